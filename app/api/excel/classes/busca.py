@@ -0,0 +1,152 @@
+from typing import Any, Dict, List, Tuple
+from sqlalchemy import Engine, Integer, column, select, table, text
+from sqlalchemy.exc import OperationalError
+
+'''
+Índices de texto das colunas declaradas nos models com info={"busca_texto": True}, usados nos critérios com curinga (*texto*, *texto, texto*).
+- SQLite: tabela virtual FTS5 com tokenizador trigram ("<tabela>_fts"), mantida por triggers de insert/update/delete,
+  então qualquer gravação (atualizar, upsert, remover) atualiza o índice na mesma transação.
+  O índice guarda a chave primária da tabela (coluna UNINDEXED "chave") e os critérios com curinga são reescritos para
+  "<pk> IN (SELECT chave FROM <tabela>_fts WHERE coluna LIKE ...)", nunca pelo rowid implícito da tabela, que o VACUUM
+  pode renumerar em tabelas sem chave inteira (ex.: OrdensCompra, chave texto).
+  O rowid do FTS é a própria chave quando ela é inteira; nas demais chaves vem de "<tabela>_fts_chaves" (chave -> inteiro estável),
+  usado pelos triggers para remover a linha do índice sem varrer o FTS.
+- PostgreSQL: índice GIN com gin_trgm_ops (extensão pg_trgm), usado pelo próprio ILIKE sem reescrever a consulta.
+O trigram só usa o índice com pelo menos 3 caracteres entre os curingas, valores menores seguem com o LIKE na tabela (criterios.TAMANHO_MINIMO).
+Somente tabelas com chave primária de uma coluna recebem o índice.
+'''
+
+#Coluna do FTS com a chave primária da tabela
+CHAVE = "chave"
+
+class IndiceTexto:
+    def __init__(self, engine: Engine, base):
+        self._engine = engine
+        self._dialeto = engine.dialect.name
+        self._preparador = engine.dialect.identifier_preparer
+        #Colunas declaradas por tabela e a chave primária (nome, se é inteira) de cada uma
+        self._colunas: Dict[str, List[str]] = {}
+        self._chaves: Dict[str, Tuple[str, bool]] = {}
+        for nome_tabela, tabela_sql in base.metadata.tables.items():
+            colunas = [c.name for c in tabela_sql.columns if c.info.get("busca_texto")]
+            primarias = list(tabela_sql.primary_key.columns)
+            if colunas and len(primarias) == 1:
+                self._colunas[nome_tabela] = colunas
+                self._chaves[nome_tabela] = (primarias[0].name, isinstance(primarias[0].type, Integer))
+        #Tabelas com o índice FTS5 pronto para reescrever os critérios (somente SQLite)
+        self._ativas = set()
+        if self._dialeto == "sqlite" and self._colunas:
+            with self._engine.begin() as conexao:
+                for tabela in self._colunas:
+                    if not self._existe_sqlite(conexao, tabela) and self._existe_fts(conexao, tabela):
+                        #Índice no formato anterior (conteúdo externo pelo rowid implícito): recria com a chave primária
+                        self._criar_sqlite(conexao, tabela)
+                    if self._existe_sqlite(conexao, tabela):
+                        self._ativas.add(tabela)
+
+    @property
+    def colunas(self) -> Dict[str, List[str]]:
+        return {t: list(c) for t, c in self._colunas.items()}
+
+    def possui(self, tabela: str, coluna: str) -> bool:
+        '''
+        Se os critérios com curinga da coluna devem ser reescritos para o índice (FTS5 no SQLite).
+        '''
+        return tabela in self._ativas and coluna in self._colunas[tabela]
+
+    def condicao(self, tabela_sql: Any, coluna: str, padrao: Any) -> Any:
+        '''
+        Condição equivalente ao coluna ILIKE padrao usando a tabela FTS5 da tabela (junção pela chave primária).
+        '''
+        fts = table(f"{tabela_sql.name}_fts", column(CHAVE), *[column(c) for c in self._colunas[tabela_sql.name]])
+        return tabela_sql.c[self._chaves[tabela_sql.name][0]].in_(select(fts.c[CHAVE]).where(fts.c[coluna].like(padrao)))
+
+    def criar(self):
+        '''
+        Cria (ou recria após a tabela ser apagada e criada de novo) os índices das colunas declaradas, chamado pelo Db.criar_tabelas.
+        '''
+        if self._dialeto == "sqlite":
+            with self._engine.begin() as conexao:
+                if not self._colunas or not self._fts5_disponivel(conexao):
+                    return
+                for tabela in self._colunas:
+                    if not self._existe_sqlite(conexao, tabela):
+                        self._criar_sqlite(conexao, tabela)
+                    self._ativas.add(tabela)
+        elif self._dialeto == "postgresql":
+            with self._engine.begin() as conexao:
+                conexao.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for tabela, colunas in self._colunas.items():
+                    for coluna in colunas:
+                        indice = self._preparador.quote(f"ix_{tabela}_{coluna}_trgm")
+                        conexao.execute(text(f"CREATE INDEX IF NOT EXISTS {indice} ON {self._preparador.quote(tabela)} USING gin ({self._preparador.quote(coluna)} gin_trgm_ops)"))
+
+    @staticmethod
+    def _fts5_disponivel(conexao) -> bool:
+        #SQLite sem FTS5 ou anterior ao 3.34 (sem o tokenizador trigram): segue sem o índice, com o LIKE na tabela
+        try:
+            conexao.exec_driver_sql("CREATE VIRTUAL TABLE temp.teste_fts5 USING fts5(a, tokenize='trigram')")
+            conexao.exec_driver_sql("DROP TABLE temp.teste_fts5")
+            return True
+        except OperationalError:
+            return False
+
+    @staticmethod
+    def _existe_fts(conexao, tabela: str) -> bool:
+        return conexao.execute(text("SELECT count(*) FROM sqlite_master WHERE name = :nome"), {"nome": f"{tabela}_fts"}).scalar_one() > 0
+
+    def _existe_sqlite(self, conexao, tabela: str) -> bool:
+        #A tabela FTS com a coluna da chave, os 3 triggers (somem quando a tabela é apagada) e a tabela de chaves das chaves não inteiras
+        nomes = [f"{tabela}_fts", f"{tabela}_fts_ai", f"{tabela}_fts_ad", f"{tabela}_fts_au"]
+        if not self._chaves[tabela][1]:
+            nomes.append(f"{tabela}_fts_chaves")
+        parametros = {f"n{i}": nome for i, nome in enumerate(nomes)}
+        encontrados = conexao.execute(
+            text(f"SELECT count(*) FROM sqlite_master WHERE name IN ({', '.join(':' + p for p in parametros)})"), parametros
+        ).scalar_one()
+        if encontrados != len(nomes):
+            return False
+        return conexao.execute(text("SELECT count(*) FROM pragma_table_info(:fts) WHERE name = :chave"), {"fts": f"{tabela}_fts", "chave": CHAVE}).scalar_one() == 1
+
+    def _criar_sqlite(self, conexao, tabela: str):
+        q = self._preparador.quote
+        fts = q(f"{tabela}_fts")
+        chaves = q(f"{tabela}_fts_chaves")
+        gatilhos = [q(f"{tabela}_fts_{sufixo}") for sufixo in ("ai", "ad", "au")]
+        pk, inteira = self._chaves[tabela]
+        pk = q(pk)
+        colunas = ", ".join(q(c) for c in self._colunas[tabela])
+        novos = ", ".join(f"new.{q(c)}" for c in self._colunas[tabela])
+        #rowid do FTS: a própria chave inteira ou o inteiro estável da tabela de chaves
+        if inteira:
+            rowid_novo, rowid_antigo = f"new.{pk}", f"old.{pk}"
+            incluir_chave = remover_chave = alterar_chave = ""
+            indexar = f"INSERT INTO {fts}(rowid, {CHAVE}, {colunas}) SELECT {pk}, {pk}, {colunas} FROM {q(tabela)}"
+        else:
+            rowid_novo = f"(SELECT id FROM {chaves} WHERE chave = new.{pk})"
+            rowid_antigo = f"(SELECT id FROM {chaves} WHERE chave = old.{pk})"
+            incluir_chave = f"INSERT INTO {chaves}(chave) VALUES (new.{pk}); "
+            remover_chave = f"DELETE FROM {chaves} WHERE chave = old.{pk}; "
+            alterar_chave = f"UPDATE {chaves} SET chave = new.{pk} WHERE chave = old.{pk} AND new.{pk} IS NOT old.{pk}; "
+            indexar = (f"INSERT INTO {fts}(rowid, {CHAVE}, {colunas}) SELECT c.id, t.{pk}, " + ", ".join(f"t.{q(c)}" for c in self._colunas[tabela])
+                       + f" FROM {q(tabela)} t JOIN {chaves} c ON c.chave = t.{pk}")
+        instrucoes = [f"DROP TRIGGER IF EXISTS {gatilho}" for gatilho in gatilhos] + [f"DROP TABLE IF EXISTS {fts}", f"DROP TABLE IF EXISTS {chaves}"]
+        if not inteira:
+            instrucoes.append(f"CREATE TABLE {chaves} (id INTEGER PRIMARY KEY, chave UNIQUE NOT NULL)")
+        instrucoes += [
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({CHAVE} UNINDEXED, {colunas}, tokenize='trigram')",
+            f"CREATE TRIGGER {gatilhos[0]} AFTER INSERT ON {q(tabela)} BEGIN "
+            f"{incluir_chave}INSERT INTO {fts}(rowid, {CHAVE}, {colunas}) VALUES ({rowid_novo}, new.{pk}, {novos}); END",
+            f"CREATE TRIGGER {gatilhos[1]} AFTER DELETE ON {q(tabela)} BEGIN "
+            f"DELETE FROM {fts} WHERE rowid = {rowid_antigo}; {remover_chave}END",
+            #Só as alterações da chave ou das colunas indexadas mexem no índice
+            f"CREATE TRIGGER {gatilhos[2]} AFTER UPDATE OF {pk}, {colunas} ON {q(tabela)} BEGIN "
+            f"DELETE FROM {fts} WHERE rowid = {rowid_antigo}; {alterar_chave}"
+            f"INSERT INTO {fts}(rowid, {CHAVE}, {colunas}) VALUES ({rowid_novo}, new.{pk}, {novos}); END",
+        ]
+        #Indexa as linhas que já existem na tabela
+        if not inteira:
+            instrucoes.append(f"INSERT INTO {chaves}(chave) SELECT {pk} FROM {q(tabela)}")
+        instrucoes.append(indexar)
+        for instrucao in instrucoes:
+            conexao.exec_driver_sql(instrucao)
@@ -0,0 +1,207 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, TypedDict
+import copy
+import json
+import sys
+import threading
+import time
+
+#Tipagem
+class EstatisticasCacheDict(TypedDict):
+    itens: int
+    bytes: int
+    max_itens: int
+    max_bytes: int
+    ttl_s: float
+    acertos: int
+    falhas: int
+    despejos: int
+    expirados: int
+    invalidados: int
+
+#Tipos de valor copiados em profundidade nos acertos, os demais (números, textos, datas...) são imutáveis
+_MUTAVEIS = (dict, list, set, bytearray)
+
+def _copiar(linha) -> List[Any]:
+    return [copy.deepcopy(valor) if isinstance(valor, _MUTAVEIS) else valor for valor in linha]
+
+class _Entrada:
+    __slots__ = ("linhas", "tamanho", "criado_em", "versoes")
+
+    def __init__(self, linhas: List[Tuple[Any, ...]], tamanho: int, versoes: Dict[str, int]):
+        self.linhas = linhas
+        self.tamanho = tamanho
+        self.criado_em = time.monotonic()
+        self.versoes = versoes
+
+class CacheConsultas:
+    '''
+    Cache LRU em memória dos resultados do Db.consultar_base.
+    - Chave: forma normalizada da consulta (colunas, tabelas, critérios, relações...).
+    - Despejo: LRU por quantidade de itens e por tamanho aproximado em bytes, além de TTL.
+    - Invalidação: cada tabela tem um contador de versão incrementado pelo Db.atualizar/remover,
+      uma entrada só é válida se as versões das suas tabelas não mudaram desde a leitura.
+    O cache e as versões ficam na memória do processo: gravações feitas por outro processo (outro worker do uvicorn/gunicorn,
+    jobs de outra instância, acesso direto ao banco) não invalidam as entradas daqui. Só é seguro com um único worker
+    gravando no banco, por isso o Db o deixa desligado por padrão (DB_CACHE_MAX_ITENS=0).
+    Os valores mutáveis (ex.: colunas JSON) são copiados em profundidade ao guardar e a cada acerto, as linhas devolvidas são novas listas.
+    '''
+    def __init__(self, max_itens: int = 256, max_bytes: int = 64 * 1024 * 1024, ttl: float = 30.0):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._versoes: Dict[str, int] = {}
+        self._bytes = 0
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.despejos = 0
+        self.expirados = 0
+        self.invalidados = 0
+
+    @property
+    def ativo(self) -> bool:
+        return self.max_itens > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def chave(**consulta: Any) -> str:
+        return json.dumps(consulta, sort_keys=True, default=str, ensure_ascii=False)
+
+    @staticmethod
+    def tamanho_estimado(linhas: List[List[Any]]) -> int:
+        return sys.getsizeof(linhas) + sum(sys.getsizeof(linha) + sum(sys.getsizeof(valor) for valor in linha) for linha in linhas)
+
+    def versoes(self, tabelas: Iterable[str]) -> Dict[str, int]:
+        '''
+        Retorna a versão atual de cada tabela, deve ser chamado antes de executar a consulta que será guardada.
+        '''
+        with self._trava:
+            return {tabela: self._versoes.get(tabela, 0) for tabela in set(tabelas)}
+
+    def obter(self, chave: str) -> Optional[List[List[Any]]]:
+        with self._trava:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.falhas += 1
+                return None
+            if self.ttl and time.monotonic() - entrada.criado_em > self.ttl:
+                self._remover(chave)
+                self.expirados += 1
+                self.falhas += 1
+                return None
+            if any(self._versoes.get(tabela, 0) != versao for tabela, versao in entrada.versoes.items()):
+                self._remover(chave)
+                self.invalidados += 1
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            linhas = entrada.linhas
+        #Devolve uma cópia para que o chamador não altere o conteúdo guardado (inclusive dicts/listas das colunas JSON)
+        return [_copiar(linha) for linha in linhas]
+
+    def guardar(self, chave: str, linhas: List[List[Any]], versoes: Dict[str, int]):
+        if not self.ativo:
+            return
+        tamanho = self.tamanho_estimado(linhas)
+        if tamanho > self.max_bytes:
+            return
+        #O chamador recebe as mesmas linhas, os valores mutáveis guardados são cópias
+        entrada = _Entrada([tuple(_copiar(linha)) for linha in linhas], tamanho, versoes)
+        with self._trava:
+            #Alguma tabela mudou durante a consulta, o resultado já nasce desatualizado
+            if any(self._versoes.get(tabela, 0) != versao for tabela, versao in versoes.items()):
+                return
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = entrada
+            self._bytes += tamanho
+            while len(self._entradas) > self.max_itens or self._bytes > self.max_bytes:
+                self._remover(next(iter(self._entradas)))
+                self.despejos += 1
+
+    def invalidar(self, tabela: str):
+        '''
+        Incrementa a versão da tabela, tornando inválidas todas as entradas que a utilizam.
+        '''
+        with self._trava:
+            self._versoes[tabela] = self._versoes.get(tabela, 0) + 1
+
+    def limpar(self):
+        with self._trava:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def _remover(self, chave: str):
+        entrada = self._entradas.pop(chave)
+        self._bytes -= entrada.tamanho
+
+    def estatisticas(self) -> EstatisticasCacheDict:
+        with self._trava:
+            return {
+                "itens": len(self._entradas),
+                "bytes": self._bytes,
+                "max_itens": self.max_itens,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "despejos": self.despejos,
+                "expirados": self.expirados,
+                "invalidados": self.invalidados,
+            }
+
+class EstatisticasFormasDict(TypedDict):
+    itens: int
+    max_itens: int
+    acertos: int
+    falhas: int
+    despejos: int
+    taxa_acertos: float
+
+class CacheFormas:
+    '''
+    Cache LRU dos selects montados pelo Db, por forma da consulta (colunas, tabelas, relações e estrutura dos critérios).
+    Os valores dos critérios ficam em parâmetros (bindparam), então consultas com a mesma forma reaproveitam o select
+    e o SQLAlchemy reaproveita a compilação.
+    '''
+    def __init__(self, max_itens: int = 512):
+        self.max_itens = max_itens
+        self._entradas: "OrderedDict[Any, Any]" = OrderedDict()
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.despejos = 0
+
+    def obter(self, forma: Any) -> Optional[Any]:
+        with self._trava:
+            valor = self._entradas.get(forma)
+            if valor is None:
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(forma)
+            self.acertos += 1
+            return valor
+
+    def guardar(self, forma: Any, valor: Any):
+        if self.max_itens <= 0:
+            return
+        with self._trava:
+            self._entradas[forma] = valor
+            self._entradas.move_to_end(forma)
+            while len(self._entradas) > self.max_itens:
+                self._entradas.popitem(last=False)
+                self.despejos += 1
+
+    def estatisticas(self) -> EstatisticasFormasDict:
+        with self._trava:
+            total = self.acertos + self.falhas
+            return {
+                "itens": len(self._entradas),
+                "max_itens": self.max_itens,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "despejos": self.despejos,
+                "taxa_acertos": self.acertos / total if total else 0.0,
+            }
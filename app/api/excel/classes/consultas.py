@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+import threading
+
+#Tipagem
+class UsoColunaDict(TypedDict):
+    tabela: str
+    coluna: str
+    filtros: int
+    relacoes: int
+    agrupamentos: int
+    ordenacoes: int
+
+class FormaConsultaDict(TypedDict):
+    tabelas: List[str]
+    filtros: List[str]
+    relacoes: List[str]
+    execucoes: int
+    linhas: int
+    tempo_total_ms: float
+    tempo_medio_ms: float
+    tempo_maximo_ms: float
+
+# Operadores dos critérios que um índice B-tree atende (os curingas ficam com o índice de texto)
+OPERADORES_INDEXAVEIS = ("=", "in", "between", ">", ">=", "<", "<=", "nulo")
+
+class _Forma:
+    __slots__ = ("stmt", "parametros", "tabelas", "filtros", "relacoes", "agrupamentos", "ordenacoes", "execucoes", "linhas", "tempo_total", "tempo_maximo")
+
+    def __init__(self, stmt: Any, forma: Tuple[Any, ...]):
+        colunas, tabelas, relacoes, forma_criterios, forma_agregacao = forma
+        self.stmt = stmt
+        self.parametros = {}
+        self.tabelas = sorted(set(tabelas))
+        #Colunas usadas em filtros (com o operador), relações, agrupamentos e ordenações
+        self.filtros = list(dict.fromkeys(
+            (p.tabela, p.coluna, p.operador) for linha in forma_criterios for celula in linha for p in celula
+        ))
+        self.relacoes = list(dict.fromkeys(c for a, b, coluna_a, coluna_b, _ in relacoes for c in ((a, coluna_a), (b, coluna_b))))
+        agregacoes, ordenacao, _ = forma_agregacao or ((), (), None)
+        self.agrupamentos = [(t, c) for t, c, a in zip(tabelas, colunas, agregacoes) if not a] if any(agregacoes) else []
+        self.ordenacoes = [(t, c) for t, c, o in zip(tabelas, colunas, ordenacao) if o]
+        self.execucoes = 0
+        self.linhas = 0
+        self.tempo_total = 0.0
+        self.tempo_maximo = 0.0
+
+    def resumo(self) -> FormaConsultaDict:
+        return {
+            "tabelas": self.tabelas,
+            "filtros": [f"{t}.{c} {o}" for t, c, o in self.filtros],
+            "relacoes": [f"{t}.{c}" for t, c in self.relacoes],
+            "execucoes": self.execucoes,
+            "linhas": self.linhas,
+            "tempo_total_ms": round(self.tempo_total * 1000, 3),
+            "tempo_medio_ms": round(self.tempo_total * 1000 / self.execucoes, 3) if self.execucoes else 0.0,
+            "tempo_maximo_ms": round(self.tempo_maximo * 1000, 3),
+        }
+
+class RegistroConsultas:
+    '''
+    Estatísticas das consultas do Db por forma (mesma chave do cache de formas): execuções, linhas e tempos,
+    além do uso de cada coluna em filtros, relações, agrupamentos e ordenações. Base do assessor de índices (classes/indices.py).
+    Guarda até max_formas formas (LRU), max_formas=0 desativa.
+    '''
+    def __init__(self, max_formas: int = 256):
+        self.max_formas = max_formas
+        self._formas: "OrderedDict[Tuple[Any, ...], _Forma]" = OrderedDict()
+        self._colunas: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._trava = threading.Lock()
+
+    @property
+    def ativo(self) -> bool:
+        return self.max_formas > 0
+
+    def registrar(self, forma: Tuple[Any, ...], stmt: Any, parametros: Dict[str, Any], duracao: float, linhas: int):
+        if not self.ativo:
+            return
+        with self._trava:
+            entrada = self._formas.get(forma)
+            if entrada is None:
+                entrada = self._formas[forma] = _Forma(stmt, forma)
+                while len(self._formas) > self.max_formas:
+                    self._formas.popitem(last=False)
+            else:
+                self._formas.move_to_end(forma)
+            #Parâmetros da execução mais lenta, usados no EXPLAIN
+            if duracao >= entrada.tempo_maximo:
+                entrada.stmt = stmt
+                entrada.parametros = parametros
+                entrada.tempo_maximo = duracao
+            entrada.execucoes += 1
+            entrada.linhas += linhas
+            entrada.tempo_total += duracao
+
+            for uso, colunas in (
+                ("filtros", [(t, c) for t, c, _ in entrada.filtros]),
+                ("relacoes", entrada.relacoes),
+                ("agrupamentos", entrada.agrupamentos),
+                ("ordenacoes", entrada.ordenacoes),
+            ):
+                for chave in colunas:
+                    contadores = self._colunas.setdefault(chave, {"filtros": 0, "relacoes": 0, "agrupamentos": 0, "ordenacoes": 0})
+                    contadores[uso] += 1
+
+    def colunas(self) -> List[UsoColunaDict]:
+        '''
+        Uso de cada coluna, das mais usadas para as menos usadas.
+        '''
+        with self._trava:
+            uso = [{"tabela": t, "coluna": c, **contadores} for (t, c), contadores in self._colunas.items()]
+        return sorted(uso, key=lambda u: -(u["filtros"] + u["relacoes"] + u["agrupamentos"] + u["ordenacoes"]))
+
+    def formas(self, limite: Optional[int] = None) -> List[FormaConsultaDict]:
+        '''
+        Formas de consulta ordenadas pelo tempo total (as que mais pesam no banco primeiro).
+        '''
+        return [entrada.resumo() for entrada in self.mais_lentas(limite)]
+
+    def mais_lentas(self, limite: Optional[int] = None) -> List[_Forma]:
+        with self._trava:
+            entradas = sorted(self._formas.values(), key=lambda e: -e.tempo_total)
+        return entradas[:limite] if limite else entradas
+
+    def limpar(self):
+        with self._trava:
+            self._formas.clear()
+            self._colunas.clear()
@@ -0,0 +1,187 @@
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, List, Literal, Optional, TypedDict
+import logging
+import threading
+import time
+
+from sqlalchemy import Engine, event
+
+#Imports internos
+from app.api.excel.classes.metricas import Metricas, rota_atual
+
+#Tipagem
+class ConsultaLentaDict(TypedDict):
+    instante: str
+    duracao_ms: float
+    instrucao: str
+    parametros: Any
+    linhas: Optional[int]
+    rota: Optional[str]
+    plano: List[str]
+    erro: Optional[str] # mensagem do erro quando a instrução falhou
+
+# Como os parâmetros aparecem no registro: completos, só o tipo (e tamanho dos textos) ou omitidos
+ModoParametros = Literal[
+    "completos",
+    "tipos",
+    "ocultos",
+]
+
+# Instruções que aceitam EXPLAIN sem executar (no PostgreSQL o EXPLAIN sem ANALYZE também não executa)
+_INSTRUCOES_EXPLICAVEIS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+'''
+Log de consultas lentas do engine do Db: instruções com duração acima do limite (DB_CONSULTA_LENTA_MS) são guardadas
+em um buffer circular (DB_CONSULTA_LENTA_MAX) com os parâmetros (DB_CONSULTA_LENTA_PARAMETROS), duração, linhas, rota de origem
+e o plano (EXPLAIN QUERY PLAN no SQLite, EXPLAIN nos demais), capturado na hora na mesma conexão.
+Instruções que falham (evento handle_error) também entram, com o erro e sem o plano.
+Também registra no log "app.db.consultas_lentas" e alimenta o histograma excel_sql_segundos e o contador excel_sql_erros_total das métricas.
+Consultado em GET /api/excel/obter_consultas_lentas.
+'''
+
+def _resumir_parametros(parametros: Any, modo: ModoParametros, max_itens: int = 50, max_texto: int = 200) -> Any:
+    if modo == "ocultos" or parametros is None:
+        return None
+    #executemany: lista de conjuntos de parâmetros, guarda o primeiro e a quantidade
+    if isinstance(parametros, list):
+        return {"conjuntos": len(parametros), "primeiro": _resumir_parametros(parametros[0], modo, max_itens, max_texto) if parametros else None}
+
+    def resumir(valor: Any) -> Any:
+        if modo == "tipos":
+            return f"{type(valor).__name__}({len(valor)})" if isinstance(valor, (str, bytes)) else type(valor).__name__
+        if isinstance(valor, str) and len(valor) > max_texto:
+            return valor[:max_texto] + "..."
+        if isinstance(valor, (str, int, float, bool)) or valor is None:
+            return valor
+        return str(valor)[:max_texto]
+
+    if isinstance(parametros, dict):
+        itens = list(parametros.items())
+        resumo = {chave: resumir(valor) for chave, valor in itens[:max_itens]}
+        if len(itens) > max_itens:
+            resumo["..."] = f"mais {len(itens) - max_itens} parâmetros"
+        return resumo
+    itens = list(parametros)
+    resumo = [resumir(valor) for valor in itens[:max_itens]]
+    if len(itens) > max_itens:
+        resumo.append(f"... mais {len(itens) - max_itens} parâmetros")
+    return resumo
+
+class RegistroConsultasLentas:
+    def __init__(self, engine: Engine, limite_ms: float, max_itens: int = 100, modo_parametros: ModoParametros = "tipos", explicar: bool = True):
+        if modo_parametros not in ("completos", "tipos", "ocultos"):
+            raise ValueError(f"Modo de parâmetros '{modo_parametros}' inválido. Use 'completos', 'tipos' ou 'ocultos'.")
+        self._engine = engine
+        self._dialeto = engine.dialect.name
+        self.limite_ms = limite_ms
+        self.modo_parametros = modo_parametros
+        self.explicar = explicar
+        self._itens: "deque[ConsultaLentaDict]" = deque(maxlen=max(1, max_itens))
+        self._trava = threading.Lock()
+        self._logger = logging.getLogger("app.db.consultas_lentas")
+        self._metricas = Metricas()
+        event.listen(engine, "before_cursor_execute", self._antes)
+        event.listen(engine, "after_cursor_execute", self._depois)
+        event.listen(engine, "handle_error", self._erro)
+
+    def _antes(self, conexao, cursor, instrucao, parametros, contexto, executemany):
+        #A anotação de linhas vale apenas para a última instrução da conexão
+        conexao.info.pop("ultima_consulta_lenta", None)
+        conexao.info.setdefault("inicios_sql", []).append(time.perf_counter())
+
+    def _depois(self, conexao, cursor, instrucao, parametros, contexto, executemany):
+        duracao = time.perf_counter() - conexao.info["inicios_sql"].pop()
+        self._registrar(conexao, cursor, instrucao, parametros, executemany, duracao)
+
+    def _erro(self, contexto):
+        #Instrução que falhou: o after_cursor_execute não é chamado, o início é retirado aqui
+        #Sem contexto de execução o erro aconteceu antes do before_cursor_execute (ex.: ao montar a execução), não há início a retirar
+        conexao = contexto.connection
+        execucao = contexto.execution_context
+        if conexao is None or execucao is None or not conexao.info.get("inicios_sql"):
+            return
+        duracao = time.perf_counter() - conexao.info["inicios_sql"].pop()
+        self._registrar(conexao, execucao.cursor, contexto.statement or "", contexto.parameters, execucao.executemany, duracao, contexto.original_exception)
+
+    def _registrar(self, conexao, cursor, instrucao: str, parametros: Any, executemany: bool, duracao: float, erro: Optional[BaseException] = None):
+        tipo = instrucao.split(None, 1)[0].upper() if instrucao.strip() else ""
+        self._metricas.observar("excel_sql_segundos", "Tempo das instruções SQL por tipo", duracao, instrucao=tipo)
+        if erro is not None:
+            self._metricas.incrementar("excel_sql_erros_total", "Instruções SQL que falharam por tipo", instrucao=tipo)
+        if self.limite_ms < 0 or duracao * 1000 < self.limite_ms:
+            return
+
+        entrada: ConsultaLentaDict = {
+            "instante": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "duracao_ms": round(duracao * 1000, 3),
+            "instrucao": instrucao,
+            "parametros": _resumir_parametros(parametros, self.modo_parametros),
+            #SELECT e RETURNING ainda não foram lidos aqui, o Db completa com anotar_linhas após ler o resultado
+            "linhas": cursor.rowcount if erro is None and tipo in ("INSERT", "UPDATE", "DELETE") and "RETURNING" not in instrucao.upper() and (cursor.rowcount or 0) >= 0 else None,
+            "rota": rota_atual(),
+            #Após um erro a transação pode estar abortada (PostgreSQL), o plano não é capturado
+            "plano": self._plano(conexao, tipo, instrucao, parametros[0] if executemany and parametros else parametros) if self.explicar and erro is None else [],
+            "erro": f"{type(erro).__name__}: {erro}" if erro is not None else None,
+        }
+        with self._trava:
+            self._itens.append(entrada)
+        if erro is not None:
+            self._logger.warning("Consulta lenta com erro (%.1f ms, rota %s): %s: %s", entrada["duracao_ms"], entrada["rota"], instrucao, entrada["erro"])
+            return
+        conexao.info["ultima_consulta_lenta"] = entrada
+        self._logger.warning("Consulta lenta (%.1f ms, rota %s): %s", entrada["duracao_ms"], entrada["rota"], instrucao)
+
+    def _plano(self, conexao, tipo: str, instrucao: str, parametros: Any) -> List[str]:
+        if tipo not in _INSTRUCOES_EXPLICAVEIS:
+            return []
+        prefixo = "EXPLAIN QUERY PLAN " if self._dialeto == "sqlite" else "EXPLAIN "
+        #Cursor próprio da conexão DBAPI: não passa pelos eventos nem altera o cursor da instrução original
+        #Fora do SQLite um erro no EXPLAIN invalidaria a transação em andamento, por isso roda dentro de um savepoint
+        protegido = self._dialeto != "sqlite"
+        cursor = conexao.connection.dbapi_connection.cursor()
+        try:
+            if protegido:
+                cursor.execute("SAVEPOINT plano_consulta_lenta")
+            cursor.execute(prefixo + instrucao, parametros if parametros is not None else ())
+            #SQLite: (id, pai, não usado, detalhe), demais: uma coluna com o texto
+            plano = [str(linha[-1]) for linha in cursor.fetchall()]
+            if protegido:
+                cursor.execute("RELEASE SAVEPOINT plano_consulta_lenta")
+            return plano
+        except Exception as e:
+            if protegido:
+                try:
+                    cursor.execute("ROLLBACK TO SAVEPOINT plano_consulta_lenta")
+                except Exception:
+                    pass
+            return [f"Não foi possível obter o plano: {e}"]
+        finally:
+            cursor.close()
+
+    def anotar_linhas(self, conexao, linhas: int):
+        '''
+        Completa a quantidade de linhas da última consulta lenta da conexão (SELECT só tem a quantidade depois de lido).
+        '''
+        entrada = conexao.info.pop("ultima_consulta_lenta", None)
+        if entrada is not None and entrada["linhas"] is None:
+            entrada["linhas"] = linhas
+
+    def consultas(self, limite: Optional[int] = None, rota: Optional[str] = None) -> List[ConsultaLentaDict]:
+        '''
+        Consultas lentas registradas, das mais recentes para as mais antigas, opcionalmente filtradas pela rota (trecho do texto).
+        '''
+        with self._trava:
+            itens = list(reversed(self._itens))
+        if rota:
+            itens = [item for item in itens if item["rota"] and rota in item["rota"]]
+        return itens[:limite] if limite else itens
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+
+    def remover_eventos(self):
+        event.remove(self._engine, "before_cursor_execute", self._antes)
+        event.remove(self._engine, "after_cursor_execute", self._depois)
+        event.remove(self._engine, "handle_error", self._erro)
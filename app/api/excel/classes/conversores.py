@@ -0,0 +1,152 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict
+import json
+
+from sqlalchemy import types
+
+#Tipagem
+Conversor = Callable[[Any], Any]
+
+'''
+Conversores de valores vindos do Excel para o tipo Python de cada coluna.
+Cada conversor recebe um valor e devolve o valor convertido, ou o próprio valor quando a conversão não é possível.
+Nas colunas que não são texto a célula em branco (texto vazio ou só espaços) vira None, como a célula vazia.
+'''
+
+def _em_branco(valor: Any) -> bool:
+    return isinstance(valor, str) and valor.strip() == ""
+
+def converter_identidade(valor: Any) -> Any:
+    return valor
+
+def converter_json(valor: Any) -> Any:
+    if valor is None or isinstance(valor, (list, dict)):
+        return valor
+    try:
+        return json.loads(valor)
+    except Exception:
+        return None if _em_branco(valor) else valor
+
+def converter_inteiro(valor: Any) -> Any:
+    if valor is None:
+        return None
+    try:
+        return int(valor)
+    except Exception:
+        #Texto em branco só é testado quando a conversão falha (o caminho comum não paga a verificação)
+        return None if _em_branco(valor) else valor
+
+def converter_decimal(valor: Any) -> Any:
+    if valor is None:
+        return None
+    try:
+        return float(valor)
+    except Exception:
+        return None if _em_branco(valor) else valor
+
+def converter_booleano(valor: Any) -> Any:
+    if valor is None:
+        return None
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, (int, float)):
+        return valor != 0
+    if isinstance(valor, str):
+        texto = valor.strip().lower()
+        return texto in ["true", "1", "yes", "y", "sim", "s"] if texto else None
+    return False
+
+def converter_data(valor: Any) -> Any:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        try:
+            return datetime.strptime(valor, "%Y-%m-%d").date()
+        except Exception:
+            return None if _em_branco(valor) else valor
+    return valor
+
+def converter_hora(valor: Any) -> Any:
+    if isinstance(valor, datetime):
+        return valor.time()
+    if isinstance(valor, str):
+        try:
+            return datetime.strptime(valor, "%H:%M:%S").time()
+        except Exception:
+            return None if _em_branco(valor) else valor
+    return valor
+
+def converter_data_hora(valor: Any) -> Any:
+    if isinstance(valor, datetime):
+        return valor
+    if isinstance(valor, str):
+        try:
+            return datetime.strptime(valor, "%Y-%m-%d %H:%M:%S")
+        except Exception:
+            return None if _em_branco(valor) else valor
+    return valor
+
+class ConversorComPadrao:
+    '''
+    Conversor do atualizar para colunas NOT NULL com valor padrão escalar (ex.: Boolean com default=False):
+    a célula vazia (None após a conversão) recebe o padrão, tanto na inclusão quanto na alteração.
+    Classe (e não closure) para poder ser enviada aos processos da conversão paralela.
+    '''
+    __slots__ = ("conversor", "padrao")
+
+    def __init__(self, conversor: Conversor, padrao: Any):
+        self.conversor = conversor
+        self.padrao = padrao
+
+    def __call__(self, valor: Any) -> Any:
+        convertido = self.conversor(valor)
+        return self.padrao if convertido is None else convertido
+
+# Conversor por python_type do tipo SQLAlchemy (busca exata: bool não cai em int e datetime não cai em date)
+CONVERSORES_POR_PYTHON_TYPE: Dict[type, Conversor] = {
+    int: converter_inteiro,
+    float: converter_decimal,
+    Decimal: converter_decimal,
+    bool: converter_booleano,
+    date: converter_data,
+    time: converter_hora,
+    datetime: converter_data_hora,
+    dict: converter_json,
+    list: converter_json,
+}
+
+def conversor_para_tipo(tipo_coluna: types.TypeEngine) -> Conversor:
+    '''
+    Resolve o conversor de um tipo de coluna SQLAlchemy a partir do seu python_type.
+    Tipos sem python_type (ou sem conversor registrado) usam o conversor identidade.
+    '''
+    if isinstance(tipo_coluna, types.JSON):
+        return converter_json
+    try:
+        python_type = tipo_coluna.python_type
+    except NotImplementedError:
+        return converter_identidade
+    return CONVERSORES_POR_PYTHON_TYPE.get(python_type, converter_identidade)
+
+def conversor_para_texto(tipo: str) -> Conversor:
+    '''
+    Resolve o conversor a partir do nome do tipo em texto (ex.: "INTEGER", "DATETIME").
+    Usado apenas quando não há coluna SQLAlchemy disponível.
+    '''
+    tipo = tipo.lower()
+    if "json" in tipo:
+        return converter_json
+    elif "integer" in tipo:
+        return converter_inteiro
+    elif "float" in tipo or "double" in tipo or "numeric" in tipo or "real" in tipo or "decimal" in tipo:
+        return converter_decimal
+    elif "boolean" in tipo or "bool" in tipo:
+        return converter_booleano
+    elif "datetime" in tipo or "timestamp" in tipo:
+        return converter_data_hora
+    elif "date" in tipo:
+        return converter_data
+    elif "time" in tipo:
+        return converter_hora
+    return converter_identidade
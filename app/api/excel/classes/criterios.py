@@ -0,0 +1,205 @@
+from typing import Any, Callable, List, NamedTuple, Tuple
+import functools
+import itertools
+
+from sqlalchemy import and_, bindparam, or_
+
+#Imports internos
+from app.api.excel.classes.conversores import Conversor
+
+'''
+Compilador dos critérios do pesquisar (formato do Excel: primeira linha as colunas, demais linhas os critérios).
+As colunas de uma linha são E, as linhas são OU entre si e cada célula pode ter vários valores separados por ";" (OU).
+Cada valor pode começar com um operador (= <> != > >= < <=) e usar curingas * no início/fim (contém, termina com, começa com).
+
+A análise gera a forma (árvore de predicados sem os valores, usada como chave do cache de formas do Db) e a lista de valores,
+a compilação transforma a forma nas condições do select com um bindparam por valor (criterio_0, criterio_1...):
+- as igualdades de uma célula viram um IN (...), dividido em blocos conforme o limite de parâmetros do banco
+- os pares >= e <= da mesma coluna em uma linha viram BETWEEN
+- os curingas em colunas com índice de texto usam a condição do índice no lugar do ILIKE
+- "=" e "<>" vazios em colunas que não são texto (o conversor devolve None) viram IS NULL e IS NOT NULL, sem bindparam
+'''
+
+# Operadores aceitos no início de cada valor, os de dois caracteres antes dos de um
+OPERADORES = (">=", "<=", "<>", "!=", ">", "<", "=")
+
+# Caracteres mínimos do valor para o curinga usar o índice de texto (trigram)
+TAMANHO_MINIMO = 3
+
+# Operadores LIKE (curingas) e o padrão montado com o valor
+PADROES_LIKE = {
+    "**": "%{}%",
+    "*-": "%{}",
+    "-*": "{}%",
+}
+
+class Predicado(NamedTuple):
+    tabela: str
+    coluna: str
+    operador: str # "=", "!=", ">", ">=", "<", "<=", "in", "between", "nulo", "nao_nulo" ou um dos PADROES_LIKE
+    vazio: bool = False # comparação com texto vazio: "=" também aceita nulo e "!=" também exige não nulo
+    blocos: int = 0 # quantidade de blocos (bindparams) do IN
+    indice: bool = False # curinga resolvido pelo índice de texto da coluna (ver classes/busca.py)
+
+# Forma: linhas (OU) de células (E) de predicados (OU)
+FormaCriterios = Tuple[Tuple[Tuple[Predicado, ...], ...], ...]
+
+@functools.lru_cache(maxsize=4096)
+def analisar_celula(texto: str) -> Tuple[Tuple[str, str], ...]:
+    '''
+    Separa o texto de uma célula nos valores do OU (;), cada um com o seu operador.
+    Ex.: "SP;RJ" -> (("", "SP"), ("", "RJ")), ">=10;<5" -> ((">=", "10"), ("<", "5")), "*silva" -> (("*-", "silva"),)
+    '''
+    itens = []
+    for parte in texto.split(";"):
+        operador = next((op for op in OPERADORES if parte.startswith(op)), "")
+        valor = parte[len(operador):].strip()
+        if operador == "<>":
+            operador = "!="
+        #Curingas (o operador informado antes do curinga é ignorado)
+        if valor.startswith("*") and valor.endswith("*"):
+            operador, valor = "**", valor[1:-1]
+        elif valor.startswith("*"):
+            operador, valor = "*-", valor[1:]
+        elif valor.endswith("*"):
+            operador, valor = "-*", valor[:-1]
+        itens.append((operador, valor))
+    return tuple(itens)
+
+def _analisar_valores(tabela: str, coluna: str, celula: Any, conversor: Conversor, limite_in: int, indice_texto: bool = False) -> Tuple[Tuple[Predicado, ...], List[Any]]:
+    itens = analisar_celula(celula) if isinstance(celula, str) else (("", celula),)
+    igualdades = []
+    predicados = []
+    valores = []
+    for operador, valor in itens:
+        #Valor vazio sem operador não filtra
+        if operador == "" and (valor is None or valor == ""):
+            continue
+        valor_efetivo = conversor(valor)
+        vazio = isinstance(valor_efetivo, str) and valor_efetivo == ""
+        if operador in ("", "=") and not vazio and valor_efetivo is not None:
+            igualdades.append(valor_efetivo)
+        elif operador in PADROES_LIKE:
+            padrao = "" if valor_efetivo is None else str(valor_efetivo)
+            predicados.append(Predicado(tabela, coluna, operador, indice=indice_texto and len(padrao) >= TAMANHO_MINIMO))
+            valores.append(PADROES_LIKE[operador].format(padrao))
+        elif valor_efetivo is None and operador in ("=", "!="):
+            #Vazio em coluna que não é texto: só o nulo
+            predicados.append(Predicado(tabela, coluna, "nulo" if operador == "=" else "nao_nulo"))
+        else:
+            predicados.append(Predicado(tabela, coluna, operador or "=", vazio))
+            valores.append(valor_efetivo)
+
+    #Igualdades da célula em um único IN (um bindparam expandido por bloco)
+    if len(igualdades) == 1:
+        predicados.insert(0, Predicado(tabela, coluna, "="))
+        valores.insert(0, igualdades[0])
+    elif igualdades:
+        igualdades = list(dict.fromkeys(igualdades)) if all(isinstance(v, (str, int, float)) for v in igualdades) else igualdades
+        blocos = [igualdades[i:i + limite_in] for i in range(0, len(igualdades), limite_in)]
+        predicados.insert(0, Predicado(tabela, coluna, "in", blocos=len(blocos)))
+        valores[0:0] = blocos
+    return tuple(predicados), valores
+
+def _unir_faixas(celulas: List[Tuple[Tuple[Predicado, ...], List[Any]]]) -> List[Tuple[Tuple[Predicado, ...], List[Any]]]:
+    '''
+    Une ">= a" e "<= b" da mesma coluna em uma linha no predicado BETWEEN a AND b.
+    '''
+    inicios = {}
+    fins = {}
+    for pos, (predicados, _) in enumerate(celulas):
+        if len(predicados) == 1 and predicados[0].operador in (">=", "<="):
+            chave = (predicados[0].tabela, predicados[0].coluna)
+            destino = inicios if predicados[0].operador == ">=" else fins
+            destino.setdefault(chave, pos)
+    unidas = list(celulas)
+    for chave, pos_inicio in inicios.items():
+        pos_fim = fins.get(chave)
+        if pos_fim is None:
+            continue
+        primeira = min(pos_inicio, pos_fim)
+        unidas[primeira] = ((Predicado(chave[0], chave[1], "between"),), [celulas[pos_inicio][1][0], celulas[pos_fim][1][0]])
+        unidas[max(pos_inicio, pos_fim)] = None
+    return [celula for celula in unidas if celula is not None]
+
+def analisar(criterios: List[List[Any]], tabelas_criterios: List[str], conversor: Callable[[str, str], Conversor], limite_in: Callable[[str], int], indice_texto: Callable[[str, str], bool] = None) -> Tuple[FormaCriterios, List[Any]]:
+    '''
+    Analisa os critérios (primeira linha o cabeçalho) e retorna a forma e os valores, na ordem dos bindparams da compilação.
+    conversor(tabela, coluna) devolve o conversor dos valores da coluna, limite_in(tabela) a quantidade máxima de valores por bloco do IN
+    e indice_texto(tabela, coluna) se a coluna tem índice de texto para os curingas.
+    '''
+    forma = []
+    valores = []
+    if not criterios or len(criterios) <= 1:
+        return tuple(forma), valores
+
+    cabecalho = criterios[0]
+    if len(tabelas_criterios) < len(cabecalho):
+        raise ValueError("A lista de tabelas dos critérios deve ter uma tabela para cada coluna dos critérios.")
+    conversores = [conversor(tabelas_criterios[c], coluna) for c, coluna in enumerate(cabecalho)]
+    limites = [max(1, limite_in(tabela)) for tabela in tabelas_criterios[:len(cabecalho)]]
+    indices = [bool(indice_texto and indice_texto(tabelas_criterios[c], coluna)) for c, coluna in enumerate(cabecalho)]
+
+    for l, linha in enumerate(criterios[1:], start=1):
+        if len(linha) > len(cabecalho):
+            raise ValueError(f"A linha {l + 1} dos critérios tem mais colunas que o cabeçalho.")
+        celulas = []
+        for c, celula in enumerate(linha):
+            predicados, valores_celula = _analisar_valores(tabelas_criterios[c], cabecalho[c], celula, conversores[c], limites[c], indices[c])
+            if predicados:
+                celulas.append((predicados, valores_celula))
+        #Linhas sem nenhum critério não filtram
+        if not celulas:
+            continue
+        celulas = _unir_faixas(celulas)
+        forma.append(tuple(predicados for predicados, _ in celulas))
+        for _, valores_celula in celulas:
+            valores.extend(valores_celula)
+    return tuple(forma), valores
+
+def _condicao(predicado: Predicado, coluna_sql: Any, parametro: Callable[..., Any], condicao_texto: Callable[[str, str, Any], Any] = None) -> Any:
+    operador = predicado.operador
+    if predicado.indice and condicao_texto is not None:
+        return condicao_texto(predicado.tabela, predicado.coluna, parametro())
+    if operador == "in":
+        blocos = [coluna_sql.in_(parametro(expanding=True)) for _ in range(predicado.blocos)]
+        return blocos[0] if len(blocos) == 1 else or_(*blocos)
+    if operador == "between":
+        return coluna_sql.between(parametro(), parametro())
+    if operador == "nulo":
+        return coluna_sql.is_(None)
+    if operador == "nao_nulo":
+        return coluna_sql.isnot(None)
+    if operador in PADROES_LIKE:
+        return coluna_sql.ilike(parametro())
+    if operador == ">":
+        return coluna_sql > parametro()
+    if operador == ">=":
+        return coluna_sql >= parametro()
+    if operador == "<":
+        return coluna_sql < parametro()
+    if operador == "<=":
+        return coluna_sql <= parametro()
+    if operador == "!=":
+        condicao = coluna_sql != parametro()
+        return and_(condicao, coluna_sql.isnot(None)) if predicado.vazio else condicao
+    condicao = coluna_sql == parametro()
+    return or_(condicao, coluna_sql.is_(None)) if predicado.vazio else condicao
+
+def compilar(forma: FormaCriterios, coluna_sql: Callable[[str, str], Any], condicao_texto: Callable[[str, str, Any], Any] = None) -> List[Any]:
+    '''
+    Monta as condições OU (linhas) de E (células) a partir da forma, coluna_sql(tabela, coluna) devolve a coluna do SQLAlchemy
+    e condicao_texto(tabela, coluna, padrao) a condição do índice de texto para os curingas marcados com indice.
+    '''
+    posicoes = itertools.count()
+    def parametro(expanding: bool = False) -> Any:
+        return bindparam(f"criterio_{next(posicoes)}", expanding=expanding)
+
+    condicoes_or = []
+    for linha in forma:
+        condicoes_and = []
+        for celula in linha:
+            condicoes = [_condicao(predicado, coluna_sql(predicado.tabela, predicado.coluna), parametro, condicao_texto) for predicado in celula]
+            condicoes_and.append(condicoes[0] if len(condicoes) == 1 else or_(*condicoes))
+        condicoes_or.append(condicoes_and[0] if len(condicoes_and) == 1 else and_(*condicoes_and))
+    return condicoes_or
@@ -1,14 +1,40 @@
-from sqlalchemy import column, create_engine, select,insert,delete,update, and_, or_, Engine
+from sqlalchemy import column, create_engine, select,insert,delete,update, or_, cast, distinct, func, types, Engine, Select, Table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.selectable import Join
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 import os
+import sqlite3
 import importlib
 import pkgutil
 import json
-from typing import List,Dict,TypedDict,Literal,Any,Type,Optional
+import base64
+import functools
+import itertools
+import threading
+import time
+import unicodedata
+import anyio
+from contextvars import ContextVar
+from typing import List,Dict,TypedDict,Literal,Any,Type,Optional,Iterator,Tuple,Callable,AsyncIterator,TypeVar,Set
 
 #Imports internos
 from app.api.excel.classes.dbBases import Base
+from app.api.excel.classes.conversores import Conversor, ConversorComPadrao, conversor_para_tipo, conversor_para_texto
+from app.api.excel.classes.cache import CacheConsultas, CacheFormas, EstatisticasCacheDict, EstatisticasFormasDict
+from app.api.excel.classes import criterios as criterios_sql
+from app.api.excel.classes.criterios import FormaCriterios
+from app.api.excel.classes.busca import IndiceTexto
+from app.api.excel.classes.consultas import RegistroConsultas
+from app.api.excel.classes.metricas import Metricas
+from app.api.excel.classes.consultas_lentas import RegistroConsultasLentas
+from app.api.excel.classes.validacao import ErroValidacao, ValidadorTabela, ordenar_erros
+from app.api.excel.classes.lote import LoteColunar, impressoes
+from app.api.excel.classes.paralelo import ConversaoParalela
 
 #Tipagem
 class ColunaDict(TypedDict):
@@ -21,6 +47,8 @@ class ColunaDict(TypedDict):
 
 EstruturaTabela = Dict[str, Dict[str, ColunaDict]]
 
+T = TypeVar("T")
+
 # Tipos de relações SQL comuns
 tiposJoins = Literal[
     "left",
@@ -35,6 +63,91 @@ class RelacoesDict(TypedDict):
     coluna_b: str
     tipo: tiposJoins
 
+class ModeloDict(TypedDict):
+    tabela: Table
+    modelo: Optional[Type]
+    coluna_id: Optional[str]
+    conversores: Dict[str, Conversor]
+
+class EstatisticasPoolDict(TypedDict):
+    classe: str
+    tamanho: Optional[int]
+    em_uso: Optional[int]
+    disponiveis: Optional[int]
+    overflow: Optional[int]
+    checkouts: int
+    espera_total_s: float
+    espera_maxima_s: float
+
+class PaginaDict(TypedDict):
+    dados: List[List[Any]]
+    cursor: Optional[str]
+
+class AtualizacaoPreparadaDict(TypedDict):
+    tabela: str
+    lote: LoteColunar
+
+# Funções de agregação do pesquisar (por coluna), as colunas sem agregação formam o GROUP BY
+FuncaoAgregacao = Literal[
+    "soma",
+    "contar",
+    "contar_distintos",
+    "media",
+    "minimo",
+    "maximo",
+]
+
+# Estratégias de atualização (upsert) do Db.atualizar
+EstrategiaAtualizacao = Literal[
+    "auto",
+    "upsert",
+    "diff",
+]
+
+# Limite de parâmetros (bind) por instrução de cada dialeto
+# No SQLite o valor é lido em tempo de execução (SQLITE_MAX_VARIABLE_NUMBER), ver _detectar_limite_parametros
+_LIMITES_PARAMETROS_DIALETO = {
+    "sqlite": 999,
+    "postgresql": 32767,
+    "mysql": 65535,
+    "mariadb": 65535,
+    "mssql": 2100,
+    "oracle": 65535,
+}
+_LIMITE_PARAMETROS_PADRAO = 999
+_LIMITE_PARAMETROS_MAXIMO = 32767 # evita instruções gigantes mesmo quando o banco aceitaria mais
+
+# Linhas por execução do insert com insertmanyvalues, os dicionários de parâmetros são montados só para a execução atual
+_LINHAS_POR_EXECUCAO = 10000
+
+# Nomes aceitos para as agregações e ordenações (minúsculas e sem acento)
+_NOMES_AGREGACOES = {
+    "soma": "soma", "sum": "soma",
+    "contar": "contar", "count": "contar",
+    "contar_distintos": "contar_distintos", "count_distinct": "contar_distintos",
+    "media": "media", "avg": "media",
+    "minimo": "minimo", "min": "minimo",
+    "maximo": "maximo", "max": "maximo",
+}
+_FUNCOES_AGREGACOES = {
+    "soma": func.sum,
+    "contar": func.count,
+    "contar_distintos": lambda coluna: func.count(distinct(coluna)),
+    "media": func.avg,
+    "minimo": func.min,
+    "maximo": func.max,
+}
+_NOMES_ORDENACOES = {
+    "asc": "asc", "crescente": "asc",
+    "desc": "desc", "decrescente": "desc",
+}
+
+# Dialetos com INSERT ... ON CONFLICT nativo
+_INSERTS_UPSERT = {
+    "sqlite": sqlite_insert,
+    "postgresql": postgresql_insert,
+}
+
 '''
 estrutura = {
     "tabela1": {
@@ -52,7 +165,55 @@ estrutura = {
     }
 }
 '''
-#Classe de Apoio
+#Sessões abertas pelo "with Db() as session" no contexto atual (thread/tarefa), a última é a ativa
+_sessoes_contexto: ContextVar[Tuple[Session, ...]] = ContextVar("sessoes_db", default=())
+
+#Funções de Apoio
+_SEM_VALOR = object() # marcador de fonte esgotada no intercalar_ids
+
+def intercalar_ids(origens: List[Any], fontes: Dict[Any, List[Any]]) -> List[Any]:
+    '''
+    Monta a lista de ids por linha em uma única passada: cada origem com fonte consome o próximo valor da sua fonte (na ordem)
+    e as origens sem fonte ficam com o próprio valor.
+    Ex.: intercalar_ids(["A", "D", "A", ""], {"A": [10, 11]}) -> [10, "D", 11, ""]
+    Usado pelo Db.atualizar (linhas existentes e novas) e pelo Excel.atualizar (linhas A, D e vazias).
+    '''
+    iteradores = {origem: iter(valores) for origem, valores in fontes.items()}
+    resultado = []
+    try:
+        for origem in origens:
+            iterador = iteradores.get(origem)
+            resultado.append(next(iterador) if iterador is not None else origem)
+    except StopIteration:
+        raise ValueError(f"Quantidade de ids insuficiente para as linhas '{origem}'.")
+    sobras = [origem for origem, iterador in iteradores.items() if next(iterador, _SEM_VALOR) is not _SEM_VALOR]
+    if sobras:
+        raise ValueError(f"Quantidade de ids maior que a de linhas para as origens {sobras}.")
+    return resultado
+
+#Classes de Apoio
+class _PoolMedido(QueuePool):
+    '''
+    QueuePool que mede quantas conexões foram obtidas e quanto tempo se esperou por elas.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._trava_medicao = threading.Lock()
+        self.checkouts = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            espera = time.perf_counter() - inicio
+            with self._trava_medicao:
+                self.checkouts += 1
+                self.espera_total += espera
+                self.espera_maxima = max(self.espera_maxima, espera)
+
 class _Singleton(type):
     _instances = {}
     def __call__(cls, *args, **kwargs):
@@ -73,7 +234,21 @@ class Db(metaclass=_Singleton):
     @property
     def engine(self) -> Engine:
         return self._engine
-    
+
+    @property
+    def estrategia_atualizacao(self) -> EstrategiaAtualizacao:
+        return self._estrategia_atualizacao
+
+    @estrategia_atualizacao.setter
+    def estrategia_atualizacao(self, estrategia: EstrategiaAtualizacao):
+        if estrategia not in ("auto", *self._estrategias_atualizacao):
+            raise ValueError(f"Estratégia de atualização '{estrategia}' inválida. Use 'auto', " + ", ".join(f"'{e}'" for e in self._estrategias_atualizacao) + ".")
+        self._estrategia_atualizacao = estrategia
+
+    @property
+    def conversao_paralela(self) -> ConversaoParalela:
+        return self._conversao_paralela
+
     def _importar_models(self,package_name):
         package = importlib.import_module(package_name)
         for _, module_name, is_pkg in pkgutil.iter_modules(package.__path__):
@@ -95,6 +270,54 @@ class Db(metaclass=_Singleton):
                 }
         return estrutura
 
+    def _gerar_dict_conversores(self,base) -> Dict[str, Dict[str, Conversor]]:
+        conversores = {}
+        for table_name, table in base.metadata.tables.items():
+            conversores[table_name] = {column.name: conversor_para_tipo(column.type) for column in table.columns}
+        return conversores
+
+    def _gerar_dict_conversores_atualizar(self,base) -> Dict[str, Dict[str, Conversor]]:
+        '''
+        Conversores do atualizar: nas colunas NOT NULL com valor padrão escalar a célula vazia recebe o padrão (ConversorComPadrao),
+        as demais usam o conversor da coluna. Os critérios do pesquisar continuam com os conversores sem padrão.
+        '''
+        conversores = {}
+        for table_name, table in base.metadata.tables.items():
+            conversores[table_name] = {
+                column.name: ConversorComPadrao(self._conversores[table_name][column.name], column.default.arg)
+                if not column.nullable and not column.primary_key and column.default is not None and column.default.is_scalar
+                else self._conversores[table_name][column.name]
+                for column in table.columns
+            }
+        return conversores
+
+    def _gerar_dict_colunas_padrao_banco(self,base) -> Dict[str, Set[str]]:
+        '''
+        Colunas NOT NULL com valor padrão calculado (função Python ou server_default), que não pode ser aplicado na conversão:
+        a célula vazia fica fora da inclusão (o padrão é aplicado) e da alteração (o valor atual é mantido).
+        '''
+        return {
+            table_name: {
+                column.name for column in table.columns
+                if not column.nullable and not column.primary_key
+                and (column.server_default is not None or (column.default is not None and not column.default.is_scalar))
+            }
+            for table_name, table in base.metadata.tables.items()
+        }
+
+    def _gerar_dict_modelos(self,base) -> Dict[str, ModeloDict]:
+        #Classes mapeadas pela tabela, o nome da classe/módulo não precisa seguir nenhuma regra
+        classes = {mapper.local_table.name: mapper.class_ for mapper in base.registry.mappers}
+        modelos = {}
+        for table_name, table in base.metadata.tables.items():
+            modelos[table_name] = {
+                "tabela": table,
+                "modelo": classes.get(table_name),
+                "coluna_id": self._primarias.get(table_name),
+                "conversores": self._conversores[table_name],
+            }
+        return modelos
+
     def _gerar_dict_primarias(self,base) -> Dict[str, str]:
         primarias = {}
         for table_name, table in base.metadata.tables.items():
@@ -104,20 +327,89 @@ class Db(metaclass=_Singleton):
                     break
         return primarias
 
-    def __init__(self, database_url: str = None, env_path: str = ".env"):
+    def __init__(self, database_url: str = None, env_path: str = ".env", estrategia_atualizacao: EstrategiaAtualizacao = None):
         if not hasattr(self, "_initialized"):
             if not database_url:
                 load_dotenv(env_path)
                 database_url = os.getenv("DATABASE_URL")
                 if not database_url:
                     raise ValueError("DATABASE_URL não está definida no arquivo .env")
-            self._engine = create_engine(database_url, echo=True)
+            #O echo (todas as instruções no stdout) fica desligado por padrão, use o log de consultas lentas (DB_CONSULTA_LENTA_MS)
+            echo = os.getenv("DB_ECHO", "false").strip().lower() in ["true", "1", "yes", "sim", "s"]
+            self._engine = create_engine(database_url, echo=echo, **self._opcoes_pool(database_url))
             self._session_factory = sessionmaker(bind=self._engine, autocommit=False, autoflush=False)
             self._base = Base
+
+            #Estratégias de atualização disponíveis (nome -> método), ver _resolver_estrategia
+            self._estrategias_atualizacao = {
+                "upsert": self._atualizar_upsert,
+                "diff": self._atualizar_diff,
+            }
+            self.estrategia_atualizacao = estrategia_atualizacao or os.getenv("DB_ESTRATEGIA_ATUALIZACAO", "auto")
+
+            #Limites de parâmetros por instrução (global via .env e por tabela via __table_args__ info "limite_parametros")
+            self._limite_parametros_dialeto = None # detectado na primeira utilização
+            self._limite_parametros_global = int(os.getenv("DB_LIMITE_PARAMETROS", "0")) or None
+            self._limites_parametros_tabelas = {}
+
+            #Threads para execução fora do event loop (ver executar), por padrão a capacidade do pool de conexões
+            #Pools de uma conexão por thread (ex.: SQLite em memória) ficam com 1 thread para não separar os dados
+            pool = self._engine.pool
+            threads_padrao = pool.size() + max(pool._max_overflow, 0) if isinstance(pool, QueuePool) else 1
+            self._limitador_threads = anyio.CapacityLimiter(int(os.getenv("DB_MAX_THREADS", threads_padrao)))
+
+            #Cache de resultados do consultar_base, desligado por padrão: fica na memória do processo e só é invalidado pelas gravações deste processo,
+            #ative (DB_CACHE_MAX_ITENS > 0) apenas com um único worker gravando no banco, ver CacheConsultas
+            self._cache = CacheConsultas(
+                max_itens=int(os.getenv("DB_CACHE_MAX_ITENS", "0")),
+                max_bytes=int(os.getenv("DB_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                ttl=float(os.getenv("DB_CACHE_TTL", "30")),
+            )
+            #Cache dos selects montados por forma de consulta (DB_CACHE_FORMAS=0 desativa)
+            self._cache_formas = CacheFormas(max_itens=int(os.getenv("DB_CACHE_FORMAS", "512")))
+            #Estatísticas das consultas por forma, usadas pelo assessor de índices (DB_ESTATISTICAS_CONSULTAS=0 desativa)
+            self._registro_consultas = RegistroConsultas(max_formas=int(os.getenv("DB_ESTATISTICAS_CONSULTAS", "256")))
+            #Métricas (GET /metrics): etapas do atualizar/consultar_base, linhas e estatísticas do pool
+            self._metricas = Metricas()
+            self._metricas.adicionar_coletor(self._coletar_metricas)
+            #Log de consultas lentas e tempo de cada instrução SQL, somente quando DB_CONSULTA_LENTA_MS for informado
+            #Os eventos por instrução têm custo (~50% no insert de 20 mil linhas no SQLite, uma instrução por linha), por isso são opcionais
+            self._consultas_lentas = None
+            if os.getenv("DB_CONSULTA_LENTA_MS"):
+                self._consultas_lentas = RegistroConsultasLentas(
+                    self._engine,
+                    limite_ms=float(os.getenv("DB_CONSULTA_LENTA_MS")),
+                    max_itens=int(os.getenv("DB_CONSULTA_LENTA_MAX", "100")),
+                    modo_parametros=os.getenv("DB_CONSULTA_LENTA_PARAMETROS", "tipos"),
+                    explicar=os.getenv("DB_CONSULTA_LENTA_EXPLAIN", "true").strip().lower() in ["true", "1", "yes", "sim", "s"],
+                )
+            #Conversão e validação das matrizes grandes do atualizar em processos (classes/paralelo.py)
+            #Opcional e desligado por padrão: DB_PARALELO_PROCESSOS (> 1) ativa, DB_PARALELO_MIN_LINHAS é o número mínimo de linhas para usar os processos
+            self._conversao_paralela = ConversaoParalela(
+                processos=int(os.getenv("DB_PARALELO_PROCESSOS", "0")),
+                min_linhas=int(os.getenv("DB_PARALELO_MIN_LINHAS", "100000")),
+            )
             self._initialized = True
             self._importar_models("app.api.excel.models")
             self._estrutura = self._gerar_dict_estrutura(self._base)
             self._primarias = self._gerar_dict_primarias(self._base)
+            self._conversores = self._gerar_dict_conversores(self._base)
+            self._conversores_atualizar = self._gerar_dict_conversores_atualizar(self._base)
+            self._colunas_padrao_banco = self._gerar_dict_colunas_padrao_banco(self._base)
+            self._modelos = self._gerar_dict_modelos(self._base)
+            #Regras da pré-validação do atualizar montadas do metadata (classes/validacao.py)
+            self._validadores = {table_name: ValidadorTabela(table) for table_name, table in self._base.metadata.tables.items()}
+            #Coluna de impressão digital das linhas por tabela (info={"impressao_linha": True}), ver _planejar_impressao
+            self._colunas_impressao = {
+                table_name: column.name
+                for table_name, table in self._base.metadata.tables.items()
+                for column in table.columns if column.info.get("impressao_linha")
+            }
+            #Índices de texto das colunas com info={"busca_texto": True} (FTS5 no SQLite, pg_trgm no PostgreSQL)
+            self._indice_texto = IndiceTexto(self._engine, self._base)
+            for table_name, table in self._base.metadata.tables.items():
+                if table.info.get("limite_parametros"):
+                    self._limites_parametros_tabelas[table_name] = table.info["limite_parametros"]
 
             # Verifica se a estrutura foi carregada corretamente
             if not self._estrutura:
@@ -125,94 +417,201 @@ class Db(metaclass=_Singleton):
             if not self._primarias:
                 raise ValueError("As chaves primárias não foram carregadas corretamente.")
 
+    def _opcoes_pool(self, database_url: str) -> Dict[str, Any]:
+        '''
+        Opções do pool de conexões lidas do .env (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING).
+        Quando o dialeto usa QueuePool, usa o _PoolMedido para coletar estatísticas de espera.
+        '''
+        opcoes = {}
+        if os.getenv("DB_POOL_PRE_PING"):
+            opcoes["pool_pre_ping"] = os.getenv("DB_POOL_PRE_PING").strip().lower() in ["true", "1", "yes", "sim", "s"]
+        if os.getenv("DB_POOL_RECYCLE"):
+            opcoes["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE"))
+
+        url = make_url(database_url)
+        if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+            opcoes["poolclass"] = _PoolMedido
+            if os.getenv("DB_POOL_SIZE"):
+                opcoes["pool_size"] = int(os.getenv("DB_POOL_SIZE"))
+            if os.getenv("DB_MAX_OVERFLOW"):
+                opcoes["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW"))
+            if os.getenv("DB_POOL_TIMEOUT"):
+                opcoes["pool_timeout"] = float(os.getenv("DB_POOL_TIMEOUT"))
+        return opcoes
+
+    def _anotar_linhas(self, session: Session, linhas: int):
+        #Completa a quantidade de linhas da consulta lenta registrada na última instrução da sessão
+        if self._consultas_lentas is not None:
+            self._consultas_lentas.anotar_linhas(session.connection(), linhas)
+
+    def _coletar_metricas(self) -> List[Tuple[str, str, str, Dict[str, Any], float]]:
+        #Valores instantâneos do pool e dos caches, lidos a cada exportação das métricas
+        pool = self.estatisticas_pool()
+        cache = self._cache.estatisticas()
+        formas = self._cache_formas.estatisticas()
+        return [
+            ("excel_pool_conexoes", "gauge", "Conexões do pool por estado", {"estado": "em_uso"}, pool["em_uso"]),
+            ("excel_pool_conexoes", "gauge", "Conexões do pool por estado", {"estado": "disponiveis"}, pool["disponiveis"]),
+            ("excel_pool_conexoes", "gauge", "Conexões do pool por estado", {"estado": "overflow"}, pool["overflow"]),
+            ("excel_pool_tamanho", "gauge", "Tamanho configurado do pool", {}, pool["tamanho"]),
+            ("excel_pool_checkouts_total", "counter", "Conexões obtidas do pool", {}, pool["checkouts"]),
+            ("excel_pool_espera_segundos_total", "counter", "Tempo total de espera por conexões do pool", {}, pool["espera_total_s"]),
+            ("excel_pool_espera_maxima_segundos", "gauge", "Maior espera por uma conexão do pool", {}, pool["espera_maxima_s"]),
+            ("excel_cache_itens", "gauge", "Itens nos caches", {"cache": "consultas"}, cache["itens"]),
+            ("excel_cache_itens", "gauge", "Itens nos caches", {"cache": "formas"}, formas["itens"]),
+            ("excel_cache_bytes", "gauge", "Bytes estimados no cache de consultas", {}, cache["bytes"]),
+            ("excel_cache_acertos_total", "counter", "Acertos dos caches", {"cache": "consultas"}, cache["acertos"]),
+            ("excel_cache_acertos_total", "counter", "Acertos dos caches", {"cache": "formas"}, formas["acertos"]),
+            ("excel_cache_falhas_total", "counter", "Falhas dos caches", {"cache": "consultas"}, cache["falhas"]),
+            ("excel_cache_falhas_total", "counter", "Falhas dos caches", {"cache": "formas"}, formas["falhas"]),
+        ]
+
+    def estatisticas_pool(self) -> EstatisticasPoolDict:
+        '''
+        Estatísticas do pool de conexões para monitoramento (conexões em uso, overflow e tempo de espera).
+        '''
+        pool = self._engine.pool
+        medido = isinstance(pool, _PoolMedido)
+        fila = isinstance(pool, QueuePool)
+        return {
+            "classe": type(pool).__name__,
+            "tamanho": pool.size() if fila else None,
+            "em_uso": pool.checkedout() if fila else None,
+            "disponiveis": pool.checkedin() if fila else None,
+            "overflow": pool.overflow() if fila else None,
+            "checkouts": pool.checkouts if medido else 0,
+            "espera_total_s": pool.espera_total if medido else 0.0,
+            "espera_maxima_s": pool.espera_maxima if medido else 0.0,
+        }
+
+    @property
+    def registro_consultas(self) -> RegistroConsultas:
+        return self._registro_consultas
+
+    @property
+    def consultas_lentas(self) -> Optional[RegistroConsultasLentas]:
+        '''
+        Log de consultas lentas, None quando DB_CONSULTA_LENTA_MS não estiver definido.
+        '''
+        return self._consultas_lentas
+
+    @property
+    def sessao(self) -> Optional[Session]:
+        '''
+        Sessão ativa do "with Db() as session" no contexto atual (thread ou tarefa), ou None fora dele.
+        '''
+        sessoes = _sessoes_contexto.get()
+        return sessoes[-1] if sessoes else None
+
     def __enter__(self) -> Session:
-        self._session = self._session_factory()
-        return self._session
+        #Cada contexto (thread/tarefa) tem a sua pilha de sessões, o singleton não guarda a sessão
+        session = self._session_factory()
+        _sessoes_contexto.set(_sessoes_contexto.get() + (session,))
+        return session
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        sessoes = _sessoes_contexto.get()
+        session = sessoes[-1]
+        _sessoes_contexto.set(sessoes[:-1])
         try:
             if exc_type is None:
-                self._session.commit()
+                session.commit()
             else:
-                self._session.rollback()
+                session.rollback()
         finally:
-            self._session.close()
-            self._session = None
+            session.close()
     
+    async def executar(self, funcao: Callable[..., T], *args, **kwargs) -> T:
+        '''
+        Executa uma função síncrona (ex.: Excel.pesquisar) em uma thread, sem bloquear o event loop.
+        O número de execuções simultâneas é limitado por DB_MAX_THREADS, independente do pool de threads do FastAPI.
+        '''
+        return await anyio.to_thread.run_sync(functools.partial(funcao, *args, **kwargs), limiter=self._limitador_threads)
+
+    async def iterar(self, iterador: Iterator[T], tamanho_lote: int = 1000) -> AsyncIterator[T]:
+        '''
+        Consome um iterador síncrono (ex.: Excel.pesquisar_stream) em lotes, devolvendo os itens de forma assíncrona.
+        Todos os lotes e o fechamento do iterador rodam na mesma thread dedicada: a sessão de um gerador como o consultar_base_stream
+        não é thread-safe e nunca troca de thread. A iteração ocupa uma vaga do DB_MAX_THREADS do início ao fim.
+        Ao abandonar a iteração (ex.: o cliente desconectou) o iterador é fechado na thread dedicada, depois do lote em andamento.
+        '''
+        def proximo_lote() -> List[T]:
+            return list(itertools.islice(iterador, tamanho_lote))
+
+        def fechar():
+            if hasattr(iterador, "close"):
+                iterador.close()
+
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-iterar")
+        async with self._limitador_threads:
+            try:
+                while True:
+                    #Espera o lote em uma thread do anyio, sem bloquear o event loop
+                    lote = await anyio.to_thread.run_sync(executor.submit(proximo_lote).result)
+                    if not lote:
+                        break
+                    for item in lote:
+                        yield item
+            finally:
+                executor.submit(fechar)
+                executor.shutdown(wait=False)
+
     def criar_tabelas(self):
         self._base.metadata.create_all(bind=self._engine)
+        self._indice_texto.criar()
     
+    def modelo(self, tabela: str) -> ModeloDict:
+        '''
+        Retorna o registro da tabela (Table, classe do modelo, chave primária e conversores), montado no __init__
+        '''
+        try:
+            return self._modelos[tabela]
+        except KeyError:
+            raise ValueError(f"Tabela '{tabela}' não encontrada na estrutura do banco de dados.")
+
+    def _modelo_classe(self, tabela: str) -> Type:
+        modelo = self.modelo(tabela)["modelo"]
+        if modelo is None:
+            raise ValueError(f"Modelo para a tabela '{tabela}' não encontrado.")
+        return modelo
+
+    def conversor(self, tabela: str, coluna: str) -> Conversor:
+        '''
+        Retorna o conversor (pré-compilado no __init__) da coluna de uma tabela
+        '''
+        try:
+            return self._conversores[tabela][coluna]
+        except KeyError:
+            raise ValueError(f"Coluna '{coluna}' da tabela '{tabela}' não encontrada na estrutura do banco de dados.")
+
+    def tipo_python(self, tabela: str, coluna: str, agregacao: str = None) -> Optional[type]:
+        '''
+        Tipo Python (python_type do SQLAlchemy) da coluna de uma tabela, None se a coluna não existir ou o tipo não tiver python_type.
+        Com agregacao retorna o tipo do resultado da agregação (contar é int, media é float).
+        '''
+        if tabela not in self._modelos or coluna not in self._modelos[tabela]["tabela"].c:
+            return None
+        agregacao = self._normalizar_opcao(agregacao, _NOMES_AGREGACOES, "agregação")
+        if agregacao in ("contar", "contar_distintos"):
+            return int
+        if agregacao == "media":
+            return float
+        try:
+            return self._modelos[tabela]["tabela"].c[coluna].type.python_type
+        except NotImplementedError:
+            return None
+
     def obter_valor(self,valor, tipo:str=None,tabela:str=None,coluna:str=None) -> Any:
         '''
         dado valor e o tipo (opcional) ou tabela e coluna (opcional) retorna o valor convertido para o tipo correto
         '''
         if tabela and coluna:
-            tipo = self._estrutura[tabela][coluna]["tipo"]
-        
+            return self.conversor(tabela, coluna)(valor)
+
         if not tipo:
             raise ValueError("Tipo não especificado e não encontrado na estrutura do banco de dados.")
-        
-        if valor is None:
-            return None
 
-        tipo = tipo.lower()
-        if "json" in tipo:
-            if isinstance(valor, (list, dict)):
-                return valor
-            try:
-                return json.loads(valor)
-            except Exception:
-                return valor
-        elif "integer" in tipo:
-            try:
-                return int(valor)
-            except Exception:
-                return valor
-        elif "float" in tipo or "double" in tipo or "numeric" in tipo or "real" in tipo or "decimal" in tipo:
-            try:
-                return float(valor)
-            except Exception:
-                return valor
-        elif "boolean" in tipo or "bool" in tipo:
-            if isinstance(valor, bool):
-                return valor
-            if isinstance(valor, (int, float)):
-                return valor != 0
-            if isinstance(valor, str):
-                return valor.strip().lower() in ["true", "1", "yes", "y", "sim", "s"]
-            return False
-        elif "date" in tipo:
-            from datetime import datetime
-            if isinstance(valor, (datetime, )):
-                return valor.date()
-            if isinstance(valor, str):
-                try:
-                    return datetime.strptime(valor, "%Y-%m-%d").date()
-                except Exception:
-                    return valor
-            return valor
-        elif "time" in tipo:
-            from datetime import datetime
-            if isinstance(valor, (datetime, )):
-                return valor.time()
-            if isinstance(valor, str):
-                try:
-                    return datetime.strptime(valor, "%H:%M:%S").time()
-                except Exception:
-                    return valor
-            return valor
-        elif "datetime" in tipo or "timestamp" in tipo:
-            from datetime import datetime
-            if isinstance(valor, (datetime, )):
-                return valor
-            if isinstance(valor, str):
-                try:
-                    return datetime.strptime(valor, "%Y-%m-%d %H:%M:%S")
-                except Exception:
-                    return valor
-            return valor
-        else:
-            return valor
+        return conversor_para_texto(tipo)(valor)
 
     def formatar_valor(self,valor, tipo:str=None,tabela:str=None,coluna:str=None) -> str:
         '''
@@ -288,11 +687,9 @@ class Db(metaclass=_Singleton):
             print(f"Tabela '{nome_tabela}' não encontrada na estrutura do banco de dados.")
             return
 
-        # Importa dinamicamente o modelo da tabela
-        try:
-            model_module = importlib.import_module(f"app.api.excel.models.{nome_tabela}")
-            model_class = getattr(model_module, nome_tabela.capitalize())
-        except (ModuleNotFoundError, AttributeError):
+        # Coleta o modelo da tabela no registro
+        model_class = self._modelos[nome_tabela]["modelo"]
+        if model_class is None:
             print(f"Modelo para a tabela '{nome_tabela}' não encontrado.")
             return
 
@@ -325,12 +722,97 @@ class Db(metaclass=_Singleton):
                 print(" | ".join(linha))
             print("-" * 40)
 
-    def consultar_base(self,colunas: List[str],tabelas: List[str],criterios: List[List[Any]] = None,tabelas_criterios: List[str] = None, relacoes: List[RelacoesDict] = None,caractere_invalido: str = "-")-> List[List[Any]]:
+    def _analisar_criterios(self,criterios: List[List[Any]],tabelas_criterios: List[str],tabelas: List[str]) -> Tuple[FormaCriterios, List[Any]]:
+        '''
+        Separa os critérios em forma e valores (ver classes/criterios.py).
+        A forma descreve a estrutura das condições (predicados de cada célula sem os valores) e é usada como chave do cache de formas,
+        os valores são os parâmetros do select, na ordem dos bindparam criterio_0, criterio_1...
+        '''
+        if not criterios or len(criterios) <= 1:
+            return (), []
+
+        #Sem tabelas dos critérios, todas as colunas dos critérios são da primeira tabela
+        if not tabelas_criterios:
+            tabelas_criterios = [tabelas[0]] * len(criterios[0])
+
+        def conversor(tabela: str, coluna: str) -> Conversor:
+            self.modelo(tabela) # valida a tabela
+            return self.conversor(tabela, coluna)
+
+        #Cada bloco do IN respeita o limite de parâmetros da tabela
+        return criterios_sql.analisar(criterios, tabelas_criterios, conversor, self.limite_parametros, self._indice_texto.possui)
+
+    @staticmethod
+    def _normalizar_opcao(valor: Optional[str], nomes: Dict[str, str], descricao: str) -> Optional[str]:
+        '''
+        Converte o nome informado pelo usuário (ex.: "Média", "AVG", "Decrescente") no nome interno, None quando vazio.
+        '''
+        if valor is None or str(valor).strip() == "":
+            return None
+        texto = unicodedata.normalize("NFKD", str(valor).strip().lower())
+        texto = "".join(c for c in texto if not unicodedata.combining(c)).replace(" ", "_")
+        if texto not in nomes:
+            raise ValueError(f"{descricao.capitalize()} '{valor}' inválida. Use " + ", ".join(f"'{n}'" for n in dict.fromkeys(nomes.values())) + ".")
+        return nomes[texto]
+
+    def _analisar_agregacao(self, colunas: List[str], agregacoes: List[str] = None, ordenacao: List[str] = None, top: int = None) -> Tuple[Any, ...]:
+        '''
+        Valida agregações e ordenação (uma por coluna, na mesma ordem das colunas) e o top, retornando a forma usada no select e no cache de formas.
+        '''
+        if agregacoes is not None and len(agregacoes) != len(colunas):
+            raise ValueError("A lista de agregações deve ter a mesma quantidade de itens das colunas (vazio para as colunas agrupadas).")
+        if ordenacao is not None and len(ordenacao) != len(colunas):
+            raise ValueError("A lista de ordenação deve ter a mesma quantidade de itens das colunas (vazio para não ordenar pela coluna).")
+        if top is not None and top < 1:
+            raise ValueError("O top deve ser maior que zero.")
+        forma_agregacoes = tuple(self._normalizar_opcao(a, _NOMES_AGREGACOES, "agregação") for a in agregacoes or [])
+        forma_ordenacao = tuple(self._normalizar_opcao(o, _NOMES_ORDENACOES, "ordenação") for o in ordenacao or [])
+        if not any(forma_agregacoes) and not any(forma_ordenacao) and top is None:
+            return ()
+        return (forma_agregacoes, forma_ordenacao, top)
+
+    def _montar_criterios(self, forma: FormaCriterios) -> List[Any]:
+        '''
+        Monta as condições OU (linhas) de E (colunas) a partir da forma dos critérios, com um bindparam por valor (ou por bloco do IN).
+        '''
+        return criterios_sql.compilar(
+            forma,
+            lambda tabela, coluna: self.modelo(tabela)["tabela"].c[coluna],
+            lambda tabela, coluna, padrao: self._indice_texto.condicao(self.modelo(tabela)["tabela"], coluna, padrao),
+        )
+
+    def _montar_consulta(self,colunas: List[str],tabelas: List[str],criterios: List[List[Any]] = None,tabelas_criterios: List[str] = None, relacoes: List[RelacoesDict] = None, agregacoes: List[str] = None, ordenacao: List[str] = None, top: int = None) -> Tuple[Select, Dict[str, Any], List[int], str, Tuple[Any, ...]]:
+        '''
+        Monta o select de uma consulta.
+        Os valores dos critérios vão como parâmetros (bindparam) e o select é guardado no cache de formas,
+        consultas com as mesmas colunas, tabelas, relações, estrutura de critérios, agregações, ordenação e top reaproveitam o select já montado.
+        Retorna o select, os parâmetros, as posições de cada coluna pedida no resultado (-1 para colunas inválidas), a tabela base (a mais à esquerda do FROM)
+        e a forma (chave do cache e do registro de consultas).
+        '''
         #Testa se todas as tabelas estão na estrutura
         for tabela in tabelas:
             if tabela not in self._estrutura:
                 raise ValueError(f"Tabela '{tabela}' não encontrada na estrutura do banco de dados.")
-        
+
+        forma_criterios, valores = self._analisar_criterios(criterios, tabelas_criterios, tabelas)
+        forma_agregacao = self._analisar_agregacao(colunas, agregacoes, ordenacao, top)
+        parametros = {f"criterio_{i}": valor for i, valor in enumerate(valores)}
+        forma = (
+            tuple(colunas),
+            tuple(tabelas),
+            tuple((r["tabela_a"], r["tabela_b"], r["coluna_a"], r["coluna_b"], r["tipo"]) for r in relacoes or []),
+            forma_criterios,
+            forma_agregacao,
+        )
+        montado = self._cache_formas.obter(forma)
+        if montado is None:
+            montado = self._montar_select(colunas, tabelas, relacoes, forma_criterios, forma_agregacao)
+            self._cache_formas.guardar(forma, montado)
+        stmt, colunas_posicoes, tabela_base = montado
+        return stmt, parametros, list(colunas_posicoes), tabela_base, forma
+
+    def _montar_select(self,colunas: List[str],tabelas: List[str],relacoes: List[RelacoesDict],forma_criterios: FormaCriterios,forma_agregacao: Tuple[Any, ...] = ()) -> Tuple[Select, Tuple[int, ...], str]:
+        agregacoes, ordenacao, top = forma_agregacao or ((), (), None)
         #varre as colunas e tabelas
         colunas_ok = []
         colunas_posicoes = []
@@ -339,15 +821,19 @@ class Db(metaclass=_Singleton):
             colunas_posicoes.append(-1)  # Inicializa com -1
             if tabela in self._estrutura:
                 if coluna in self._estrutura[tabela]:
-                    colunas_ok.append((tabela, coluna))
+                    colunas_ok.append((tabela, coluna, agregacoes[pos] if agregacoes else None, ordenacao[pos] if ordenacao else None))
                     colunas_posicoes[-1] = len(colunas_ok)-1  # Atualiza a posição da coluna
 
         #testa se sobrou alguma coluna
         if not colunas_ok:
             raise ValueError("Nenhuma coluna válida encontrada nas tabelas especificadas.")
         
-        #Cria o select
-        stmt = select(*[getattr(importlib.import_module(f"app.api.excel.models.{t}"), t.capitalize()).__table__.c[c] for t, c in colunas_ok])
+        #Cria o select (colunas com agregação viram a função correspondente)
+        expressoes = []
+        for t, c, agregacao, _ in colunas_ok:
+            coluna_sql = self._modelos[t]["tabela"].c[c]
+            expressoes.append(_FUNCOES_AGREGACOES[agregacao](coluna_sql) if agregacao else coluna_sql)
+        stmt = select(*[expressao.label(f"{agregacao}_{c}") if agregacao else expressao for expressao, (_, c, agregacao, _) in zip(expressoes, colunas_ok)])
 
         #adiciona as relacoes
         if relacoes:
@@ -358,145 +844,404 @@ class Db(metaclass=_Singleton):
                 coluna_b = relacao['coluna_b']
                 tipo = relacao['tipo']
 
-                # Coleta as classes dos modelos
-                modelo_a = getattr(importlib.import_module(f"app.api.excel.models.{tabela_a}"), tabela_a.capitalize())
-                modelo_b = getattr(importlib.import_module(f"app.api.excel.models.{tabela_b}"), tabela_b.capitalize())
+                # Coleta as tabelas no registro
+                tabela_sql_a = self.modelo(tabela_a)["tabela"]
+                tabela_sql_b = self.modelo(tabela_b)["tabela"]
                 
                 if tipo == "inner":
-                    stmt = stmt.join(modelo_a, modelo_a.__table__.c[coluna_a] == modelo_b.__table__.c[coluna_b])
+                    stmt = stmt.join(tabela_sql_a, tabela_sql_a.c[coluna_a] == tabela_sql_b.c[coluna_b])
                 elif tipo == "right":
-                    stmt = stmt.join(modelo_b, modelo_a.__table__.c[coluna_a] == modelo_b.__table__.c[coluna_b],isouter=True)
+                    stmt = stmt.join(tabela_sql_b, tabela_sql_a.c[coluna_a] == tabela_sql_b.c[coluna_b],isouter=True)
                 else:
                     #tipo == "left"
-                    stmt = stmt.join(modelo_a, modelo_a.__table__.c[coluna_a] == modelo_b.__table__.c[coluna_b],isouter=True)
+                    stmt = stmt.join(tabela_sql_a, tabela_sql_a.c[coluna_a] == tabela_sql_b.c[coluna_b],isouter=True)
 
         #Adiciona as condições
-        if criterios:
-            if len(criterios)>1:
-                #Verifica se tabelas critérios existe e cria uma lista repetindo tabelas[0] para todas as colunas de criterios
-                if not tabelas_criterios:
-                    tabelas_criterios = [tabelas[0] for t in tabelas]
-
-                #Primeira linha o cabeçalho as demais linhas os critérios OU e colunas E
-                crit_or = []
-                for l, linha in enumerate(criterios[1:], start=1):
-                    crit_and = []
-                    for c, coluna in enumerate(linha):
-                        tab = tabelas_criterios[c]
-                        col = criterios[0][c]
-                        #Coleta o sinal (início da string = >= < <= <>) e o valor
-                        sinal = ""
-                        if isinstance(coluna, str):
-                            #Trata casos numéricos
-                            if coluna.startswith(">"):
-                                sinal = ">"
-                            elif coluna.startswith("<"):
-                                sinal = "<"
-                            elif coluna.startswith("="):
-                                sinal = "="
-                            elif coluna.startswith(">="):
-                                sinal = ">="
-                            elif coluna.startswith("<="):
-                                sinal = "<="
-                            elif coluna.startswith("!=") or coluna.startswith("<>"):
-                                sinal = "!="
-                            coluna = coluna[len(sinal):].strip()
-                            #Trata casos de texto
-                            if coluna.startswith("*") and coluna.endswith("*"):
-                                sinal = "**"
-                                coluna = coluna[1:-1]
-                            elif coluna.startswith("*"):
-                                sinal = "*-"
-                                coluna = coluna[1:]
-                            elif coluna.endswith("*"):
-                                sinal = "-*"
-                                coluna = coluna[:-1]
-
-                        #Trata o caso de or no critério caso tenha mais de uma coluna ;
-                        if isinstance(coluna, str):
-                            colunas_or = coluna.split(";")
-                        else:
-                            colunas_or = [coluna]
-                        
-                        #para cada item da coluna or, cria um critério
-                        modelo = getattr(importlib.import_module(f"app.api.excel.models.{tab}"), tab.capitalize())
-                        for col_or in colunas_or:
-                            crit_and_or = []
-                            valor_txt = self.formatar_valor(col_or,tabela = tab,coluna = col)
-                            if valor_txt != "" or len(sinal) > 0:
-                                valor_efetivo = self.obter_valor(col_or, tabela=tab, coluna=col)
-                                if sinal == ">":
-                                    crit_and_or.append(modelo.__table__.c[col] > valor_efetivo)
-                                elif sinal == "<":
-                                    crit_and_or.append(modelo.__table__.c[col] < valor_efetivo)
-                                elif sinal == ">=":
-                                    crit_and_or.append(modelo.__table__.c[col] >= valor_efetivo)
-                                elif sinal == "<=":
-                                    crit_and_or.append(modelo.__table__.c[col] <= valor_efetivo)
-                                elif sinal == "**":
-                                    crit_and_or.append(modelo.__table__.c[col].ilike(f"%{valor_efetivo}%"))
-                                elif sinal == "*-":
-                                    crit_and_or.append(modelo.__table__.c[col].ilike(f"%{valor_efetivo}"))
-                                elif sinal == "-*":
-                                    crit_and_or.append(modelo.__table__.c[col].ilike(f"{valor_efetivo}%"))
-                                elif sinal == "!=":
-                                    crit_and_or.append(modelo.__table__.c[col] != valor_efetivo)
-                                    if valor_efetivo == "":
-                                        crit_and_or.append(modelo.__table__.c[col].isnot_(None))
-                                else:  # "=" ou sem sinal
-                                    crit_and_or.append(modelo.__table__.c[col] == valor_efetivo)
-                                    if valor_efetivo == "":
-                                        crit_and_or.append(modelo.__table__.c[col].is_(None))
-                            #Adiciona os critérios or se tiver algo
-                            if crit_and_or:
-                                if len(crit_and_or) == 1:
-                                    crit_and.append(crit_and_or[0])
-                                else:
-                                    crit_and.append(or_(*crit_and_or))
-
-                    #Adiciona a linha de critérios se tiver algo
-                    if crit_and:
-                        crit_or.append(and_(*crit_and))
-                #Adiciona os critérios ao select se tiver algo
-                if crit_or:
-                    if len(crit_or) == 1:
-                        stmt = stmt.where(crit_or[0])
-                    else:
-                        stmt = stmt.where(or_(*crit_or))
+        crit_or = self._montar_criterios(forma_criterios)
+        #Adiciona os critérios ao select se tiver algo
+        if crit_or:
+            if len(crit_or) == 1:
+                stmt = stmt.where(crit_or[0])
+            else:
+                stmt = stmt.where(or_(*crit_or))
+
+        #Agrupa pelas colunas sem agregação quando alguma coluna tiver agregação
+        if any(agregacao for _, _, agregacao, _ in colunas_ok):
+            agrupadas = [expressao for expressao, (_, _, agregacao, _) in zip(expressoes, colunas_ok) if not agregacao]
+            if agrupadas:
+                stmt = stmt.group_by(*agrupadas)
+
+        #Ordena na ordem das colunas (da esquerda para a direita) e limita as linhas
+        ordem = [expressao.desc() if sentido == "desc" else expressao.asc() for expressao, (_, _, _, sentido) in zip(expressoes, colunas_ok) if sentido]
+        if ordem:
+            stmt = stmt.order_by(*ordem)
+        if top:
+            stmt = stmt.limit(top)
+
+        #Tabela base: a mais à esquerda do FROM, preservada em todas as relações (sua chave nunca é nula)
+        tabela_base = stmt.get_final_froms()[0]
+        while isinstance(tabela_base, Join):
+            tabela_base = tabela_base.left
+
+        return stmt, tuple(colunas_posicoes), tabela_base.name
+
+    def _formatar_linha(self, row, colunas_posicoes: List[int], caractere_invalido: str) -> List[Any]:
+        return [row[col] if col >= 0 else caractere_invalido for col in colunas_posicoes]
+
+    def consultar_base(self,colunas: List[str],tabelas: List[str],criterios: List[List[Any]] = None,tabelas_criterios: List[str] = None, relacoes: List[RelacoesDict] = None,caractere_invalido: str = "-", agregacoes: List[str] = None, ordenacao: List[str] = None, top: int = None)-> List[List[Any]]:
+        '''
+        Consulta as colunas das tabelas com os critérios e relações informados, retornando uma matriz (colunas inválidas recebem caractere_invalido).
+        agregacoes (uma por coluna: soma, contar, contar_distintos, media, minimo, maximo ou vazio) agrupa pelas colunas sem agregação,
+        ordenacao (uma por coluna: asc, desc ou vazio) ordena da esquerda para a direita e top limita a quantidade de linhas.
+        '''
+        #Consulta o cache antes de montar o select
+        chave_cache = None
+        if self._cache.ativo:
+            chave_cache = CacheConsultas.chave(colunas=colunas, tabelas=tabelas, criterios=criterios, tabelas_criterios=tabelas_criterios, relacoes=relacoes, caractere_invalido=caractere_invalido, agregacoes=agregacoes, ordenacao=ordenacao, top=top)
+            resultado = self._cache.obter(chave_cache)
+            if resultado is not None:
+                return resultado
+            tabelas_consulta = [*tabelas, *(tabelas_criterios or []), *[t for r in (relacoes or []) for t in (r["tabela_a"], r["tabela_b"])]]
+            versoes = self._cache.versoes(tabelas_consulta)
+
+        with self._metricas.etapa("consultar", "montar"):
+            stmt, parametros, colunas_posicoes, _, forma = self._montar_consulta(colunas, tabelas, criterios, tabelas_criterios, relacoes, agregacoes, ordenacao, top)
 
         #Executa o select
-        with self as session:
-            resultados = session.execute(stmt).all()
-        
+        inicio = time.perf_counter()
+        with self._metricas.etapa("consultar", "executar"), self as session:
+            resultados = session.execute(stmt, parametros).all()
+            self._anotar_linhas(session, len(resultados))
+        self._registro_consultas.registrar(forma, stmt, parametros, time.perf_counter() - inicio, len(resultados))
+
         #Formata os resultados gerando uma matriz
-        resultados_formatados = []
-        for row in resultados:
-            linha_formatada = []
-            for col in colunas_posicoes:
-                if col >= 0:
-                    linha_formatada.append(row[col])
+        with self._metricas.etapa("consultar", "formatar"):
+            resultado = [self._formatar_linha(row, colunas_posicoes, caractere_invalido) for row in resultados]
+        self._metricas.linhas("consultar", "saida", len(resultado))
+        if chave_cache is not None:
+            self._cache.guardar(chave_cache, resultado, versoes)
+        return resultado
+
+    def estatisticas_cache(self) -> EstatisticasCacheDict:
+        '''
+        Estatísticas do cache de resultados do consultar_base (acertos, falhas, despejos...) para dimensionamento.
+        '''
+        return self._cache.estatisticas()
+
+    def estatisticas_formas(self) -> EstatisticasFormasDict:
+        '''
+        Estatísticas do cache de formas de consulta (selects montados reaproveitados), para acompanhar a taxa de acertos.
+        '''
+        return self._cache_formas.estatisticas()
+
+    def consultar_base_stream(self,colunas: List[str],tabelas: List[str],criterios: List[List[Any]] = None,tabelas_criterios: List[str] = None, relacoes: List[RelacoesDict] = None,caractere_invalido: str = "-", agregacoes: List[str] = None, ordenacao: List[str] = None, top: int = None, tamanho_lote: int = 1000)-> Iterator[List[Any]]:
+        '''
+        Igual ao consultar_base, porém devolve as linhas aos poucos usando cursor no servidor (yield_per/stream_results).
+        A consulta é montada (e validada) na chamada, a execução acontece ao iterar o resultado.
+        O gerador tem sessão própria e deve ser consumido do início ao fim (ou fechado) na mesma thread, no event loop use Db.iterar.
+        '''
+        with self._metricas.etapa("consultar_stream", "montar"):
+            stmt, parametros, colunas_posicoes, _, forma = self._montar_consulta(colunas, tabelas, criterios, tabelas_criterios, relacoes, agregacoes, ordenacao, top)
+
+        def linhas():
+            #Sessão própria do gerador, somente leitura, fechada ao terminar ou abandonar a iteração
+            inicio = time.perf_counter()
+            quantidade = 0
+            with self._session_factory() as session:
+                resultados = session.execute(stmt.execution_options(yield_per=tamanho_lote), parametros)
+                for row in resultados:
+                    quantidade += 1
+                    yield self._formatar_linha(row, colunas_posicoes, caractere_invalido)
+                self._anotar_linhas(session, quantidade)
+            #Registra apenas a iteração completa (o tempo inclui o consumo das linhas pelo cliente)
+            self._registro_consultas.registrar(forma, stmt, parametros, time.perf_counter() - inicio, quantidade)
+            self._metricas.linhas("consultar_stream", "saida", quantidade)
+
+        return linhas()
+
+    def _codificar_cursor(self, tabela: str, valor: Any) -> str:
+        texto = json.dumps([tabela, valor], default=str)
+        return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii")
+
+    def _decodificar_cursor(self, tabela: str, cursor: str) -> Any:
+        try:
+            tabela_cursor, valor = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        except Exception:
+            raise ValueError("Cursor de paginação inválido.")
+        if tabela_cursor != tabela:
+            raise ValueError(f"O cursor de paginação não pertence à tabela '{tabela}'.")
+        return self.obter_valor(valor, tabela=tabela, coluna=self._primarias[tabela])
+
+    def consultar_base_pagina(self,colunas: List[str],tabelas: List[str],criterios: List[List[Any]] = None,tabelas_criterios: List[str] = None, relacoes: List[RelacoesDict] = None,caractere_invalido: str = "-", agregacoes: List[str] = None, ordenacao: List[str] = None, top: int = None, limite: int = 1000, cursor: str = None)-> PaginaDict:
+        '''
+        Consulta paginada por chave (keyset) na chave primária da tabela base (a mais à esquerda do FROM).
+        Cada página contém todas as linhas de até `limite` registros da tabela base, inclusive as repetidas pelas relações.
+        Retorna {"dados": [...], "cursor": <texto opaco para a próxima página ou None na última>}.
+        '''
+        if self._analisar_agregacao(colunas, agregacoes, ordenacao, top):
+            raise ValueError("A paginação (limite/cursor) não aceita agregações, ordenação ou top, a ordem das páginas é a da chave primária.")
+        with self._metricas.etapa("consultar_pagina", "montar"):
+            stmt, parametros, colunas_posicoes, tabela_base, forma = self._montar_consulta(colunas, tabelas, criterios, tabelas_criterios, relacoes)
+        if limite < 1:
+            raise ValueError("O limite da página deve ser maior que zero.")
+        limite = min(limite, self.limite_parametros(tabela_base))
+        coluna_id = self._base.metadata.tables[tabela_base].c[self._primarias[tabela_base]]
+
+        #Seleciona as chaves da página com os mesmos filtros e relações da consulta
+        stmt_chaves = stmt.with_only_columns(coluna_id, maintain_column_froms=True).distinct().order_by(coluna_id).limit(limite)
+        if cursor:
+            stmt_chaves = stmt_chaves.where(coluna_id > self._decodificar_cursor(tabela_base, cursor))
+
+        inicio = time.perf_counter()
+        with self._metricas.etapa("consultar_pagina", "executar"), self as session:
+            chaves = session.execute(stmt_chaves, parametros).scalars().all()
+            resultados = []
+            if chaves:
+                resultados = session.execute(stmt.where(coluna_id.in_(chaves)).order_by(coluna_id), parametros).all()
+            self._anotar_linhas(session, len(resultados) if chaves else len(chaves))
+        #O select das chaves é o que percorre os filtros, é ele que vai para o EXPLAIN do assessor de índices
+        self._registro_consultas.registrar(forma, stmt_chaves, parametros, time.perf_counter() - inicio, len(resultados))
+
+        with self._metricas.etapa("consultar_pagina", "formatar"):
+            dados = [self._formatar_linha(row, colunas_posicoes, caractere_invalido) for row in resultados]
+        self._metricas.linhas("consultar_pagina", "saida", len(dados))
+        return {
+            "dados": dados,
+            "cursor": self._codificar_cursor(tabela_base, chaves[-1]) if len(chaves) == limite else None,
+        }
+
+    def _detectar_limite_parametros(self) -> int:
+        '''
+        Detecta o limite de parâmetros por instrução do dialeto do engine.
+        No SQLite consulta o limite real da biblioteca carregada (SQLITE_MAX_VARIABLE_NUMBER).
+        '''
+        nome_dialeto = self._engine.dialect.name
+        limite = _LIMITES_PARAMETROS_DIALETO.get(nome_dialeto, _LIMITE_PARAMETROS_PADRAO)
+        if nome_dialeto == "sqlite":
+            with self._engine.connect() as conexao:
+                conexao_dbapi = conexao.connection.dbapi_connection
+                if hasattr(conexao_dbapi, "getlimit"):
+                    limite = conexao_dbapi.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
                 else:
-                    linha_formatada.append(caractere_invalido)
-            resultados_formatados.append(linha_formatada)
+                    opcoes = [linha[0] for linha in conexao.exec_driver_sql("PRAGMA compile_options").all()]
+                    opcao = next((o for o in opcoes if o.startswith("MAX_VARIABLE_NUMBER=")), None)
+                    if opcao:
+                        limite = int(opcao.split("=", 1)[1])
+                    elif sqlite3.sqlite_version_info >= (3, 32, 0):
+                        limite = 32766
+        return limite
+
+    def limite_parametros(self, tabela: str = None) -> int:
+        '''
+        Retorna o limite efetivo de parâmetros por instrução, opcionalmente para uma tabela específica.
+        Prioridade: limite da tabela > DB_LIMITE_PARAMETROS > limite do dialeto (com 10% de folga).
+        '''
+        if tabela in self._limites_parametros_tabelas:
+            return self._limites_parametros_tabelas[tabela]
+        if self._limite_parametros_global:
+            return self._limite_parametros_global
+        if self._limite_parametros_dialeto is None:
+            limite = min(self._detectar_limite_parametros(), _LIMITE_PARAMETROS_MAXIMO)
+            self._limite_parametros_dialeto = max(1, int(limite * 0.9))
+        return self._limite_parametros_dialeto
+
+    def definir_limite_parametros(self, tabela: str, limite: Optional[int]):
+        '''
+        Define (ou remove com None) o limite de parâmetros por instrução de uma tabela.
+        '''
+        if tabela not in self._estrutura:
+            raise ValueError(f"Tabela '{tabela}' não encontrada na estrutura do banco de dados.")
+        if limite is None:
+            self._limites_parametros_tabelas.pop(tabela, None)
+        elif limite < 1:
+            raise ValueError("O limite de parâmetros deve ser maior que zero.")
+        else:
+            self._limites_parametros_tabelas[tabela] = limite
 
-        return resultados_formatados
+    def _planejar_lotes(self, tabela: str, itens: List[Any], campos_por_item: int = 1) -> Iterator[List[Any]]:
+        '''
+        Divide os itens em lotes de linhas x colunas que respeitam o limite de parâmetros da tabela.
+        '''
+        tamanho = max(1, self.limite_parametros(tabela) // max(1, campos_por_item))
+        for i in range(0, len(itens), tamanho):
+            yield itens[i:i+tamanho]
+
+    def _resolver_estrategia(self) -> EstrategiaAtualizacao:
+        '''
+        Resolve a estratégia de atualização efetiva para o dialeto do engine.
+        Em "auto" usa o upsert nativo quando o dialeto suporta e o algoritmo de diferenças nos demais.
+        '''
+        nome_dialeto = self._engine.dialect.name
+        suporta_upsert = nome_dialeto in _INSERTS_UPSERT
+        if nome_dialeto == "sqlite":
+            #ON CONFLICT ... DO UPDATE existe a partir do SQLite 3.24
+            versao = getattr(self._engine.dialect.dbapi, "sqlite_version_info", (0,))
+            suporta_upsert = versao >= (3, 24, 0)
+
+        if self._estrategia_atualizacao == "auto":
+            return "upsert" if suporta_upsert else "diff"
+        if self._estrategia_atualizacao == "upsert" and not suporta_upsert:
+            raise ValueError(f"O dialeto '{nome_dialeto}' não suporta a estratégia de atualização 'upsert'.")
+        return self._estrategia_atualizacao
+
+    def _planejar_impressao(self, tabela: str, validos_cabecalho: List[str]) -> Optional[Tuple[str, Optional[List[int]]]]:
+        '''
+        Coluna de impressão digital da tabela (se houver) e a posição no cabeçalho das colunas do hash (ver lote.impressoes):
+        todas as colunas, exceto a chave e a própria impressão, na ordem da tabela. A impressão vai acrescentada no fim do lote.
+        Quando a matriz não tem todas as colunas as posições vão None e a impressão fica nula, assim as linhas alteradas não ficam com uma impressão desatualizada.
+        '''
+        coluna_impressao = self._colunas_impressao.get(tabela)
+        if not coluna_impressao:
+            return None
+        colunas = [c.name for c in self._modelos[tabela]["tabela"].columns if c.name not in (coluna_impressao, self._primarias[tabela])]
+        posicoes = [validos_cabecalho.index(c) for c in colunas if c in validos_cabecalho]
+        return coluna_impressao, posicoes if len(posicoes) == len(colunas) else None
+
+    def _atualizar_diff(self, session: Session, model_class, coluna_id: str, lote: LoteColunar, posicoes: List[int]):
+        '''
+        Estratégia "diff": lê as linhas existentes (posicoes do lote) pela chave, compara em Python e envia apenas os campos alterados.
+        Linhas iguais são descartadas com uma única comparação (da linha inteira ou, com a coluna de impressão digital completa, só da impressão).
+        '''
+        tabela_sql = model_class.__table__
+        tabela = tabela_sql.name
+        validos_cabecalho = lote.cabecalho
+        ids = lote.coluna(0, posicoes)
+        #A impressão (quando existe) é sempre a última coluna, ver _planejar_impressao
+        coluna_impressao = self._colunas_impressao.get(tabela)
+        com_impressao = coluna_impressao is not None and validos_cabecalho[-1] == coluna_impressao
+        por_impressao = com_impressao and lote.valor(posicoes[0], -1) is not None
+        quantidade_colunas = len(validos_cabecalho) - 1 if com_impressao else len(validos_cabecalho)
+        colunas_lidas = [coluna_id, coluna_impressao] if por_impressao else validos_cabecalho[:quantidade_colunas]
+        #Colunas NOT NULL com padrão calculado: a célula vazia mantém o valor atual
+        padrao_banco = self._colunas_padrao_banco.get(tabela)
+
+        #Gera o dados atualizar caso algum campo tenha sido alterado
+        dados_atualizar = [] #linhas a serem atualizadas [{coluna_id: valor, coluna1: valor1, ...}, ...]
+        stmt_colunas = [tabela_sql.c[col] for col in colunas_lidas]
+        tamanho_lote = max(1, self.limite_parametros(tabela))
+
+        # Pesquisa e compara os dados existentes em lotes que respeitam o limite de parâmetros, só as linhas lidas do lote atual ficam em memória
+        for inicio in range(0, len(posicoes), tamanho_lote):
+            posicoes_lote = posicoes[inicio:inicio + tamanho_lote]
+            ids_lote = ids[inicio:inicio + tamanho_lote]
+            # Indexados pela chave (o banco devolve em qualquer ordem)
+            with self._metricas.etapa("atualizar", "ler_existentes"):
+                stmt = select(*stmt_colunas).where(tabela_sql.c[coluna_id].in_(list(set(ids_lote))))
+                existentes = {row[0]: tuple(row) for row in session.execute(stmt)}
+
+            with self._metricas.etapa("atualizar", "comparar"):
+                for posicao, id in zip(posicoes_lote, ids_lote):
+                    existente = existentes.get(id)
+                    #Linha removida por outra transação depois da busca dos ids
+                    if existente is None:
+                        continue
+                    if por_impressao:
+                        #Impressão diferente: regrava a linha inteira (os campos não foram lidos)
+                        if existente[1] != lote.valor(posicao, -1):
+                            linha_atualizar = dict(zip(validos_cabecalho, lote.linha(posicao)))
+                            for col in padrao_banco or ():
+                                if col in linha_atualizar and linha_atualizar[col] is None:
+                                    del linha_atualizar[col]
+                            dados_atualizar.append(linha_atualizar)
+                        continue
+                    linha = lote.tupla(posicao, quantidade_colunas)
+                    if linha == existente:
+                        continue
+
+                    #gera a linha de atualização
+                    linha_atualizar = {}
+                    linha_atualizar[coluna_id] = linha[0]
+                    for poscol in range(1, quantidade_colunas):  # Ignora o id
+                        if linha[poscol] != existente[poscol] and not (linha[poscol] is None and padrao_banco and validos_cabecalho[poscol] in padrao_banco):
+                            linha_atualizar[validos_cabecalho[poscol]] = linha[poscol]
+                    if com_impressao:
+                        linha_atualizar[coluna_impressao] = None
+
+                    # Adiciona a linha de atualização se houver alguma alteração
+                    if len(linha_atualizar)>1:
+                        dados_atualizar.append(linha_atualizar)
+
+        # Atualiza os dados existentes utilizando bulk (executemany, os parâmetros são enviados por linha)
+        if dados_atualizar:
+            with self._metricas.etapa("atualizar", "gravar_alterados"):
+                session.execute(
+                    update(model_class),
+                    dados_atualizar
+                )
+                session.flush()
+
+    def _atualizar_upsert(self, session: Session, model_class, coluna_id: str, lote: LoteColunar, posicoes: List[int]):
+        '''
+        Estratégia "upsert": envia INSERT ... ON CONFLICT (id) DO UPDATE ... WHERE <alterado> por bloco (posicoes do lote).
+        Em drivers com insertmanyvalues (ex.: psycopg2) cada bloco vira uma única instrução com várias linhas.
+        Linhas sem alteração não são regravadas e linhas com id inexistente são incluídas com o id informado.
+        '''
+        tabela_sql = model_class.__table__
+        insert_dialeto = _INSERTS_UPSERT[self._engine.dialect.name]
+        validos_cabecalho = lote.cabecalho
+        colunas_atualizar = [col for col in validos_cabecalho if col != coluna_id]
+        #Com a impressão digital completa basta comparar a impressão, sem ela (nula) compara as demais colunas
+        coluna_impressao = self._colunas_impressao.get(tabela_sql.name)
+        colunas_comparadas = [col for col in colunas_atualizar if col != coluna_impressao]
+        if coluna_impressao in colunas_atualizar and lote.valor(posicoes[0], -1) is not None:
+            colunas_comparadas = [coluna_impressao]
+
+        def comparavel(coluna):
+            #JSON não possui operador de igualdade no PostgreSQL, compara a representação em texto
+            if isinstance(coluna.type, types.JSON):
+                return cast(coluna, types.Text)
+            return coluna
+
+        #Gera os blocos respeitando o limite de parâmetros (linhas x colunas) e sem repetir o id dentro do mesmo bloco
+        linhas_por_bloco = max(1, self.limite_parametros(tabela_sql.name) // len(validos_cabecalho))
+        blocos = [] #posições do lote de cada bloco, os parâmetros ({coluna_id: valor, coluna1: valor1, ...}) são montados no envio
+        ids_bloco = set()
+        for posicao, id in zip(posicoes, lote.coluna(0, posicoes)):
+            if not blocos or len(blocos[-1]) >= linhas_por_bloco or id in ids_bloco:
+                blocos.append([])
+                ids_bloco = set()
+            blocos[-1].append(posicao)
+            ids_bloco.add(id)
+
+        #Instrução única (compilada uma vez e reaproveitada), os blocos são enviados via executemany/insertmanyvalues
+        stmt = insert_dialeto(tabela_sql)
+        #Colunas NOT NULL com padrão calculado: a célula vazia (nula) mantém o valor atual
+        padrao_banco = self._colunas_padrao_banco.get(tabela_sql.name, set())
+        if colunas_comparadas:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[tabela_sql.c[coluna_id]],
+                set_={col: func.coalesce(stmt.excluded[col], tabela_sql.c[col]) if col in padrao_banco else stmt.excluded[col] for col in colunas_atualizar},
+                where=or_(*[comparavel(tabela_sql.c[col]).is_distinct_from(comparavel(stmt.excluded[col])) for col in colunas_comparadas])
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[tabela_sql.c[coluna_id]])
+        stmt = stmt.execution_options(insertmanyvalues_page_size=linhas_por_bloco)
 
-    def atualizar(self,tabela:str,matriz: List[List[Any]]):
+        with self._metricas.etapa("atualizar", "gravar_alterados"):
+            for bloco in blocos:
+                session.execute(stmt, list(lote.dicionarios(bloco)))
+            session.flush()
+
+    def atualizar(self,tabela:str,matriz: List[List[Any]], linhas_origem: List[int] = None, validar_duplicados: bool = True):
         '''
         Atualiza os dados de uma tabela com base em uma matriz de dados.
         A matriz deve conter os dados na mesma ordem das colunas da tabela.
         Cada linha representa um registro a ser atualizado.
+        Equivale a preparar_atualizacao (conversão e pré-validação, sem acessar o banco) seguido de gravar_atualizacao.
+        '''
+        return self.gravar_atualizacao(self.preparar_atualizacao(tabela, matriz, linhas_origem, validar_duplicados))
+
+    def preparar_atualizacao(self,tabela:str,matriz: List[List[Any]], linhas_origem: List[int] = None, validar_duplicados: bool = True) -> AtualizacaoPreparadaDict:
+        '''
+        Primeira etapa do atualizar, sem nenhuma instrução SQL: converte cada coluna com o seu conversor e aplica a pré-validação
+        do metadata (classes/validacao.py), levantando ErroValidacao com todos os erros encontrados (linha e coluna de cada um).
+        linhas_origem informa a linha da matriz original de cada linha quando a matriz recebida é um recorte (ex.: Excel.atualizar)
+        e validar_duplicados procura valores repetidos na matriz nas colunas únicas.
+        Com DB_PARALELO_PROCESSOS, matrizes a partir de DB_PARALELO_MIN_LINHAS linhas são convertidas em processos (classes/paralelo.py), com o mesmo resultado.
         '''
         if tabela not in self._estrutura:
             raise ValueError(f"Tabela '{tabela}' não encontrada na estrutura do banco de dados.")
         
-        # Importa dinamicamente o modelo da tabela
-        try:
-            model_module = importlib.import_module(f"app.api.excel.models.{tabela}")
-            model_class = getattr(model_module, tabela.capitalize())
-        except (ModuleNotFoundError, AttributeError):
-            raise ValueError(f"Modelo para a tabela '{tabela}' não encontrado.")
-        
         #Coleta o nome da coluna de id
         coluna_id = self._primarias[tabela]
         if not coluna_id:
@@ -506,115 +1251,138 @@ class Db(metaclass=_Singleton):
         if matriz[0][0] != coluna_id:
             raise ValueError(f"A primeira coluna da matriz deve ser '{coluna_id}' para a tabela '{tabela}'.")
 
-        #Verifica se é autoincremento
+        #Coleta as colunas válidas da primeira linha da matriz (a impressão digital é calculada aqui, o valor enviado na matriz é ignorado)
+        posicoes_colunas = [poscol for poscol, col in enumerate(matriz[0]) if col in self._estrutura[tabela] and col != self._colunas_impressao.get(tabela)]
+        validos_cabecalho = [matriz[0][poscol] for poscol in posicoes_colunas]
+        conversores = [self._conversores_atualizar[tabela][col] for col in validos_cabecalho]
+        linhas = matriz[1:] # as linhas podem ter colunas além do cabeçalho (ex.: MD no Excel.atualizar), são ignoradas
+        if linhas_origem is None:
+            linhas_origem = range(2, len(linhas) + 2)
+        validador = self._validadores[tabela]
+        impressao = self._planejar_impressao(tabela, validos_cabecalho)
+
+        #Matrizes grandes: conversão, regras por linha e impressão digital em processos, as regras da matriz inteira ficam aqui
+        if self._conversao_paralela.ativa(len(linhas)):
+            with self._metricas.etapa("atualizar", "converter_paralelo"):
+                posicoes_impressao = impressao[1] if impressao else None
+                compactas, erros = self._conversao_paralela.converter(linhas, posicoes_colunas, conversores, validos_cabecalho, validador, linhas_origem, posicoes_impressao)
+                lote = LoteColunar(validos_cabecalho + ([impressao[0]] if posicoes_impressao is not None else []), compactas=compactas)
+            with self._metricas.etapa("atualizar", "validar_colunas"):
+                erros.extend(validador.validar_matriz(validos_cabecalho, lambda nome: lote.coluna(lote.cabecalho.index(nome)), linhas_origem, validar_duplicados))
+                if erros:
+                    raise ErroValidacao(ordenar_erros(erros, validos_cabecalho))
+            if impressao is not None and posicoes_impressao is None:
+                lote.acrescentar_coluna(impressao[0], [None] * len(lote))
+            return {"tabela": tabela, "lote": lote}
+
+        #Converte cada coluna com o seu conversor
+        with self._metricas.etapa("atualizar", "converter"):
+            validos_colunas = [[converter(lin[poscol]) for lin in linhas] for poscol, converter in zip(posicoes_colunas, conversores)]
+
+        #Valida as colunas convertidas antes de montar o lote, todos os erros são devolvidos juntos
+        with self._metricas.etapa("atualizar", "validar_colunas"):
+            erros = validador.validar(validos_cabecalho, validos_colunas, linhas_origem, validar_duplicados)
+            if erros:
+                raise ErroValidacao(erros)
+
+        #Lote colunar: as colunas convertidas são compactadas e não há cópia por linha
+        with self._metricas.etapa("atualizar", "montar_lote"):
+            lote = LoteColunar(validos_cabecalho, validos_colunas)
+            if impressao is not None:
+                coluna_impressao, posicoes_impressao = impressao
+                lote.acrescentar_coluna(coluna_impressao, impressoes([validos_colunas[p] for p in posicoes_impressao]) if posicoes_impressao is not None else [None] * len(lote))
+        return {"tabela": tabela, "lote": lote}
+
+    def gravar_atualizacao(self, preparada: AtualizacaoPreparadaDict, antes_commit: Callable[[Session, List[Any]], None] = None) -> List[Any]:
+        '''
+        Segunda etapa do atualizar: grava a matriz já convertida e validada por preparar_atualizacao
+        e retorna os ids de cada linha (os novos ids nas inclusões).
+        antes_commit(session, ids) é chamado na mesma transação da gravação, antes do commit
+        (ex.: os jobs registram o lote gravado junto com os dados, ver classes/jobs.py).
+        '''
+        tabela = preparada["tabela"]
+        lote = preparada["lote"]
+        validos_cabecalho = lote.cabecalho
+        ids = lote.coluna(0)
+        model_class = self._modelo_classe(tabela)
+        coluna_id = self._primarias[tabela]
         coluna_autoincremento = self._estrutura[tabela][coluna_id]["autoincremento"]
-        
-        #Coleta as colunas válidas da primeira linha da matriz
-        validos_cabecalho = []
-        validos_dados = [[] for _ in range(len(matriz)-1)]  # Inicializa uma lista para cada linha
-        for poscol, col in enumerate(matriz[0]):
-            if col in self._estrutura[tabela]:
-                validos_cabecalho.append(col)
-                for poslin, lin in enumerate(matriz[1:]):
-                    validos_dados[poslin].append(self.obter_valor(lin[poscol],tabela=tabela,coluna=col))
 
         #Processa os dados
+        estrategia = self._resolver_estrategia()
+        validador = self._validadores[tabela]
+        ausentes = validador.colunas_ausentes(validos_cabecalho)
         dados_ids = [] #salva os ids dos novos dados
         with self as session:
-            #Coleta todos os ids da tabela
-            ids_existentes = session.execute(select(getattr(model_class, coluna_id))).scalars().all()
+            #No upsert sem autoincremento o próprio banco resolve se o id existe (ON CONFLICT),
+            #exceto quando faltam colunas obrigatórias: os ids que não existem precisam ser conhecidos para recusar a inclusão
+            ids_existentes = None
+            if estrategia != "upsert" or coluna_autoincremento or ausentes:
+                #Coleta apenas os ids da matriz que já existem na tabela (em lotes que respeitam o limite de parâmetros)
+                with self._metricas.etapa("atualizar", "buscar_ids"):
+                    ids_matriz = list({id for id in ids if id is not None})
+                    ids_existentes = set()
+                    for ids_lote in self._planejar_lotes(tabela, ids_matriz):
+                        stmt = select(getattr(model_class, coluna_id)).where(
+                            getattr(model_class, coluna_id).in_(ids_lote)
+                        )
+                        ids_existentes.update(session.execute(stmt).scalars().all())
 
-            #Separa os dados entre novos e existentes
-            dados_existentes = []
-            dados_existentes_ids = []
-            dados_novos = []
+            #Separa as posições do lote entre novos e existentes
+            posicoes_existentes = []
+            posicoes_novas = []
             dados_origens = [] #lista para saber de onde veio o dado
             
-            for linha in validos_dados:  # Ignora o cabeçalho
-                dados_existentes_ids.append(linha[0])  # Coleta o id da linha
-                if linha[0] in ids_existentes:
-                    dados_existentes.append(linha)
+            for posicao, id in enumerate(ids):
+                if ids_existentes is None or id in ids_existentes:
+                    posicoes_existentes.append(posicao)
                     dados_origens.append("e")
                 else:
-                    dados_novos.append(linha)
+                    posicoes_novas.append(posicao)
                     dados_origens.append("n")
 
-            #Caso existam dados existentes, pesquisa na base os campos validos_cabecalhos para os ids dados_existentes_ids
-            if dados_existentes:
-                # Atualiza para processar no máximo 900 ids por vez
-                resultados_existentes = []
-                for i in range(0, len(dados_existentes_ids), 900):
-                    ids_lote = dados_existentes_ids[i:i+900]
-                    stmt = select(*[getattr(model_class, col) for col in validos_cabecalho]).where(
-                        getattr(model_class, coluna_id).in_(ids_lote)
-                    )
-                    resultados_existentes.extend(session.execute(stmt).all())
-
-                #Gera o dados atualizar caso algum campo tenha sido alterado
-                dados_atualizar = [] #estrutura de blocos a serem atualizados [[{coluna_id: valor, coluna1: valor1, ...}, ...],[{coluna_id: valor, coluna1: valor1, ...}, ...]]
-                dados_atualizar_bloco_atual = -1
-                total_campos = 0
-
-                for poslin, linha in enumerate(dados_existentes):
-                    #gera a linha de atualização
-                    linha_atualizar = {}
-                    linha_atualizar[coluna_id] = linha[0]
-                    for poscol, col in enumerate(linha[1:], 1):  # Ignora o id
-                        if col != resultados_existentes[poslin][poscol]:
-                            linha_atualizar[validos_cabecalho[poscol]] = col
-                    
-                    # Adiciona a linha de atualização se houver alguma alteração
-                    if len(linha_atualizar)>1:
-                        # Limite de 900 campos por bloco
-                        if total_campos >= 900 or dados_atualizar_bloco_atual == -1:  
-                            dados_atualizar.append([])
-                            total_campos = 0
-                            dados_atualizar_bloco_atual += 1
-                        # Adiciona a linha de atualização ao bloco atual
-                        dados_atualizar[dados_atualizar_bloco_atual].append(linha_atualizar)
-                        total_campos += len(linha_atualizar)
-
-                # Atualiza os dados existentes utilizando bulk
-                if dados_atualizar:
-                    for bloco in dados_atualizar:
-                        session.execute(
-                            update(model_class),
-                            bloco
-                        )
-                        session.flush()
+            #Ids informados que não existem também são inclusões (a pré-validação só conhece as linhas sem id)
+            if ausentes and posicoes_novas:
+                erros = validador.validar_inclusoes(validos_cabecalho, len(posicoes_novas))
+                if erros:
+                    raise ErroValidacao(erros)
+
+            #Atualiza os dados existentes com a estratégia escolhida
+            #Sem todas as colunas obrigatórias o upsert não serve (o banco confere o NOT NULL da linha proposta antes do ON CONFLICT)
+            if posicoes_existentes:
+                estrategia_existentes = "diff" if ausentes and estrategia == "upsert" else estrategia
+                self._estrategias_atualizacao[estrategia_existentes](session, model_class, coluna_id, lote, posicoes_existentes)
                 
             #Se houver dados novos, adiciona-os
-            if dados_novos:
-                dados_incluir = []  # estrutura de blocos a serem inseridos [[{coluna1: valor1, ...}, ...],[{coluna1: valor1, ...}, ...]]
-                dados_novos_bloco_atual = -1
-                total_campos = 0
-                # Processa os dados novos
-                for poslin, linha in enumerate(dados_novos):
-                    novo_dado = {col: valor for col, valor in zip(validos_cabecalho, linha)}
-                    if coluna_autoincremento and coluna_id in novo_dado:
-                        del novo_dado[coluna_id]  # Remove o id se for autoincremento
-                    # Limite de 900 campos por bloco
-                    if total_campos >= 900 or dados_novos_bloco_atual == -1:
-                        dados_incluir.append([])
-                        dados_novos_bloco_atual += 1
-                        total_campos = 0
-                    # Adiciona o novo dado ao bloco atual
-                    dados_incluir[dados_novos_bloco_atual].append(novo_dado)
-                    total_campos += len(novo_dado)
+            if posicoes_novas:
+                # Colunas inseridas (sem o id se for autoincremento), os dicionários {coluna1: valor1, ...} são montados por execução
+                colunas_incluir = [col for col in validos_cabecalho if not (coluna_autoincremento and col == coluna_id)]
 
                 # Insere os novos dados e obtém o id
-                for bloco in dados_incluir:
-                    stmt = insert(model_class).returning(getattr(model_class, coluna_id))
-                    result = session.execute(stmt, bloco)
-                    dados_ids.extend(result.scalars().all())
-
-        # Gera uma lista de ids com o mesmo número de linhas de validos_dados com base nos dados_origens e dados_ids
-        dados_ids_final = []
-        for pos, origem in enumerate(dados_origens):
-            if origem == "e":
-                dados_ids_final.append(dados_existentes_ids[pos])
-            elif origem == "n":
-                dados_ids_final.append(dados_ids.pop(0))  # Pega o próximo id dos novos dados
+                with self._metricas.etapa("atualizar", "incluir"):
+                    stmt = insert(model_class).returning(getattr(model_class, coluna_id), sort_by_parameter_order=True)
+                    campos_por_linha = len(colunas_incluir) or 1
+                    if self._engine.dialect.use_insertmanyvalues:
+                        #O próprio SQLAlchemy pagina o executemany (insertmanyvalues), limitado aos parâmetros da tabela
+                        linhas_por_pagina = max(1, self.limite_parametros(tabela) // campos_por_linha)
+                        linhas_por_execucao = max(1, _LINHAS_POR_EXECUCAO // linhas_por_pagina) * linhas_por_pagina
+                        stmt = stmt.execution_options(insertmanyvalues_page_size=linhas_por_pagina)
+                        for inicio in range(0, len(posicoes_novas), linhas_por_execucao):
+                            result = session.execute(stmt, list(lote.dicionarios(posicoes_novas[inicio:inicio + linhas_por_execucao], colunas_incluir)))
+                            dados_ids.extend(result.scalars().all())
+                    else:
+                        for bloco in self._planejar_lotes(tabela, posicoes_novas, campos_por_linha):
+                            result = session.execute(stmt, list(lote.dicionarios(bloco, colunas_incluir)))
+                            dados_ids.extend(result.scalars().all())
+
+            # Gera uma lista de ids com o mesmo número de linhas do lote com base nos dados_origens e dados_ids
+            dados_ids_final = intercalar_ids(dados_origens, {"e": [ids[p] for p in posicoes_existentes], "n": dados_ids})
+            if antes_commit is not None:
+                antes_commit(session, dados_ids_final)
+
+        #Invalida os resultados em cache que utilizam a tabela
+        self._cache.invalidar(tabela)
+        self._metricas.linhas("atualizar", "saida", len(dados_ids_final))
 
         #Retorne os ids atualizados
         return dados_ids_final
@@ -627,12 +1395,8 @@ class Db(metaclass=_Singleton):
         if tabela not in self._estrutura:
             raise ValueError(f"Tabela '{tabela}' não encontrada na estrutura do banco de dados.")
         
-        # Importa dinamicamente o modelo da tabela
-        try:
-            model_module = importlib.import_module(f"app.api.excel.models.{tabela}")
-            model_class = getattr(model_module, tabela.capitalize())
-        except (ModuleNotFoundError, AttributeError):
-            raise ValueError(f"Modelo para a tabela '{tabela}' não encontrado.")
+        # Coleta o modelo da tabela no registro
+        model_class = self._modelo_classe(tabela)
         
         #Coleta o nome da coluna de id
         coluna_id = self._primarias[tabela]
@@ -642,15 +1406,22 @@ class Db(metaclass=_Singleton):
         #Verifica se os ids são válidos
         if not ids:
             raise ValueError("A lista de ids não pode estar vazia.")
+
+        #Converte os ids para o tipo da chave (ex.: ids lidos de CSV chegam como texto)
+        converter = self._conversores[tabela][coluna_id]
+        ids = [converter(id) for id in ids]
         
         #processa a remoção dos ids passados
-        with self as session:
-            # Remove em lotes de até 900 ids por vez usando SQLAlchemy 2.0 style
-            for i in range(0, len(ids), 900):
-                ids_lote = ids[i:i+900]
+        with self._metricas.etapa("atualizar", "excluir"), self as session:
+            # Remove em lotes que respeitam o limite de parâmetros usando SQLAlchemy 2.0 style
+            for ids_lote in self._planejar_lotes(tabela, ids):
                 stmt = delete(model_class).where(getattr(model_class, coluna_id).in_(ids_lote))
                 session.execute(stmt)
                 session.flush()
+        self._metricas.linhas("atualizar", "saida", len(ids))
+
+        #Invalida os resultados em cache que utilizam a tabela
+        self._cache.invalidar(tabela)
 
     
 if __name__ == "__main__":
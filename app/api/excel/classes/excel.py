@@ -1,7 +1,10 @@
-from typing import List,Any
+from typing import List,Any,Callable,Dict,Iterable,Iterator,Optional
+from sqlalchemy.orm import Session
+import itertools
 
-from app.api.excel.classes.db import Db,RelacoesDict,EstruturaTabela
+from app.api.excel.classes.db import Db,RelacoesDict,EstruturaTabela,PaginaDict,intercalar_ids
 from app.api.excel.classes.singleton import Singleton
+from app.api.excel.classes.metricas import Metricas
 
 class Excel(metaclass=Singleton):
     def __init__(self):
@@ -12,22 +15,10 @@ class Excel(metaclass=Singleton):
     def db(self)-> Db:
         return self._db
 
-    def pesquisar(self,colunas: List[List[str]], tabelas: List[List[str]],criterios: List[List[Any]] = None, criterios_tabelas: List[List[str]] = None,relacoes: List[List[str]] = None,caractere_especial = "-") -> List[List[Any]]:
+    def _preparar_pesquisa(self,colunas: List[List[str]], tabelas: List[List[str]],criterios: List[List[Any]] = None, criterios_tabelas: List[List[str]] = None,relacoes: List[List[str]] = None,caractere_especial = "-", agregacoes: List[List[str]] = None, ordenacao: List[List[str]] = None, top: int = None) -> Dict[str, Any]:
         '''
-        Realiza uma pesquisa na base de dados utilizando os parâmetros fornecidos para colunas, tabelas, critérios, relações e caractere especial.
-        Args:
-            colunas (List[List[str]]): Lista contendo uma linha com os nomes das colunas a serem selecionadas.
-            tabelas (List[List[str]]): Lista contendo uma linha com os nomes das tabelas a serem consultadas.
-            criterios (List[List[Any]], optional): Lista contendo ao menos duas linhas, uma para os nomes das colunas e outra para os valores dos critérios de filtragem. Pode ser None.
-            criterios_tabelas (List[List[str]], optional): Lista contendo uma linha com os nomes das tabelas relacionadas aos critérios. Pode ser None.
-            relacoes (List[List[str]], optional): Lista contendo as relações entre as tabelas com 5 colunas: tabela A, tabela B, Coluna tabela A, Coluna Tabela B, Relação(inner, left, right). Pode ser None.
-            caractere_especial (str, optional): Caractere especial utilizado na consulta. Padrão é "-".
-        Returns:
-            List[List[Any]]: Resultado da consulta, contendo os dados encontrados conforme os parâmetros informados.
-        Raises:
-            ValueError: Se as listas de colunas, tabelas ou critérios não estiverem no formato esperado.
+        Valida os parâmetros da pesquisa no formato do Excel e os converte nos argumentos do Db.consultar_base.
         '''
-        
         #Testa se colunas possúi apenas uma linha
         if len(colunas) != 1:
             raise ValueError("A lista de colunas deve conter apenas uma linha com os nomes das colunas.")
@@ -52,6 +43,12 @@ class Excel(metaclass=Singleton):
         #Coleta os critérios em uma lista
         criterios_tabelas_ok = criterios_tabelas[0] if criterios_tabelas is not None else None
 
+        #Testa se agregacoes e ordenacao possuem apenas uma linha ou são None (uma opção por coluna)
+        if agregacoes is not None and len(agregacoes) != 1:
+            raise ValueError("A lista de agregações deve conter apenas uma linha com a agregação de cada coluna.")
+        if ordenacao is not None and len(ordenacao) != 1:
+            raise ValueError("A lista de ordenação deve conter apenas uma linha com a ordenação de cada coluna.")
+
         #Gea as relações
         relacoes_ok = None
         if relacoes is not None:
@@ -68,23 +65,73 @@ class Excel(metaclass=Singleton):
                 }
                 relacoes_ok.append(relacao_dict)
         
+        return {
+            "colunas": colunas_ok,
+            "tabelas": tabelas_ok,
+            "criterios": criterios,
+            "tabelas_criterios": criterios_tabelas_ok,
+            "relacoes": relacoes_ok,
+            "caractere_invalido": caractere_especial,
+            "agregacoes": agregacoes[0] if agregacoes is not None else None,
+            "ordenacao": ordenacao[0] if ordenacao is not None else None,
+            "top": top,
+        }
+
+    def pesquisar(self,colunas: List[List[str]], tabelas: List[List[str]],criterios: List[List[Any]] = None, criterios_tabelas: List[List[str]] = None,relacoes: List[List[str]] = None,caractere_especial = "-", agregacoes: List[List[str]] = None, ordenacao: List[List[str]] = None, top: int = None) -> List[List[Any]]:
+        '''
+        Realiza uma pesquisa na base de dados utilizando os parâmetros fornecidos para colunas, tabelas, critérios, relações e caractere especial.
+        Args:
+            colunas (List[List[str]]): Lista contendo uma linha com os nomes das colunas a serem selecionadas.
+            tabelas (List[List[str]]): Lista contendo uma linha com os nomes das tabelas a serem consultadas.
+            criterios (List[List[Any]], optional): Lista contendo ao menos duas linhas, uma para os nomes das colunas e outra para os valores dos critérios de filtragem. Pode ser None.
+            criterios_tabelas (List[List[str]], optional): Lista contendo uma linha com os nomes das tabelas relacionadas aos critérios. Pode ser None.
+            relacoes (List[List[str]], optional): Lista contendo as relações entre as tabelas com 5 colunas: tabela A, tabela B, Coluna tabela A, Coluna Tabela B, Relação(inner, left, right). Pode ser None.
+            caractere_especial (str, optional): Caractere especial utilizado na consulta. Padrão é "-".
+            agregacoes (List[List[str]], optional): Lista contendo uma linha com a agregação de cada coluna (soma, contar, contar_distintos, media, minimo, maximo ou vazio), as colunas vazias são agrupadas. Pode ser None.
+            ordenacao (List[List[str]], optional): Lista contendo uma linha com a ordenação de cada coluna (asc, desc ou vazio), aplicada da esquerda para a direita. Pode ser None.
+            top (int, optional): Quantidade máxima de linhas retornadas. Pode ser None.
+        Returns:
+            List[List[Any]]: Resultado da consulta, contendo os dados encontrados conforme os parâmetros informados.
+        Raises:
+            ValueError: Se as listas de colunas, tabelas ou critérios não estiverem no formato esperado.
+        '''
+        
         #Pesquisa
-        resultado = self.db.consultar_base(
-            colunas=colunas_ok,
-            tabelas=tabelas_ok,
-            criterios=criterios,
-            tabelas_criterios=criterios_tabelas_ok,
-            relacoes=relacoes_ok,
-            caractere_invalido=caractere_especial)
+        resultado = self.db.consultar_base(**self._preparar_pesquisa(colunas, tabelas, criterios, criterios_tabelas, relacoes, caractere_especial, agregacoes, ordenacao, top))
         
         #Retorna o resultado
         return resultado
 
-    def atualizar(self, tabela: str, matriz:List[List[Any]]) -> List[Any]:
+    def pesquisar_stream(self,colunas: List[List[str]], tabelas: List[List[str]],criterios: List[List[Any]] = None, criterios_tabelas: List[List[str]] = None,relacoes: List[List[str]] = None,caractere_especial = "-", agregacoes: List[List[str]] = None, ordenacao: List[List[str]] = None, top: int = None, tamanho_lote: int = 1000) -> Iterator[List[Any]]:
+        '''
+        Igual ao pesquisar, porém devolve as linhas aos poucos (cursor no servidor) sem manter o resultado inteiro em memória.
+        '''
+        return self.db.consultar_base_stream(**self._preparar_pesquisa(colunas, tabelas, criterios, criterios_tabelas, relacoes, caractere_especial, agregacoes, ordenacao, top), tamanho_lote=tamanho_lote)
+
+    def pesquisar_pagina(self,colunas: List[List[str]], tabelas: List[List[str]],criterios: List[List[Any]] = None, criterios_tabelas: List[List[str]] = None,relacoes: List[List[str]] = None,caractere_especial = "-", agregacoes: List[List[str]] = None, ordenacao: List[List[str]] = None, top: int = None, limite: int = 1000, cursor: str = None) -> PaginaDict:
+        '''
+        Igual ao pesquisar, porém paginado pela chave primária da tabela base (a mais à esquerda das relações).
+        Retorna {"dados": [...], "cursor": ...}, basta repetir a chamada com o cursor recebido até ele vir None.
+        '''
+        return self.db.consultar_base_pagina(**self._preparar_pesquisa(colunas, tabelas, criterios, criterios_tabelas, relacoes, caractere_especial, agregacoes, ordenacao, top), limite=limite, cursor=cursor)
+
+    def tipos_colunas(self, colunas: List[List[str]], tabelas: List[List[str]], agregacoes: List[List[str]] = None) -> List[Optional[type]]:
+        '''
+        Tipo Python de cada coluna da pesquisa (None para colunas inválidas), usado nos formatos tipados da resposta (ex.: Arrow).
+        '''
+        agregacoes_ok = agregacoes[0] if agregacoes else [None] * len(colunas[0])
+        return [self.db.tipo_python(tabela, coluna, agregacao) for coluna, tabela, agregacao in zip(colunas[0], tabelas[0], agregacoes_ok)]
+
+    def atualizar(self, tabela: str, matriz:List[List[Any]], validar_duplicados: bool = True, linha_inicial: int = 2, antes_commit: Callable[[Session, List[Any]], None] = None) -> List[Any]:
         '''
         Recebe uma matriz com o id na primeira coluna e MD na última coluna.
         A última coluna deve conter 'A' (Atualizar/Incluir) ou 'D' (Excluir).
         Retorna uma lista com os ids atualizados ou excluídos.
+        As linhas 'A' são validadas pelo metadata da tabela antes de qualquer alteração (nulos, tipos, tamanho, Enum e, com
+        validar_duplicados, valores repetidos em colunas únicas), os erros de todas as linhas vêm juntos em ErroValidacao.
+        linha_inicial é o número da primeira linha de dados nos erros (ex.: lotes de uma carga maior).
+        antes_commit(session, ids) recebe o mesmo retorno do atualizar dentro da transação das linhas 'A', antes do commit
+        (sem linhas 'A', em uma transação própria após as exclusões), ex.: marcação do lote gravado pelos jobs.
         Exemplo de matriz:
         [
             ['id', 'name', 'email', 'MD'],
@@ -112,59 +159,86 @@ class Excel(metaclass=Singleton):
         if matriz[0][-1] != "MD":
             raise ValueError("A última coluna da matriz deve ser chamada 'MD' para indicar a ação de atualização A (Atualizar ou Incluir) ou D (Excluir).")
 
-        #Coleta a estrutura da tabela
-        estrutura_tabela = self.coletar_estrutura([tabela])
-        if not estrutura_tabela:
-            raise ValueError(f"A estrutura da tabela '{tabela}' não foi encontrada.")
+        metricas = Metricas()
+        metricas.linhas("atualizar", "entrada", len(matriz) - 1)
+        with metricas.etapa("atualizar", "validar"):
+            #Coleta a estrutura da tabela
+            estrutura_tabela = self.coletar_estrutura([tabela])
+            if not estrutura_tabela:
+                raise ValueError(f"A estrutura da tabela '{tabela}' não foi encontrada.")
         
-        #Coleta as colunas com Enums
-        colunas_com_enum = {col: info["enum"] for col, info in estrutura_tabela[tabela].items() if info.get("enum")}
-
-        #Valida nas colunas dos dados passados
-        if colunas_com_enum:
-            erros_enum = []
-            for col, col_valor in enumerate(matriz[0][:-1]):  # Ignora a última coluna "MD"
-                if col_valor in colunas_com_enum:
-                    for lin in enumerate(matriz[1:]):
-                        lin_valor = lin[1][col]
-                        if lin_valor not in colunas_com_enum[col_valor]:
-                            erros_enum.append(f"Linha {lin[0]+1:03}: O valor '{lin_valor}' da coluna '{col_valor}' não é válido.")
-
-                if erros_enum:
-                    erros_enum.append("Os valores devem ser um dos seguintes: " + ", ".join(colunas_com_enum[col_valor]))
-                    raise ValueError("Erros de validação encontrados:\n" + "\n".join(erros_enum))
-
-
-        #Separa as linhas da matriz em dois grupos: atualizar_incluir e excluir
-        ids = [''] #inicializa ids com uma string vazia (cabeçalho)
-        matriz_atualizar_incluir = [matriz[0][:-1]]  # Mantém a primeira linha (cabeçalho) sem a última coluna
-        matriz_excluir = []
-        for linha_pos, linha in enumerate(matriz[1:]):
-            if linha[-1].upper() not in ['A', 'D','']:
-                raise ValueError(f"A última coluna da matriz deve conter 'A' (Atualizar/Incluir) ou 'D' (Excluir), erro na linha {linha_pos + 2}.")
+            #Separa as linhas da matriz em dois grupos: atualizar_incluir e excluir
+            ids = [''] #inicializa ids com uma string vazia (cabeçalho)
+            matriz_atualizar_incluir = [matriz[0][:-1]]  # Mantém a primeira linha (cabeçalho) sem a última coluna
+            linhas_atualizar_incluir = [] # linha de cada registro na matriz recebida, usada nos erros de validação
+            matriz_excluir = []
+            for linha_pos, linha in enumerate(matriz[1:]):
+                if linha[-1].upper() not in ['A', 'D','']:
+                    raise ValueError(f"A última coluna da matriz deve conter 'A' (Atualizar/Incluir) ou 'D' (Excluir), erro na linha {linha_inicial + linha_pos}.")
             
-            tipo = linha[-1].upper()
-            if tipo == 'A':
-                matriz_atualizar_incluir.append(linha[:-1])
-            elif tipo == 'D':
-                matriz_excluir.append(linha[0])
-            ids.append(tipo)
+                tipo = linha[-1].upper()
+                if tipo == 'A':
+                    matriz_atualizar_incluir.append(linha) # sem cópia: o Db só lê as colunas do cabeçalho, a coluna MD fica de fora
+                    linhas_atualizar_incluir.append(linha_inicial + linha_pos)
+                elif tipo == 'D':
+                    matriz_excluir.append(linha[0])
+                ids.append(tipo)
+
+        #Converte e valida as linhas a atualizar ou incluir antes de qualquer alteração no banco (inclusive as exclusões)
+        preparada = None
+        if len(matriz_atualizar_incluir)>1:
+            preparada = self.db.preparar_atualizacao(tabela, matriz_atualizar_incluir, linhas_atualizar_incluir, validar_duplicados)
 
         #Exclui os dados se necessário
         if matriz_excluir:
             self.db.remover(tabela, matriz_excluir)
 
         #Atualiza ou inclui os dados
-        if len(matriz_atualizar_incluir)>1:
-            print(matriz_atualizar_incluir)
-            novos_ids = self.db.atualizar(tabela, matriz_atualizar_incluir)
-            for i, id in enumerate(ids):
-                if id == 'A':
-                    ids[i] = novos_ids.pop(0)
+        if preparada is not None:
+            marcar = None
+            if antes_commit is not None:
+                #Chamado dentro do gravar_atualizacao, ids ainda contém as ações de cada linha
+                marcar = lambda session, novos_ids: antes_commit(session, intercalar_ids(ids, {'A': novos_ids}))
+            novos_ids = self.db.gravar_atualizacao(preparada, marcar)
+            ids = intercalar_ids(ids, {'A': novos_ids})
+        elif antes_commit is not None:
+            with self.db as session:
+                antes_commit(session, ids)
 
         #Retorna
         return ids
     
+    def atualizar_em_lotes(self, tabela: str, linhas: Iterable[List[Any]], tamanho_lote: int = 5000) -> List[Any]:
+        '''
+        Igual ao atualizar, porém recebe as linhas de um iterador (cabeçalho primeiro) e grava em lotes de `tamanho_lote` linhas,
+        sem manter a matriz inteira em memória (ex.: upload em streaming de NDJSON/CSV).
+        Cada lote é gravado em sua própria transação, em caso de erro os lotes anteriores permanecem gravados.
+        Retorna a mesma lista do atualizar ('' para o cabeçalho e um item por linha).
+        '''
+        if tamanho_lote < 1:
+            raise ValueError("O tamanho do lote deve ser maior que zero.")
+        iterador = iter(linhas)
+        cabecalho = next(iterador, None)
+        if not cabecalho:
+            raise ValueError("A carga deve começar pelo cabeçalho com os nomes das colunas.")
+
+        ids = ['']
+        linha_inicial = 2
+        while True:
+            lote = list(itertools.islice(iterador, tamanho_lote))
+            if not lote:
+                break
+            #MD vazio (ex.: campo vazio do CSV) não altera a linha
+            for linha in lote:
+                if linha and linha[-1] is None:
+                    linha[-1] = ''
+            try:
+                ids.extend(self.atualizar(tabela, [cabecalho] + lote, linha_inicial=linha_inicial)[1:])
+            except ValueError as e:
+                raise ValueError(f"Erro no lote iniciado na linha {linha_inicial} ({len(ids) - 1} linhas anteriores já gravadas): {e}")
+            linha_inicial += len(lote)
+        return ids
+
     def coletar_estrutura(self, tabelas: List[str])-> EstruturaTabela:
         estrutura = self.db.estrutura
         return {tabela: estrutura[tabela] for tabela in tabelas if tabela in estrutura}
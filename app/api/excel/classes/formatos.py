@@ -0,0 +1,309 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Literal, Optional
+import csv
+import io
+import itertools
+import json
+import zlib
+
+#Dependências opcionais (formatos e compressões ficam indisponíveis sem elas)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Tipagem
+FormatoPesquisa = Literal["json", "ndjson", "csv", "msgpack", "arrow"]
+CompressaoPesquisa = Literal["gzip", "zstd"]
+
+'''
+Codificação do resultado do pesquisar em formatos de resposta.
+O resultado é codificado em lotes conforme as linhas são lidas da base, cada lote gera um pedaço (bytes) da resposta:
+- json: lista de linhas (mesmo conteúdo do pesquisar)
+- ndjson: uma linha JSON por registro
+- csv: cabeçalho com os nomes das colunas e uma linha por registro
+- msgpack: sequência de objetos, o primeiro {"colunas": [...]} e depois um por lote com a lista de valores de cada coluna
+- arrow: Arrow IPC stream, um record batch por lote com o tipo de cada coluna vindo da estrutura do banco
+'''
+
+TIPOS_MIDIA: Dict[str, str] = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "msgpack": "application/vnd.msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Tipos de mídia aceitos no cabeçalho Accept para cada formato
+FORMATOS_POR_MIDIA: Dict[str, str] = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "text/csv": "csv",
+    "application/vnd.msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/msgpack": "msgpack",
+    "application/vnd.apache.arrow.stream": "arrow",
+}
+
+def _dependencia_formato(formato: str) -> Optional[str]:
+    if formato == "msgpack" and msgpack is None:
+        return "msgpack"
+    if formato == "arrow" and pa is None:
+        return "pyarrow"
+    return None
+
+def _dependencia_compressao(compressao: str) -> Optional[str]:
+    if compressao == "zstd" and zstandard is None:
+        return "zstandard"
+    return None
+
+def _preferencias(cabecalho: str) -> List[str]:
+    '''
+    Valores de um cabeçalho Accept/Accept-Encoding em ordem de preferência (q), sem os recusados (q=0).
+    '''
+    itens = []
+    for pos, parte in enumerate(cabecalho.split(",")):
+        valor, *parametros = [p.strip() for p in parte.split(";")]
+        q = 1.0
+        for parametro in parametros:
+            if parametro.startswith("q="):
+                try:
+                    q = float(parametro[2:])
+                except ValueError:
+                    q = 0.0
+        if valor and q > 0:
+            itens.append((-q, pos, valor.lower()))
+    return [valor for _, _, valor in sorted(itens)]
+
+def resolver_formato(formato: Optional[str] = None, accept: Optional[str] = None) -> FormatoPesquisa:
+    '''
+    Formato da resposta: o parâmetro formato tem prioridade, depois o cabeçalho Accept, o padrão é json.
+    Formatos pedidos via Accept sem a dependência instalada são ignorados, via parâmetro geram erro.
+    '''
+    if formato:
+        formato = formato.lower()
+        if formato not in TIPOS_MIDIA:
+            raise ValueError(f"Formato '{formato}' inválido. Use " + ", ".join(f"'{f}'" for f in TIPOS_MIDIA) + ".")
+        dependencia = _dependencia_formato(formato)
+        if dependencia:
+            raise ValueError(f"O formato '{formato}' precisa do pacote '{dependencia}' instalado no servidor.")
+        return formato
+
+    for midia in _preferencias(accept or ""):
+        formato = FORMATOS_POR_MIDIA.get(midia)
+        if formato and not _dependencia_formato(formato):
+            return formato
+    return "json"
+
+def resolver_compressao(compressao: Optional[str] = None, accept_encoding: Optional[str] = None) -> Optional[CompressaoPesquisa]:
+    '''
+    Compressão da resposta: o parâmetro compressao tem prioridade, depois o cabeçalho Accept-Encoding (zstd antes de gzip).
+    '''
+    if compressao:
+        compressao = compressao.lower()
+        if compressao not in ("gzip", "zstd"):
+            raise ValueError(f"Compressão '{compressao}' inválida. Use 'gzip' ou 'zstd'.")
+        dependencia = _dependencia_compressao(compressao)
+        if dependencia:
+            raise ValueError(f"A compressão '{compressao}' precisa do pacote '{dependencia}' instalado no servidor.")
+        return compressao
+
+    aceitas = _preferencias(accept_encoding or "")
+    for opcao in ("zstd", "gzip"):
+        if opcao in aceitas and not _dependencia_compressao(opcao):
+            return opcao
+    return None
+
+def _valor_texto(valor: Any) -> Any:
+    #Valores sem representação direta no JSON/msgpack
+    if isinstance(valor, (date, datetime, time)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return str(valor)
+
+#Codificadores: inicio() e fim() geram o começo e o final da resposta, lote(linhas) o pedaço de cada lote
+class _CodificadorJson:
+    def __init__(self, nomes: List[str], tipos: List[Optional[type]]):
+        self._primeiro = True
+
+    def inicio(self) -> bytes:
+        return b"["
+
+    def lote(self, linhas: List[List[Any]]) -> bytes:
+        texto = json.dumps(linhas, default=_valor_texto, ensure_ascii=False)[1:-1]
+        if not self._primeiro:
+            texto = "," + texto
+        self._primeiro = False
+        return texto.encode("utf-8")
+
+    def fim(self) -> bytes:
+        return b"]"
+
+class _CodificadorNdjson:
+    def __init__(self, nomes: List[str], tipos: List[Optional[type]]):
+        pass
+
+    def inicio(self) -> bytes:
+        return b""
+
+    def lote(self, linhas: List[List[Any]]) -> bytes:
+        return "".join(json.dumps(linha, default=_valor_texto, ensure_ascii=False) + "\n" for linha in linhas).encode("utf-8")
+
+    def fim(self) -> bytes:
+        return b""
+
+class _CodificadorCsv:
+    def __init__(self, nomes: List[str], tipos: List[Optional[type]]):
+        self._nomes = nomes
+        self._buffer = io.StringIO()
+        self._escritor = csv.writer(self._buffer, lineterminator="\n")
+
+    def _esvaziar(self) -> bytes:
+        texto = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return texto.encode("utf-8")
+
+    @staticmethod
+    def _celula(valor: Any) -> Any:
+        if valor is None or isinstance(valor, (str, int, float)):
+            return valor
+        if isinstance(valor, (list, dict)):
+            return json.dumps(valor, ensure_ascii=False)
+        return _valor_texto(valor)
+
+    def inicio(self) -> bytes:
+        self._escritor.writerow(self._nomes)
+        return self._esvaziar()
+
+    def lote(self, linhas: List[List[Any]]) -> bytes:
+        self._escritor.writerows([self._celula(valor) for valor in linha] for linha in linhas)
+        return self._esvaziar()
+
+    def fim(self) -> bytes:
+        return b""
+
+class _CodificadorMsgpack:
+    def __init__(self, nomes: List[str], tipos: List[Optional[type]]):
+        self._nomes = nomes
+        self._empacotador = msgpack.Packer(default=_valor_texto)
+
+    def inicio(self) -> bytes:
+        return self._empacotador.pack({"colunas": self._nomes})
+
+    def lote(self, linhas: List[List[Any]]) -> bytes:
+        #Orientado a colunas: [[valores da coluna 1], [valores da coluna 2], ...]
+        return self._empacotador.pack([list(coluna) for coluna in zip(*linhas)])
+
+    def fim(self) -> bytes:
+        return b""
+
+def _tipos_arrow() -> Dict[type, Any]:
+    return {
+        int: pa.int64(),
+        float: pa.float64(),
+        Decimal: pa.float64(),
+        bool: pa.bool_(),
+        date: pa.date32(),
+        datetime: pa.timestamp("us"),
+        time: pa.time64("us"),
+        str: pa.string(),
+    }
+
+class _CodificadorArrow:
+    def __init__(self, nomes: List[str], tipos: List[Optional[type]]):
+        tipos_arrow = _tipos_arrow()
+        self._tipos = [tipos_arrow.get(tipo, pa.string()) for tipo in tipos]
+        self._schema = pa.schema([pa.field(nome, tipo) for nome, tipo in zip(nomes, self._tipos)])
+        self._buffer = io.BytesIO()
+        self._escritor = None
+
+    def _esvaziar(self) -> bytes:
+        dados = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return dados
+
+    def _coluna(self, valores: List[Any], tipo: Any) -> Any:
+        if tipo == pa.string():
+            valores = [v if v is None or isinstance(v, str) else json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else str(v) for v in valores]
+        elif tipo == pa.float64():
+            valores = [float(v) if isinstance(v, Decimal) else v for v in valores]
+        try:
+            return pa.array(valores, type=tipo)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+            #Valores fora do tipo da coluna (ex.: texto gravado em coluna numérica no SQLite) vão como nulos
+            return pa.array([self._escalar(v, tipo) for v in valores], type=tipo)
+
+    @staticmethod
+    def _escalar(valor: Any, tipo: Any) -> Any:
+        try:
+            return pa.scalar(valor, type=tipo).as_py()
+        except Exception:
+            return None
+
+    def inicio(self) -> bytes:
+        self._escritor = pa.ipc.new_stream(self._buffer, self._schema)
+        return self._esvaziar()
+
+    def lote(self, linhas: List[List[Any]]) -> bytes:
+        colunas = [self._coluna(list(valores), tipo) for valores, tipo in zip(zip(*linhas), self._tipos)]
+        self._escritor.write_batch(pa.RecordBatch.from_arrays(colunas, schema=self._schema))
+        return self._esvaziar()
+
+    def fim(self) -> bytes:
+        self._escritor.close()
+        return self._esvaziar()
+
+CODIFICADORES = {
+    "json": _CodificadorJson,
+    "ndjson": _CodificadorNdjson,
+    "csv": _CodificadorCsv,
+    "msgpack": _CodificadorMsgpack,
+    "arrow": _CodificadorArrow,
+}
+
+def _criar_compressor(compressao: Optional[str]) -> Any:
+    if compressao == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compressao == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+def codificar(formato: FormatoPesquisa, nomes: List[str], tipos: List[Optional[type]], linhas: Iterator[List[Any]], compressao: Optional[CompressaoPesquisa] = None, tamanho_lote: int = 1000) -> Iterator[bytes]:
+    '''
+    Codifica as linhas (ex.: Excel.pesquisar_stream) no formato pedido, em pedaços de até `tamanho_lote` linhas.
+    nomes e tipos (python_type de cada coluna, None quando desconhecido) descrevem as colunas do resultado.
+    '''
+    codificador = CODIFICADORES[formato](nomes, tipos)
+    compressor = _criar_compressor(compressao)
+
+    def pedacos() -> Iterator[bytes]:
+        yield codificador.inicio()
+        while True:
+            lote = list(itertools.islice(linhas, tamanho_lote))
+            if not lote:
+                break
+            yield codificador.lote(lote)
+        yield codificador.fim()
+
+    for pedaco in pedacos():
+        if compressor is not None:
+            pedaco = compressor.compress(pedaco)
+        if pedaco:
+            yield pedaco
+    if compressor is not None:
+        final = compressor.flush()
+        if final:
+            yield final
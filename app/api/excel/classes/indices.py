@@ -0,0 +1,148 @@
+from typing import Any, Dict, List, Optional, TypedDict
+from sqlalchemy import Index, inspect
+from sqlalchemy.schema import CreateIndex
+import re
+
+#Imports internos
+from app.api.excel.classes.consultas import OPERADORES_INDEXAVEIS
+
+#Tipagem
+class SugestaoIndiceDict(TypedDict):
+    nome: str
+    tabela: str
+    colunas: List[str]
+    sql: str
+    motivo: str
+    consultas: int
+    tempo_total_ms: float
+    planos: List[str]
+
+class AplicacaoIndicesDict(TypedDict):
+    criados: List[str]
+    nao_encontrados: List[str] # nomes pedidos que não estão entre as sugestões atuais
+
+'''
+Assessor de índices: usa as estatísticas de consultas do Db (classes/consultas.py) para propor índices para a carga real.
+Para as formas de consulta mais lentas roda o EXPLAIN (EXPLAIN QUERY PLAN no SQLite) e, nas tabelas lidas por varredura completa,
+propõe um índice com as colunas filtradas (igualdades primeiro, depois uma faixa) e um com as colunas das relações,
+ignorando as colunas que já são a primeira coluna de algum índice (ou da chave primária).
+'''
+
+# Varreduras completas no plano: SQLite "SCAN <tabela>" (sem USING INDEX) e PostgreSQL "Seq Scan on <tabela>"
+_VARREDURAS = (
+    re.compile(r"^SCAN (?:TABLE )?(\S+)"),
+    re.compile(r"Seq Scan on (\S+)"),
+)
+
+def explicar(db: Any, stmt: Any, parametros: Dict[str, Any]) -> List[str]:
+    '''
+    Plano de execução do select com os parâmetros informados, uma linha de texto por passo.
+    '''
+    engine = db.engine
+    dialeto = engine.dialect.name
+    compilado = stmt.params(**parametros).compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+    valores = compilado.construct_params()
+    if compilado.positional:
+        valores = tuple(valores[nome] for nome in compilado.positiontup)
+    prefixo = "EXPLAIN QUERY PLAN " if dialeto == "sqlite" else "EXPLAIN "
+    with engine.connect() as conexao:
+        linhas = conexao.exec_driver_sql(prefixo + str(compilado), valores).all()
+    #SQLite: (id, pai, não usado, detalhe), demais: uma coluna com o texto
+    return [str(linha[-1]) for linha in linhas]
+
+def _tabelas_varridas(planos: List[str]) -> set:
+    tabelas = set()
+    for plano in planos:
+        if "USING INDEX" in plano or "USING COVERING INDEX" in plano:
+            continue
+        for expressao in _VARREDURAS:
+            encontrado = expressao.search(plano.strip())
+            if encontrado:
+                tabelas.add(encontrado.group(1).strip('"'))
+    return tabelas
+
+def _primeiras_colunas(db: Any, tabela: str) -> set:
+    '''
+    Colunas que já são a primeira coluna de um índice, restrição única ou chave primária da tabela.
+    '''
+    inspetor = inspect(db.engine)
+    primeiras = set(inspetor.get_pk_constraint(tabela).get("constrained_columns", [])[:1])
+    for indice in inspetor.get_indexes(tabela):
+        if indice.get("column_names") and indice["column_names"][0]:
+            primeiras.add(indice["column_names"][0])
+    for unica in inspetor.get_unique_constraints(tabela):
+        if unica.get("column_names"):
+            primeiras.add(unica["column_names"][0])
+    return primeiras
+
+def _indice(db: Any, nome: str, tabela: str, colunas: List[str]) -> Index:
+    #O Index é ligado à tabela do metadata ao ser criado, remove a ligação para não alterar o schema dos models
+    tabela_sql = db.modelo(tabela)["tabela"]
+    indice = Index(nome, *[tabela_sql.c[c] for c in colunas])
+    tabela_sql.indexes.discard(indice)
+    return indice
+
+def sugerir(db: Any, limite_formas: int = 10) -> List[SugestaoIndiceDict]:
+    '''
+    Propõe índices a partir das limite_formas formas de consulta com maior tempo total registradas no Db.
+    '''
+    sugestoes: Dict[str, SugestaoIndiceDict] = {}
+    primeiras: Dict[str, set] = {}
+    for entrada in db.registro_consultas.mais_lentas(limite_formas):
+        planos = explicar(db, entrada.stmt, entrada.parametros)
+        for tabela in sorted(_tabelas_varridas(planos)):
+            if tabela not in db.estrutura:
+                continue
+            if tabela not in primeiras:
+                primeiras[tabela] = _primeiras_colunas(db, tabela)
+
+            #Filtros: igualdades primeiro e no máximo uma faixa no final (as colunas depois de uma faixa não ajudam)
+            igualdades = [c for t, c, o in entrada.filtros if t == tabela and o in ("=", "in")]
+            faixas = [c for t, c, o in entrada.filtros if t == tabela and o in OPERADORES_INDEXAVEIS and o not in ("=", "in")]
+            candidatos = []
+            colunas_filtro = list(dict.fromkeys(igualdades + faixas[:1]))
+            if colunas_filtro:
+                candidatos.append((colunas_filtro, "filtro"))
+            for t, c in entrada.relacoes:
+                if t == tabela:
+                    candidatos.append(([c], "relação"))
+
+            for colunas, motivo in candidatos:
+                if colunas[0] in primeiras[tabela]:
+                    continue
+                nome = f"ix_{tabela}_{'_'.join(colunas)}"[:63]
+                sugestao = sugestoes.get(nome)
+                if sugestao is None:
+                    indice = _indice(db, nome, tabela, colunas)
+                    sugestao = sugestoes[nome] = {
+                        "nome": nome,
+                        "tabela": tabela,
+                        "colunas": colunas,
+                        "sql": str(CreateIndex(indice, if_not_exists=True).compile(dialect=db.engine.dialect)).strip(),
+                        "motivo": f"Varredura completa de {tabela} em consultas com {motivo} por {', '.join(colunas)}",
+                        "consultas": 0,
+                        "tempo_total_ms": 0.0,
+                        "planos": [],
+                    }
+                sugestao["consultas"] += entrada.execucoes
+                sugestao["tempo_total_ms"] = round(sugestao["tempo_total_ms"] + entrada.tempo_total * 1000, 3)
+                sugestao["planos"].extend(p for p in planos if p not in sugestao["planos"])
+    return sorted(sugestoes.values(), key=lambda s: -s["tempo_total_ms"])
+
+def aplicar(db: Any, sugestoes: List[SugestaoIndiceDict], nomes: Optional[List[str]] = None) -> AplicacaoIndicesDict:
+    '''
+    Cria os índices sugeridos (todos ou apenas os de nomes informados) e retorna os nomes criados
+    e os nomes pedidos que não estão nas sugestões (ex.: as estatísticas mudaram desde o GET /obter_indices).
+    Os índices criados aqui não ficam nos models, declare-os (index=True ou __table_args__) para que façam parte do schema.
+    '''
+    criados = []
+    for sugestao in sugestoes:
+        if nomes is not None and sugestao["nome"] not in nomes:
+            continue
+        indice = _indice(db, sugestao["nome"], sugestao["tabela"], sugestao["colunas"])
+        with db.engine.begin() as conexao:
+            indice.create(conexao, checkfirst=True)
+        criados.append(sugestao["nome"])
+    sugeridos = {sugestao["nome"] for sugestao in sugestoes}
+    nao_encontrados = [nome for nome in dict.fromkeys(nomes or []) if nome not in sugeridos]
+    return {"criados": criados, "nao_encontrados": nao_encontrados}
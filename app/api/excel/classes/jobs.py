@@ -0,0 +1,370 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, List, Literal, Optional, TypedDict
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, and_, create_engine, delete, event, func, insert, inspect, or_, select, text, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+#Imports internos
+from app.api.excel.classes.excel import Excel
+from app.api.excel.classes.singleton import Singleton
+from app.api.excel.classes.validacao import ErroValidacao, ErroValidacaoDict
+
+#Tipagem
+EstadoJob = Literal["pendente", "executando", "concluido", "erro"]
+
+class JobDict(TypedDict):
+    id: str
+    tabela: str
+    estado: EstadoJob
+    total_linhas: int
+    linhas_processadas: int
+    linhas_por_segundo: float
+    lotes: int
+    lotes_processados: int
+    erro: Optional[str]
+    erros: Optional[List[ErroValidacaoDict]] # erros de validação do lote que falhou (linhas absolutas da matriz enviada)
+    criado_em: str
+    iniciado_em: Optional[str]
+    concluido_em: Optional[str]
+    ids: Optional[List[Any]]
+
+'''
+Jobs em segundo plano para cargas grandes do atualizar.
+A matriz é gravada em lotes em um SQLite local (separado da base principal) e aplicada por um pool de threads,
+um lote por transação. O progresso fica no SQLite, então os jobs não concluídos são retomados quando o servidor reinicia,
+a partir do primeiro lote ainda não gravado.
+Cada lote também é marcado na base principal (jobs_lotes_gravados) na mesma transação dos dados: se o processo morrer depois
+do commit dos dados e antes do registro do progresso aqui, a retomada usa os ids da marcação em vez de gravar o lote de novo
+(as inclusões seriam duplicadas). As marcações são apagadas quando o job termina.
+A tabela jobs_lotes_gravados fica no esquema da aplicação (precisa estar na mesma transação dos dados), é criada no primeiro job
+e só tem linhas enquanto algum job está em andamento.
+
+Com vários processos (ex.: gunicorn com vários workers) usando a mesma base de jobs, cada job é reivindicado por um único processo:
+um UPDATE condicional grava o dono e o pulso (pulso_em) e só acontece se o job estiver pendente ou com o pulso vencido (JOBS_PRAZO_SEGUNDOS).
+O dono renova o pulso a cada lote e periodicamente (thread job-pulso), que também retoma os jobs de processos que pararam de pulsar.
+'''
+
+# Base padrão na raiz do projeto (não depende do diretório de trabalho ao iniciar o servidor)
+_RAIZ_PROJETO = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+JOBS_DATABASE_URL_PADRAO = f"sqlite:///{os.path.join(_RAIZ_PROJETO, 'jobs.db')}"
+
+_metadata = MetaData()
+
+_tabela_jobs = Table(
+    "jobs", _metadata,
+    Column("id", String(36), primary_key=True),
+    Column("tabela", String(100), nullable=False),
+    Column("cabecalho", Text, nullable=False),
+    Column("estado", String(20), nullable=False, index=True),
+    Column("total_linhas", Integer, nullable=False),
+    Column("linhas_processadas", Integer, nullable=False, default=0),
+    Column("lotes", Integer, nullable=False),
+    Column("erro", Text),
+    Column("erros", Text), # JSON com os erros de validação (ErroValidacao.erros)
+    Column("criado_em", Float, nullable=False),
+    Column("iniciado_em", Float),
+    Column("atualizado_em", Float),
+    Column("concluido_em", Float),
+    Column("dono", String(100)), # processo que executa o job (GerenciadorJobs.dono)
+    Column("pulso_em", Float), # último sinal do dono, vencido após JOBS_PRAZO_SEGUNDOS
+)
+
+# Colunas acrescentadas depois da criação da tabela jobs (bases antigas recebem ALTER TABLE ao iniciar)
+_COLUNAS_NOVAS = {"erros": "TEXT", "dono": "VARCHAR(100)", "pulso_em": "FLOAT"}
+
+_tabela_lotes = Table(
+    "jobs_lotes", _metadata,
+    Column("job_id", String(36), primary_key=True),
+    Column("numero", Integer, primary_key=True),
+    Column("linha_inicial", Integer, nullable=False),
+    Column("linhas", Text, nullable=False),
+    Column("ids", Text), # preenchido quando o lote é gravado na base principal
+)
+
+#Marcação dos lotes gravados, criada na base principal (Db) e gravada na mesma transação dos dados do lote
+_metadata_base = MetaData()
+
+_tabela_lotes_gravados = Table(
+    "jobs_lotes_gravados", _metadata_base,
+    Column("job_id", String(36), primary_key=True),
+    Column("numero", Integer, primary_key=True),
+    Column("ids", Text, nullable=False),
+)
+
+ESTADOS_FINAIS = ("concluido", "erro")
+
+def _iso(instante: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(instante).isoformat(timespec="seconds") if instante else None
+
+class GerenciadorJobs(metaclass=Singleton):
+    '''
+    Configuração via .env:
+    - JOBS_DATABASE_URL: base dos jobs (padrão jobs.db na raiz do projeto, JOBS_DATABASE_URL_PADRAO)
+    - JOBS_WORKERS: jobs executados ao mesmo tempo (padrão 2)
+    - JOBS_TAMANHO_LOTE: linhas por lote/transação (padrão 5000)
+    - JOBS_RETENCAO_DIAS: jobs finalizados mais antigos são apagados ao iniciar (padrão 7)
+    - JOBS_PRAZO_SEGUNDOS: tempo sem pulso após o qual um job em execução é considerado abandonado e pode ser retomado por outro processo (padrão 60)
+    A tabela jobs_lotes_gravados é criada na base principal (DATABASE_URL), ver a descrição do módulo.
+    '''
+    def __init__(self, database_url: str = None, env_path: str = ".env"):
+        if not hasattr(self, "_initialized"):
+            load_dotenv(env_path)
+            database_url = database_url or os.getenv("JOBS_DATABASE_URL", JOBS_DATABASE_URL_PADRAO)
+            self._engine = create_engine(database_url, connect_args={"timeout": 30} if database_url.startswith("sqlite") else {})
+            if self._engine.dialect.name == "sqlite":
+                #WAL: leituras do progresso não bloqueiam a gravação dos lotes
+                @event.listens_for(self._engine, "connect")
+                def _wal(conexao, _):
+                    conexao.execute("PRAGMA journal_mode=WAL")
+            _metadata.create_all(self._engine)
+            #Bases criadas antes das colunas novas
+            existentes = {c["name"] for c in inspect(self._engine).get_columns("jobs")}
+            with self._engine.begin() as conexao:
+                for coluna, tipo in _COLUNAS_NOVAS.items():
+                    if coluna not in existentes:
+                        conexao.execute(text(f"ALTER TABLE jobs ADD COLUMN {coluna} {tipo}"))
+
+            self.tamanho_lote = int(os.getenv("JOBS_TAMANHO_LOTE", "5000"))
+            self._executor = ThreadPoolExecutor(max_workers=int(os.getenv("JOBS_WORKERS", "2")), thread_name_prefix="job")
+            self._encerrando = threading.Event()
+            self._agendados = set()
+            self._trava = threading.Lock()
+            self.prazo = float(os.getenv("JOBS_PRAZO_SEGUNDOS", "60"))
+            #Identifica o processo (e a instância) nas reivindicações dos jobs
+            self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._logger = logging.getLogger("app.jobs")
+            self._initialized = True
+            self._limpar(float(os.getenv("JOBS_RETENCAO_DIAS", "7")))
+            self._pulso = threading.Thread(target=self._pulsar, name="job-pulso", daemon=True)
+            self._pulso.start()
+
+    def enviar(self, tabela: str, matriz: List[List[Any]], tamanho_lote: int = None) -> JobDict:
+        '''
+        Grava a matriz (mesmo formato do Excel.atualizar) em lotes e agenda o job, retornando logo em seguida.
+        '''
+        #Validações rápidas, o restante acontece em cada lote
+        if not matriz or len(matriz) <= 1 or len(matriz[0]) <= 1:
+            raise ValueError("Tamanho da matriz inválida. Deve conter pelo menos duas colunas e duas linhas.")
+        if matriz[0][-1] != "MD":
+            raise ValueError("A última coluna da matriz deve ser chamada 'MD' para indicar a ação de atualização A (Atualizar ou Incluir) ou D (Excluir).")
+        if not Excel().coletar_estrutura([tabela]):
+            raise ValueError(f"A estrutura da tabela '{tabela}' não foi encontrada.")
+        tamanho_lote = tamanho_lote or self.tamanho_lote
+        if tamanho_lote < 1:
+            raise ValueError("O tamanho do lote deve ser maior que zero.")
+
+        id = str(uuid.uuid4())
+        linhas = matriz[1:]
+        lotes = [
+            {"job_id": id, "numero": numero, "linha_inicial": inicio + 2, "linhas": json.dumps(linhas[inicio:inicio + tamanho_lote], default=str, ensure_ascii=False)}
+            for numero, inicio in enumerate(range(0, len(linhas), tamanho_lote))
+        ]
+        with self._engine.begin() as conexao:
+            conexao.execute(insert(_tabela_jobs).values(
+                id=id, tabela=tabela, cabecalho=json.dumps(matriz[0], ensure_ascii=False), estado="pendente",
+                total_linhas=len(linhas), linhas_processadas=0, lotes=len(lotes), criado_em=time.time(),
+            ))
+            conexao.execute(insert(_tabela_lotes), lotes)
+        self._agendar(id)
+        return self.obter(id, incluir_ids=False)
+
+    def obter(self, id: str, incluir_ids: bool = True) -> JobDict:
+        with self._engine.connect() as conexao:
+            job = conexao.execute(select(_tabela_jobs).where(_tabela_jobs.c.id == id)).mappings().first()
+            if job is None:
+                raise ValueError(f"Job '{id}' não encontrado.")
+            lotes_processados = conexao.execute(
+                select(func.count()).select_from(_tabela_lotes).where(_tabela_lotes.c.job_id == id, _tabela_lotes.c.ids.is_not(None))
+            ).scalar_one()
+            ids = None
+            if incluir_ids and job["estado"] == "concluido":
+                ids = ['']
+                for (ids_lote,) in conexao.execute(select(_tabela_lotes.c.ids).where(_tabela_lotes.c.job_id == id).order_by(_tabela_lotes.c.numero)):
+                    ids.extend(json.loads(ids_lote))
+
+        duracao = (job["atualizado_em"] or 0) - (job["iniciado_em"] or 0)
+        return {
+            "id": job["id"],
+            "tabela": job["tabela"],
+            "estado": job["estado"],
+            "total_linhas": job["total_linhas"],
+            "linhas_processadas": job["linhas_processadas"],
+            "linhas_por_segundo": round(job["linhas_processadas"] / duracao, 1) if job["iniciado_em"] and duracao > 0 else 0.0,
+            "lotes": job["lotes"],
+            "lotes_processados": lotes_processados,
+            "erro": job["erro"],
+            "erros": json.loads(job["erros"]) if job["erros"] else None,
+            "criado_em": _iso(job["criado_em"]),
+            "iniciado_em": _iso(job["iniciado_em"]),
+            "concluido_em": _iso(job["concluido_em"]),
+            "ids": ids,
+        }
+
+    def _disponivel(self, agora: float) -> Any:
+        '''
+        Condição dos jobs que podem ser reivindicados: pendentes ou em execução com o pulso vencido (dono parado ou encerrado).
+        '''
+        vencido = or_(_tabela_jobs.c.pulso_em.is_(None), _tabela_jobs.c.pulso_em < agora - self.prazo)
+        return or_(_tabela_jobs.c.estado == "pendente", and_(_tabela_jobs.c.estado == "executando", vencido))
+
+    def retomar(self) -> int:
+        '''
+        Agenda os jobs pendentes ou abandonados (ex.: reinício do servidor, processo que parou de pulsar), retorna a quantidade.
+        Jobs em execução por outro processo com pulso em dia não são agendados.
+        '''
+        with self._engine.connect() as conexao:
+            ids = conexao.execute(select(_tabela_jobs.c.id).where(self._disponivel(time.time())).order_by(_tabela_jobs.c.criado_em)).scalars().all()
+        for id in ids:
+            self._agendar(id)
+        return len(ids)
+
+    def encerrar(self, aguardar: bool = True):
+        '''
+        Para os jobs após o lote em andamento, os lotes restantes são retomados no próximo início (retomar).
+        '''
+        self._encerrando.set()
+        self._executor.shutdown(wait=aguardar, cancel_futures=True)
+        self._pulso.join(timeout=5)
+
+    def _agendar(self, id: str):
+        with self._trava:
+            if id in self._agendados:
+                return
+            self._agendados.add(id)
+        self._executor.submit(self._executar, id)
+
+    def _pulsar(self):
+        '''
+        Renova o pulso dos jobs deste processo e retoma os jobs abandonados, a cada terço do prazo.
+        '''
+        while not self._encerrando.wait(max(0.1, self.prazo / 3)):
+            try:
+                with self._engine.begin() as conexao:
+                    conexao.execute(update(_tabela_jobs).where(_tabela_jobs.c.dono == self.dono, _tabela_jobs.c.estado == "executando").values(pulso_em=time.time()))
+                self.retomar()
+            except Exception:
+                self._logger.exception("Falha ao renovar o pulso dos jobs")
+
+    def _reivindicar(self, id: str) -> Optional[Any]:
+        '''
+        Torna este processo o dono do job (UPDATE condicional, só um processo consegue), retorna o job ou None se não estiver disponível.
+        '''
+        agora = time.time()
+        with self._engine.begin() as conexao:
+            reivindicado = conexao.execute(
+                update(_tabela_jobs).where(_tabela_jobs.c.id == id, self._disponivel(agora)).values(
+                    estado="executando", dono=self.dono, pulso_em=agora, atualizado_em=agora,
+                    iniciado_em=func.coalesce(_tabela_jobs.c.iniciado_em, agora),
+                )
+            ).rowcount
+            if reivindicado != 1:
+                return None
+            return conexao.execute(select(_tabela_jobs).where(_tabela_jobs.c.id == id)).mappings().first()
+
+    def _possui(self, id: str) -> bool:
+        with self._engine.connect() as conexao:
+            return conexao.execute(select(_tabela_jobs.c.dono).where(_tabela_jobs.c.id == id, _tabela_jobs.c.estado == "executando")).scalar_one_or_none() == self.dono
+
+    def _executar(self, id: str):
+        reivindicado = False
+        try:
+            job = self._reivindicar(id)
+            if job is None:
+                return
+            reivindicado = True
+            cabecalho = json.loads(job["cabecalho"])
+            excel = Excel()
+            _metadata_base.create_all(excel.db.engine)
+
+            while not self._encerrando.is_set():
+                #Próximo lote ainda não gravado (na retomada, continua de onde parou)
+                with self._engine.connect() as conexao:
+                    lote = conexao.execute(
+                        select(_tabela_lotes.c.numero, _tabela_lotes.c.linha_inicial, _tabela_lotes.c.linhas)
+                        .where(_tabela_lotes.c.job_id == id, _tabela_lotes.c.ids.is_(None))
+                        .order_by(_tabela_lotes.c.numero).limit(1)
+                    ).first()
+                if lote is None:
+                    self._finalizar(excel, id, "concluido")
+                    return
+
+                #Lote já gravado na base principal por uma execução interrompida antes de registrar o progresso
+                with excel.db.engine.connect() as conexao:
+                    gravado = conexao.execute(
+                        select(_tabela_lotes_gravados.c.ids).where(_tabela_lotes_gravados.c.job_id == id, _tabela_lotes_gravados.c.numero == lote.numero)
+                    ).scalar_one_or_none()
+                if gravado is not None:
+                    ids = json.loads(gravado)
+                else:
+                    def marcar(session: Session, ids_lote: List[Any], numero: int = lote.numero):
+                        session.execute(insert(_tabela_lotes_gravados).values(job_id=id, numero=numero, ids=json.dumps(ids_lote[1:], default=str)))
+                    try:
+                        ids = excel.atualizar(job["tabela"], [cabecalho] + json.loads(lote.linhas), linha_inicial=lote.linha_inicial, antes_commit=marcar)[1:]
+                    except Exception as e:
+                        #Outro processo assumiu o job (pulso vencido) e gravou o lote: a marcação repetida desfaz esta transação
+                        if not self._possui(id):
+                            self._logger.warning("Job %s assumido por outro processo durante o lote %s", id, lote.numero)
+                            return
+                        with self._engine.connect() as conexao:
+                            gravadas = conexao.execute(select(_tabela_jobs.c.linhas_processadas).where(_tabela_jobs.c.id == id)).scalar_one()
+                        erros = e.erros if isinstance(e, ErroValidacao) else None
+                        self._finalizar(excel, id, "erro", f"Erro no lote iniciado na linha {lote.linha_inicial} ({gravadas} linhas anteriores já gravadas): {e}", erros)
+                        return
+
+                if not self._registrar_lote(id, lote.numero, ids):
+                    self._logger.warning("Job %s assumido por outro processo após o lote %s", id, lote.numero)
+                    return
+            #Encerrando: libera o job para ser retomado sem esperar o prazo
+            self._liberar(id)
+        except Exception as e:
+            if reivindicado:
+                self._finalizar(None, id, "erro", str(e))
+        finally:
+            with self._trava:
+                self._agendados.discard(id)
+
+    def _registrar_lote(self, id: str, numero: int, ids: List[Any]) -> bool:
+        '''
+        Registra o lote gravado na base principal, o progresso e o pulso do job. Retorna False (sem registrar) se o job não é mais deste processo.
+        '''
+        agora = time.time()
+        with self._engine.begin() as conexao:
+            dono = conexao.execute(update(_tabela_jobs).where(_tabela_jobs.c.id == id, _tabela_jobs.c.dono == self.dono, _tabela_jobs.c.estado == "executando").values(
+                linhas_processadas=_tabela_jobs.c.linhas_processadas + len(ids), atualizado_em=agora, pulso_em=agora,
+            )).rowcount == 1
+            if dono:
+                conexao.execute(update(_tabela_lotes).where(_tabela_lotes.c.job_id == id, _tabela_lotes.c.numero == numero).values(ids=json.dumps(ids, default=str)))
+        return dono
+
+    def _liberar(self, id: str):
+        with self._engine.begin() as conexao:
+            conexao.execute(update(_tabela_jobs).where(_tabela_jobs.c.id == id, _tabela_jobs.c.dono == self.dono).values(dono=None, pulso_em=None))
+
+    def _finalizar(self, excel: Optional[Excel], id: str, estado: EstadoJob, erro: str = None, erros: List[ErroValidacaoDict] = None):
+        #Só o dono finaliza (as marcações de um job assumido por outro processo continuam valendo)
+        if not self._possui(id):
+            return
+        #As marcações são apagadas antes do estado final: se o processo morrer entre os dois, a retomada só conclui o job
+        if excel is not None:
+            with excel.db.engine.begin() as conexao:
+                conexao.execute(delete(_tabela_lotes_gravados).where(_tabela_lotes_gravados.c.job_id == id))
+        valores = {"estado": estado, "concluido_em": time.time()}
+        if estado == "erro":
+            valores.update(erro=erro, erros=json.dumps(erros, default=str, ensure_ascii=False) if erros else None, atualizado_em=valores["concluido_em"])
+        with self._engine.begin() as conexao:
+            conexao.execute(update(_tabela_jobs).where(_tabela_jobs.c.id == id, _tabela_jobs.c.dono == self.dono).values(**valores))
+
+    def _limpar(self, retencao_dias: float):
+        limite = time.time() - retencao_dias * 86400
+        with self._engine.begin() as conexao:
+            antigos = select(_tabela_jobs.c.id).where(_tabela_jobs.c.estado.in_(ESTADOS_FINAIS), _tabela_jobs.c.concluido_em < limite)
+            conexao.execute(delete(_tabela_lotes).where(_tabela_lotes.c.job_id.in_(antigos)))
+            conexao.execute(delete(_tabela_jobs).where(_tabela_jobs.c.id.in_(antigos)))
@@ -0,0 +1,143 @@
+from typing import Any, Callable, Iterator, List, Literal, Optional
+import codecs
+import csv
+import json
+import zlib
+
+#Dependência opcional (Content-Encoding zstd)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Tipagem
+FormatoCarga = Literal["ndjson", "csv"]
+
+'''
+Leitura incremental de cargas em NDJSON ou CSV (opcionalmente comprimidas), usada no upload em streaming do atualizar.
+Os bytes chegam em pedaços de qualquer tamanho e cada linha completa é devolvida assim que termina de chegar,
+sem manter o conteúdo inteiro em memória. A primeira linha é o cabeçalho (mesmo formato da matriz do Excel.atualizar).
+'''
+
+FORMATOS_POR_MIDIA = {
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+
+def resolver_formato_carga(formato: Optional[str] = None, content_type: Optional[str] = None) -> FormatoCarga:
+    '''
+    Formato da carga: o parâmetro formato tem prioridade, depois o Content-Type, o padrão é ndjson.
+    '''
+    if formato:
+        formato = formato.lower()
+        if formato not in ("ndjson", "csv"):
+            raise ValueError(f"Formato '{formato}' inválido. Use 'ndjson' ou 'csv'.")
+        return formato
+    midia = (content_type or "").split(";")[0].strip().lower()
+    return FORMATOS_POR_MIDIA.get(midia, "ndjson")
+
+def _criar_descompressor(compressao: Optional[str]) -> Any:
+    compressao = (compressao or "").lower()
+    if compressao in ("", "identity"):
+        return None
+    if compressao == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compressao == "deflate":
+        return zlib.decompressobj()
+    if compressao == "zstd":
+        if zstandard is None:
+            raise ValueError("A compressão 'zstd' precisa do pacote 'zstandard' instalado no servidor.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Compressão '{compressao}' inválida. Use 'gzip', 'deflate' ou 'zstd'.")
+
+class LeitorCarga:
+    '''
+    Recebe os bytes da carga com alimentar(pedaco) e devolve as linhas completas (listas de valores) lidas até o momento.
+    - ndjson: cada linha é uma lista JSON.
+    - csv: separador "," (ou o informado), campos vazios viram None e campos entre aspas podem conter quebras de linha.
+    Linhas com quantidade de colunas diferente do cabeçalho geram ValueError com o número da linha.
+    '''
+    def __init__(self, formato: FormatoCarga = "ndjson", compressao: Optional[str] = None, separador: str = ","):
+        self._separador = separador
+        self._descompressor = _criar_descompressor(compressao)
+        self._decodificador = codecs.getincrementaldecoder("utf-8-sig")()
+        self._resto = "" # texto após a última quebra de linha
+        self._pendente = [] # linhas físicas de um registro CSV com aspas ainda abertas
+        self._colunas = None
+        self.linhas_lidas = 0
+        self._analisar: Callable[[str], Optional[List[Any]]] = self._analisar_ndjson if formato == "ndjson" else self._analisar_csv
+
+    def alimentar(self, pedaco: bytes) -> List[List[Any]]:
+        if self._descompressor is not None:
+            pedaco = self._descompressor.decompress(pedaco)
+        return self._processar(self._decodificador.decode(pedaco))
+
+    def finalizar(self) -> List[List[Any]]:
+        '''
+        Processa o que restou após o último pedaço (linha final sem quebra de linha).
+        '''
+        texto = ""
+        if self._descompressor is not None and hasattr(self._descompressor, "flush"):
+            texto = self._decodificador.decode(self._descompressor.flush())
+        texto += self._decodificador.decode(b"", final=True)
+        linhas = self._processar(texto)
+        final = self._resto
+        self._resto = ""
+        if final or self._pendente:
+            linhas.extend(self._registrar(final))
+        if self._pendente:
+            raise ValueError(f"Linha {self.linhas_lidas + 1}: aspas não fechadas no fim do arquivo CSV.")
+        return linhas
+
+    def _processar(self, texto: str) -> List[List[Any]]:
+        partes = (self._resto + texto).split("\n")
+        self._resto = partes.pop()
+        linhas = []
+        for parte in partes:
+            linhas.extend(self._registrar(parte))
+        return linhas
+
+    def _registrar(self, texto: str) -> List[List[Any]]:
+        texto = texto.rstrip("\r")
+        linha = self._analisar(texto)
+        if linha is None:
+            return []
+        self.linhas_lidas += 1
+        if self._colunas is None:
+            self._colunas = len(linha)
+        elif len(linha) != self._colunas:
+            raise ValueError(f"Linha {self.linhas_lidas}: {len(linha)} colunas, o cabeçalho tem {self._colunas}.")
+        return [linha]
+
+    def _analisar_ndjson(self, texto: str) -> Optional[List[Any]]:
+        if not texto.strip():
+            return None
+        try:
+            linha = json.loads(texto)
+        except ValueError as e:
+            raise ValueError(f"Linha {self.linhas_lidas + 1}: JSON inválido ({e}).")
+        if not isinstance(linha, list):
+            raise ValueError(f"Linha {self.linhas_lidas + 1}: cada linha deve ser uma lista JSON.")
+        return linha
+
+    def _analisar_csv(self, texto: str) -> Optional[List[Any]]:
+        self._pendente.append(texto)
+        registro = "\n".join(self._pendente)
+        #Quantidade ímpar de aspas: um campo entre aspas continua na próxima linha física
+        if registro.count('"') % 2:
+            return None
+        self._pendente = []
+        if not registro.strip():
+            return None
+        campos = next(csv.reader([registro], delimiter=self._separador))
+        return [campo if campo != "" else None for campo in campos]
+
+    def linhas(self, pedacos: Iterator[bytes]) -> Iterator[List[Any]]:
+        '''
+        Gera as linhas a partir de um iterador de pedaços de bytes (ex.: corpo da requisição).
+        '''
+        for pedaco in pedacos:
+            yield from self.alimentar(pedaco)
+        yield from self.finalizar()
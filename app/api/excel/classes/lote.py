@@ -0,0 +1,164 @@
+from array import array
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import hashlib
+import json
+
+'''
+Lote colunar do atualizar: as colunas convertidas ficam guardadas uma vez, sem montar listas por linha nem dicionários para a matriz inteira.
+- colunas só de inteiros, números, booleanos ou datas (e nulos) ficam em arrays tipados (módulo array) com uma máscara de nulos
+- as demais (textos, JSON...) ficam na lista convertida, que aponta para os mesmos objetos da matriz recebida
+As linhas são lidas por posição (LinhaLote, sem cópia) e os parâmetros do SQL são montados por bloco (dicionarios), só o bloco atual fica em memória.
+As colunas compactadas (ColunaCompacta) podem ser enviadas a outro processo e concatenadas (ex.: fatias da conversão paralela).
+'''
+
+# Código do array e conversões de ida e volta por tipo (type exato: bool não entra como int e datetime não entra como date)
+_TIPOS_ARRAY: Dict[type, Tuple[str, Optional[Callable[[Any], Any]], Optional[Callable[[Any], Any]]]] = {
+    int: ("q", None, None),
+    float: ("d", None, None),
+    bool: ("b", None, bool),
+    date: ("l", date.toordinal, date.fromordinal),
+}
+
+# Tipo do array (None quando os valores ficam na lista), valores e máscara de nulos (None quando não há nulos)
+ColunaCompacta = Tuple[Optional[type], Sequence[Any], Optional[bytearray]]
+
+def compactar(valores: List[Any]) -> ColunaCompacta:
+    '''
+    Compacta uma coluna em array tipado quando ela tem um único tipo conhecido (além dos nulos), senão mantém a lista.
+    '''
+    #Tipos presentes (sem o nulo), a coluna só vira array com um único tipo conhecido
+    tipos = set(map(type, valores))
+    tem_nulo = type(None) in tipos
+    tipos.discard(type(None))
+    if len(tipos) != 1 or next(iter(tipos)) not in _TIPOS_ARRAY:
+        return None, valores, None
+    tipo = next(iter(tipos))
+    codigo, ida, _ = _TIPOS_ARRAY[tipo]
+    try:
+        if tem_nulo:
+            compactos = array(codigo, (0 if v is None else (ida(v) if ida else v) for v in valores))
+        else:
+            compactos = array(codigo, map(ida, valores) if ida else valores)
+    except OverflowError:
+        #Inteiros fora de 64 bits continuam na lista
+        return None, valores, None
+    return tipo, compactos, bytearray(v is None for v in valores) if tem_nulo else None
+
+def concatenar(partes: List[ColunaCompacta]) -> ColunaCompacta:
+    '''
+    Junta as partes de uma coluna na ordem recebida. Partes do mesmo tipo são concatenadas sem descompactar,
+    as demais são lidas para uma lista e compactadas de novo (ex.: uma fatia só de nulos ao lado de fatias de inteiros).
+    '''
+    tipos = {tipo for tipo, _, _ in partes}
+    if len(tipos) == 1 and None not in tipos:
+        tipo = partes[0][0]
+        valores = array(_TIPOS_ARRAY[tipo][0])
+        for _, compactos, _ in partes:
+            valores.extend(compactos)
+        nulos = None
+        if any(n is not None for _, _, n in partes):
+            nulos = bytearray()
+            for _, compactos, n in partes:
+                nulos.extend(n if n is not None else bytes(len(compactos)))
+        return tipo, valores, nulos
+    valores = []
+    for parte in partes:
+        valores.extend(parte[1] if parte[0] is None else map(_leitor(parte), range(len(parte[1]))))
+    return compactar(valores)
+
+def _leitor(coluna: ColunaCompacta) -> Callable[[int], Any]:
+    tipo, valores, nulos = coluna
+    volta = _TIPOS_ARRAY[tipo][2] if tipo is not None else None
+    if nulos is None and volta is None:
+        return valores.__getitem__
+    if nulos is None:
+        return lambda i, c=valores, v=volta: v(c[i])
+    if volta is None:
+        return lambda i, c=valores, n=nulos: None if n[i] else c[i]
+    return lambda i, c=valores, n=nulos, v=volta: None if n[i] else v(c[i])
+
+def impressoes(colunas: List[List[Any]]) -> List[str]:
+    '''
+    Impressão digital de cada linha (hash blake2b de 128 bits do JSON dos valores convertidos das colunas, na ordem recebida).
+    '''
+    resultado = []
+    for valores in zip(*colunas):
+        texto = json.dumps(valores, default=str, separators=(",", ":"), ensure_ascii=False)
+        resultado.append(hashlib.blake2b(texto.encode("utf-8"), digest_size=16).hexdigest())
+    return resultado
+
+class LinhaLote:
+    '''
+    Visão de uma linha do lote (sem cópia dos valores), indexável pela posição da coluna.
+    '''
+    __slots__ = ("_leitores", "_posicao")
+
+    def __init__(self, leitores: List[Callable[[int], Any]], posicao: int):
+        self._leitores = leitores
+        self._posicao = posicao
+
+    def __len__(self) -> int:
+        return len(self._leitores)
+
+    def __getitem__(self, coluna: int) -> Any:
+        return self._leitores[coluna](self._posicao)
+
+    def __iter__(self) -> Iterator[Any]:
+        posicao = self._posicao
+        return (ler(posicao) for ler in self._leitores)
+
+class LoteColunar:
+    '''
+    Colunas convertidas de uma matriz do atualizar, na ordem do cabeçalho.
+    compactas recebe as colunas já compactadas (ver compactar e concatenar) no lugar das listas de valores.
+    '''
+    __slots__ = ("cabecalho", "_colunas", "_leitores", "_tamanho")
+
+    def __init__(self, cabecalho: List[str], colunas: List[List[Any]] = None, compactas: List[ColunaCompacta] = None):
+        self.cabecalho = list(cabecalho)
+        self._colunas = compactas if compactas is not None else [compactar(valores) for valores in colunas]
+        self._leitores = [_leitor(coluna) for coluna in self._colunas]
+        self._tamanho = len(self._colunas[0][1]) if self._colunas else 0
+
+    def __len__(self) -> int:
+        return self._tamanho
+
+    def acrescentar_coluna(self, nome: str, valores: List[Any]):
+        coluna = compactar(valores)
+        self.cabecalho.append(nome)
+        self._colunas.append(coluna)
+        self._leitores.append(_leitor(coluna))
+
+    def linha(self, posicao: int) -> LinhaLote:
+        return LinhaLote(self._leitores, posicao)
+
+    def valor(self, posicao: int, coluna: int) -> Any:
+        return self._leitores[coluna](posicao)
+
+    def tupla(self, posicao: int, quantidade_colunas: int = None) -> Tuple[Any, ...]:
+        '''
+        Valores da linha (das primeiras quantidade_colunas colunas) em uma tupla.
+        '''
+        leitores = self._leitores if quantidade_colunas is None else self._leitores[:quantidade_colunas]
+        return tuple([ler(posicao) for ler in leitores])
+
+    def coluna(self, coluna: int, posicoes: Iterable[int] = None) -> List[Any]:
+        '''
+        Valores de uma coluna (opcionalmente só das posições informadas) em uma lista.
+        '''
+        ler = self._leitores[coluna]
+        if posicoes is None:
+            return list(map(ler, range(self._tamanho)))
+        return list(map(ler, posicoes))
+
+    def dicionarios(self, posicoes: Iterable[int], colunas: List[str] = None) -> Iterator[Dict[str, Any]]:
+        '''
+        Parâmetros do SQL ({coluna: valor}) das linhas nas posições informadas, um dicionário por vez.
+        colunas limita (e ordena) as colunas incluídas, padrão todas.
+        '''
+        nomes = self.cabecalho if colunas is None else colunas
+        leitores = self._leitores if colunas is None else [self._leitores[self.cabecalho.index(c)] for c in colunas]
+        pares = list(zip(nomes, leitores))
+        for posicao in posicoes:
+            yield {nome: ler(posicao) for nome, ler in pares}
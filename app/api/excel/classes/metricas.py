@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import bisect
+import os
+import threading
+import time
+
+#Imports internos
+from app.api.excel.classes.singleton import Singleton
+
+'''
+Métricas da API no formato de exposição do Prometheus (texto), sem serviço ou biblioteca externa.
+- contadores e histogramas com rótulos, atualizados pelo middleware (requisições por rota) e pelo Db/Excel (etapas e linhas)
+- coletores: funções chamadas na exportação que devolvem valores instantâneos (ex.: estatísticas do pool de conexões)
+Exposto em GET /metrics (app/main.py).
+'''
+
+# Limites (segundos) dos histogramas, METRICAS_BUCKETS sobrescreve (lista separada por vírgula)
+BUCKETS_PADRAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Rotulos = Tuple[Tuple[str, str], ...]
+# Coletor: devolve (nome, tipo, ajuda, rótulos, valor) para cada amostra
+Coletor = Callable[[], List[Tuple[str, str, str, Dict[str, Any], float]]]
+
+#Escopo ASGI da requisição em andamento no contexto atual (propagado para as threads do anyio), ver rota_atual
+_escopo_requisicao: ContextVar[Optional[dict]] = ContextVar("escopo_requisicao", default=None)
+
+def rota_atual() -> Optional[str]:
+    '''
+    Método e rota declarada (ex.: "POST /api/excel/pesquisar/") da requisição que originou a chamada, None fora de uma requisição (ex.: jobs).
+    '''
+    escopo = _escopo_requisicao.get()
+    if escopo is None:
+        return None
+    rota = escopo.get("route")
+    return f"{escopo.get('method', '')} {getattr(rota, 'path', None) or escopo.get('path', '')}"
+
+class _Histograma:
+    __slots__ = ("contagens", "soma", "total")
+
+    def __init__(self, quantidade_buckets: int):
+        self.contagens = [0] * quantidade_buckets
+        self.soma = 0.0
+        self.total = 0
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _formatar_rotulos(rotulos: Rotulos, extra: Rotulos = ()) -> str:
+    itens = rotulos + extra
+    if not itens:
+        return ""
+    return "{" + ",".join(f'{chave}="{_escapar(valor)}"' for chave, valor in itens) + "}"
+
+def _formatar_valor(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class Metricas(metaclass=Singleton):
+    def __init__(self, buckets: Optional[Tuple[float, ...]] = None):
+        if buckets is None and os.getenv("METRICAS_BUCKETS"):
+            buckets = tuple(float(b) for b in os.getenv("METRICAS_BUCKETS").split(","))
+        self._buckets = tuple(sorted(buckets or BUCKETS_PADRAO))
+        self._ajudas: Dict[str, Tuple[str, str]] = {} # nome: (tipo, ajuda)
+        self._contadores: Dict[str, Dict[Rotulos, float]] = {}
+        self._histogramas: Dict[str, Dict[Rotulos, _Histograma]] = {}
+        self._coletores: List[Coletor] = []
+        self._trava = threading.Lock()
+
+    def _declarar(self, nome: str, tipo: str, ajuda: str):
+        if nome not in self._ajudas:
+            self._ajudas[nome] = (tipo, ajuda)
+
+    def incrementar(self, nome: str, ajuda: str, valor: float = 1, **rotulos: Any):
+        '''
+        Soma valor ao contador nome com os rótulos informados.
+        '''
+        chave = tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+        with self._trava:
+            self._declarar(nome, "counter", ajuda)
+            serie = self._contadores.setdefault(nome, {})
+            serie[chave] = serie.get(chave, 0) + valor
+
+    def observar(self, nome: str, ajuda: str, valor: float, **rotulos: Any):
+        '''
+        Registra uma observação (em segundos) no histograma nome com os rótulos informados.
+        '''
+        chave = tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+        posicao = bisect.bisect_left(self._buckets, valor)
+        with self._trava:
+            self._declarar(nome, "histogram", ajuda)
+            serie = self._histogramas.setdefault(nome, {})
+            histograma = serie.get(chave)
+            if histograma is None:
+                histograma = serie[chave] = _Histograma(len(self._buckets) + 1)
+            histograma.contagens[posicao] += 1
+            histograma.soma += valor
+            histograma.total += 1
+
+    @contextmanager
+    def etapa(self, operacao: str, etapa: str) -> Iterator[None]:
+        '''
+        Mede o tempo do bloco no histograma excel_etapa_segundos{operacao, etapa}.
+        Ex.: with metricas.etapa("atualizar", "converter"): ...
+        '''
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar("excel_etapa_segundos", "Tempo de cada etapa das operações do Db/Excel", time.perf_counter() - inicio, operacao=operacao, etapa=etapa)
+
+    def linhas(self, operacao: str, direcao: str, quantidade: int):
+        '''
+        Conta linhas recebidas (entrada) ou devolvidas/gravadas (saida) por operação.
+        '''
+        self.incrementar("excel_linhas_total", "Linhas recebidas (entrada) e devolvidas ou gravadas (saida) por operação", quantidade, operacao=operacao, direcao=direcao)
+
+    def adicionar_coletor(self, coletor: Coletor):
+        '''
+        Adiciona uma função chamada a cada exportação para valores instantâneos (gauges).
+        '''
+        with self._trava:
+            self._coletores.append(coletor)
+
+    def limpar(self):
+        with self._trava:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+    def exportar(self) -> str:
+        '''
+        Texto no formato de exposição do Prometheus (text/plain; version=0.0.4).
+        '''
+        linhas = []
+        with self._trava:
+            contadores = {nome: dict(serie) for nome, serie in self._contadores.items()}
+            histogramas = {nome: {r: (list(h.contagens), h.soma, h.total) for r, h in serie.items()} for nome, serie in self._histogramas.items()}
+            ajudas = dict(self._ajudas)
+            coletores = list(self._coletores)
+
+        for nome, serie in sorted(contadores.items()):
+            linhas.append(f"# HELP {nome} {ajudas[nome][1]}")
+            linhas.append(f"# TYPE {nome} counter")
+            for rotulos, valor in sorted(serie.items()):
+                linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_formatar_valor(valor)}")
+
+        limites = [*self._buckets, float("inf")]
+        for nome, serie in sorted(histogramas.items()):
+            linhas.append(f"# HELP {nome} {ajudas[nome][1]}")
+            linhas.append(f"# TYPE {nome} histogram")
+            for rotulos, (contagens, soma, total) in sorted(serie.items()):
+                acumulado = 0
+                for limite, contagem in zip(limites, contagens):
+                    acumulado += contagem
+                    linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos, (('le', _formatar_valor(limite)),))} {acumulado}")
+                linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {_formatar_valor(soma)}")
+                linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {total}")
+
+        #Valores instantâneos dos coletores, agrupados por nome
+        amostras: Dict[str, List[Tuple[str, str, Rotulos, float]]] = {}
+        for coletor in coletores:
+            for nome, tipo, ajuda, rotulos, valor in coletor():
+                amostras.setdefault(nome, []).append((tipo, ajuda, tuple(sorted((k, str(v)) for k, v in rotulos.items())), valor))
+        for nome, valores in sorted(amostras.items()):
+            linhas.append(f"# HELP {nome} {valores[0][1]}")
+            linhas.append(f"# TYPE {nome} {valores[0][0]}")
+            for _, _, rotulos, valor in valores:
+                if valor is not None:
+                    linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_formatar_valor(valor)}")
+        return "\n".join(linhas) + "\n"
+
+class MiddlewareMetricas:
+    '''
+    Middleware ASGI que conta as requisições e mede a latência (até o fim do corpo, inclusive nas respostas em streaming) por rota.
+    Também guarda o escopo da requisição para identificar a rota de origem das consultas lentas (rota_atual).
+    A rota é o caminho declarado (ex.: /api/excel/jobs/{id}), caminhos sem rota ficam como "sem_rota" para não multiplicar as séries.
+    '''
+    def __init__(self, app, ignorar: Tuple[str, ...] = ("/metrics", "/static")):
+        self.app = app
+        self.ignorar = ignorar
+        self.metricas = Metricas()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.ignorar):
+            await self.app(scope, receive, send)
+            return
+        _escopo_requisicao.set(scope)
+
+        inicio = time.perf_counter()
+        status = 500
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            rota = scope.get("route")
+            caminho = getattr(rota, "path", None) or "sem_rota"
+            metodo = scope.get("method", "")
+            self.metricas.incrementar("excel_requisicoes_total", "Requisições HTTP por rota, método e status", metodo=metodo, rota=caminho, status=status)
+            self.metricas.observar("excel_requisicao_segundos", "Latência das requisições HTTP por rota e método", time.perf_counter() - inicio, metodo=metodo, rota=caminho)
@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_all_start_methods, get_context
+from typing import Any, List, Optional, Sequence, Tuple, TypedDict
+import functools
+import pickle
+import threading
+
+#Imports internos
+from app.api.excel.classes.conversores import Conversor
+from app.api.excel.classes.lote import ColunaCompacta, compactar, concatenar, impressoes
+from app.api.excel.classes.validacao import ErroValidacaoDict, ValidadorTabela
+
+#Tipagem
+class ContextoDict(TypedDict):
+    posicoes_colunas: List[int] # coluna da matriz de cada coluna convertida
+    conversores: List[Conversor]
+    cabecalho: List[str]
+    validador: ValidadorTabela
+    posicoes_impressao: Optional[List[int]] # colunas convertidas que entram na impressão digital, None sem impressão
+
+class FatiaDict(TypedDict):
+    contexto: bytes # ContextoDict serializado uma vez por chamada (igual em todas as fatias)
+    linhas: List[List[Any]]
+    linhas_origem: Sequence[int]
+
+class ResultadoFatiaDict(TypedDict):
+    colunas: List[ColunaCompacta]
+    erros: List[ErroValidacaoDict]
+
+'''
+Conversão e validação paralela das matrizes grandes do atualizar em um pool de processos (o trabalho é Python puro, preso ao GIL).
+A matriz é dividida em fatias de linhas, uma por processo, enviadas pelo executor (cada fatia é serializada uma única vez).
+As linhas ainda não convertidas são objetos Python (textos, números, datas em texto...), não há buffer tipado para compartilhar
+sem serializar: a ida custa o pickle da fatia no processo principal e a volta o pickle das colunas compactadas (arrays viajam como bytes).
+O contexto (conversores, cabeçalho, validador) é serializado uma vez por chamada e desserializado uma vez por processo (cache).
+Cada processo converte as colunas, aplica as regras por linha (ValidadorTabela.validar_colunas) e calcula a impressão digital.
+A junção segue a ordem das fatias, então o lote e os erros são os mesmos da conversão em um processo só.
+As regras que precisam da matriz inteira (duplicados e colunas ausentes) ficam com o Db.
+Os processos são iniciados por forkserver (ou spawn), nunca por fork: o servidor tem threads (pool do anyio, jobs).
+
+Custo medido (benchmarks, cenário conversao_paralela, matriz de users): converter em um processo custa ~4,2 ms por mil linhas;
+o pool acrescenta ~0,7 ms por mil linhas de serialização no processo principal (serial) e ~1,2 ms por mil linhas de desserialização em cada processo.
+Com P núcleos livres o custo por linha fica em ~0,7 + 5,4 / P, ou seja, ~20% de ganho com 2 núcleos e ~50% com 4; com 1 núcleo o pool
+é ~1,6x mais lento em qualquer tamanho (não há ponto de equilíbrio, extra["linhas_equilibrio"] None). O custo fixo por chamada é de poucos ms,
+mas o primeiro uso inicia os processos (importam o app). Por isso o pool é opcional e desligado por padrão (DB_PARALELO_PROCESSOS) e só é usado
+a partir de DB_PARALELO_MIN_LINHAS linhas (padrão 100 mil, onde a conversão passa de ~400 ms e o ganho com 2 núcleos supera o custo fixo), ver Db.
+'''
+
+@functools.lru_cache(maxsize=8)
+def _contexto(serializado: bytes) -> ContextoDict:
+    return pickle.loads(serializado)
+
+def _converter_fatia(fatia: FatiaDict) -> ResultadoFatiaDict:
+    contexto = _contexto(fatia["contexto"])
+    linhas = fatia["linhas"]
+    colunas = [[converter(linha[poscol]) for linha in linhas] for poscol, converter in zip(contexto["posicoes_colunas"], contexto["conversores"])]
+    erros = contexto["validador"].validar_colunas(contexto["cabecalho"], colunas, fatia["linhas_origem"])
+    if contexto["posicoes_impressao"] is not None:
+        colunas.append(impressoes([colunas[p] for p in contexto["posicoes_impressao"]]))
+    return {"colunas": [compactar(valores) for valores in colunas], "erros": erros}
+
+class ConversaoParalela:
+    '''
+    Pool de processos da conversão paralela, criado no primeiro uso e mantido entre as chamadas.
+    Só é usado com mais de um processo e a partir de min_linhas linhas.
+    '''
+    def __init__(self, processos: int, min_linhas: int):
+        self._processos = processos
+        self.min_linhas = min_linhas
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._trava = threading.Lock()
+
+    @property
+    def processos(self) -> int:
+        return self._processos
+
+    @processos.setter
+    def processos(self, processos: int):
+        with self._trava:
+            if processos != self._processos:
+                self._encerrar_executor()
+            self._processos = processos
+
+    def ativa(self, linhas: int) -> bool:
+        return self._processos > 1 and linhas > 0 and linhas >= self.min_linhas
+
+    def _obter_executor(self) -> ProcessPoolExecutor:
+        with self._trava:
+            if self._executor is None:
+                metodo = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(max_workers=self._processos, mp_context=get_context(metodo))
+            return self._executor
+
+    def _encerrar_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def encerrar(self):
+        with self._trava:
+            self._encerrar_executor()
+
+    def converter(self, linhas: List[List[Any]], posicoes_colunas: List[int], conversores: List[Conversor], cabecalho: List[str], validador: ValidadorTabela, linhas_origem: Sequence[int], posicoes_impressao: Optional[List[int]] = None) -> Tuple[List[ColunaCompacta], List[ErroValidacaoDict]]:
+        '''
+        Converte e valida (regras por linha) as colunas posicoes_colunas das linhas, uma fatia por processo.
+        Devolve as colunas compactadas na ordem do cabeçalho (mais a impressão digital no fim, quando posicoes_impressao é informado)
+        e os erros das fatias na ordem das linhas.
+        '''
+        contexto = pickle.dumps({
+            "posicoes_colunas": posicoes_colunas,
+            "conversores": conversores,
+            "cabecalho": cabecalho,
+            "validador": validador,
+            "posicoes_impressao": posicoes_impressao,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        linhas_por_fatia = -(-len(linhas) // self._processos)
+        tarefas: List[FatiaDict] = [
+            {"contexto": contexto, "linhas": linhas[inicio:inicio + linhas_por_fatia], "linhas_origem": linhas_origem[inicio:inicio + linhas_por_fatia]}
+            for inicio in range(0, len(linhas), linhas_por_fatia)
+        ]
+        try:
+            resultados = list(self._obter_executor().map(_converter_fatia, tarefas))
+        except BrokenProcessPool:
+            #Um processo morreu (ex.: falta de memória), o próximo uso cria um pool novo
+            self.encerrar()
+            raise
+
+        colunas = [concatenar([resultado["colunas"][poscol] for resultado in resultados]) for poscol in range(len(resultados[0]["colunas"]))]
+        erros = [erro for resultado in resultados for erro in resultado["erros"]]
+        return colunas, erros
@@ -0,0 +1,262 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Literal, Optional, Sequence, TypedDict
+
+from sqlalchemy import Table, UniqueConstraint, types
+
+#Tipagem
+RegraValidacao = Literal[
+    "obrigatorio",
+    "coluna_ausente",
+    "tipo",
+    "tamanho",
+    "enum",
+    "duplicado",
+]
+
+class ErroValidacaoDict(TypedDict):
+    linha: Optional[int] # linha na matriz enviada (1 = cabeçalho), None para erros da coluna inteira
+    coluna: str
+    valor: Any
+    regra: RegraValidacao
+    mensagem: str
+
+'''
+Pré-validação das matrizes do atualizar a partir do metadata das tabelas, antes de qualquer instrução SQL.
+As regras de cada coluna (NOT NULL, tamanho do texto, valores do Enum, tipo após a conversão e colunas únicas) são montadas
+uma vez por tabela e aplicadas coluna a coluna: cada regra avalia o conjunto de valores distintos da coluna
+e só percorre as linhas para localizar os valores inválidos quando existe algum.
+Todos os erros são devolvidos juntos (ErroValidacao.erros), com a linha e a coluna de cada um.
+'''
+
+# Tipos aceitos após a conversão, pelo python_type da coluna (os demais tipos não são verificados)
+_TIPOS_ACEITOS = {
+    int: (int,),
+    float: (int, float, Decimal),
+    Decimal: (int, float, Decimal),
+    date: (date,),
+    time: (time,),
+    datetime: (datetime,),
+}
+
+_NOMES_TIPOS = {
+    int: "inteiro",
+    float: "número",
+    Decimal: "número",
+    date: "data (AAAA-MM-DD)",
+    time: "hora (HH:MM:SS)",
+    datetime: "data e hora (AAAA-MM-DD HH:MM:SS)",
+}
+
+# Ordem dos erros de uma mesma linha e coluna (tipo, Enum e tamanho são exclusivos, um valor tem um só motivo)
+_ORDEM_REGRAS = {"coluna_ausente": 0, "obrigatorio": 0, "tipo": 1, "enum": 1, "tamanho": 1, "duplicado": 2}
+
+# Erros listados na mensagem da exceção, a lista completa fica em ErroValidacao.erros
+MAX_MENSAGENS = 100
+
+class ErroValidacao(ValueError):
+    '''
+    Erros da pré-validação do atualizar, a mensagem lista os primeiros MAX_MENSAGENS e erros contém todos.
+    '''
+    def __init__(self, erros: List[ErroValidacaoDict]):
+        self.erros = erros
+        mensagens = [erro["mensagem"] for erro in erros[:MAX_MENSAGENS]]
+        if len(erros) > MAX_MENSAGENS:
+            mensagens.append(f"... e mais {len(erros) - MAX_MENSAGENS} erros.")
+        super().__init__(f"Erros de validação encontrados ({len(erros)}):\n" + "\n".join(mensagens))
+
+def _texto(valor: Any, limite: int = 50) -> str:
+    texto = str(valor)
+    return texto if len(texto) <= limite else texto[:limite] + "..."
+
+class _RegrasColuna:
+    __slots__ = ("nome", "obrigatorio", "exige_valor_inclusao", "tamanho", "enum", "tipos", "nome_tipo", "unica")
+
+    def __init__(self, nome: str, obrigatorio: bool, exige_valor_inclusao: bool, tamanho: Optional[int], enum: Optional[frozenset], tipos: Optional[tuple], nome_tipo: Optional[str], unica: bool):
+        self.nome = nome
+        self.obrigatorio = obrigatorio
+        self.exige_valor_inclusao = exige_valor_inclusao
+        self.tamanho = tamanho
+        self.enum = enum
+        self.tipos = tipos
+        self.nome_tipo = nome_tipo
+        self.unica = unica
+
+class ValidadorTabela:
+    '''
+    Regras de validação de uma tabela montadas a partir do metadata (uma instância por tabela no Db).
+    '''
+    def __init__(self, tabela: Table):
+        self.tabela = tabela.name
+        chave = [c.name for c in tabela.primary_key.columns]
+        self.coluna_id = chave[0] if len(chave) == 1 else None
+        self.autoincremento = self.coluna_id is not None and tabela.c[self.coluna_id].autoincrement == "auto"
+
+        #Colunas únicas: unique=True, UniqueConstraint ou índice único de uma coluna (a chave não entra, ids repetidos atualizam a mesma linha)
+        unicas = {c.name for c in tabela.columns if c.unique}
+        unicas.update(r.columns.keys()[0] for r in tabela.constraints if isinstance(r, UniqueConstraint) and len(r.columns) == 1)
+        unicas.update(i.columns.keys()[0] for i in tabela.indexes if i.unique and len(i.columns) == 1)
+
+        self.regras: Dict[str, _RegrasColuna] = {}
+        for coluna in tabela.columns:
+            tipo = coluna.type
+            enum = frozenset(tipo.enums) if isinstance(tipo, types.Enum) else None
+            try:
+                python_type = None if isinstance(tipo, (types.JSON, types.Boolean)) else tipo.python_type
+            except NotImplementedError:
+                python_type = None
+            obrigatorio = not coluna.nullable and not coluna.primary_key
+            self.regras[coluna.name] = _RegrasColuna(
+                nome=coluna.name,
+                obrigatorio=obrigatorio,
+                exige_valor_inclusao=obrigatorio and coluna.default is None and coluna.server_default is None,
+                tamanho=getattr(tipo, "length", None) if isinstance(tipo, types.String) and enum is None else None,
+                enum=enum,
+                tipos=_TIPOS_ACEITOS.get(python_type),
+                nome_tipo=_NOMES_TIPOS.get(python_type),
+                unica=coluna.name in unicas and not coluna.primary_key,
+            )
+
+    def validar(self, cabecalho: List[str], colunas: List[List[Any]], linhas_origem: List[int] = None, duplicados: bool = True) -> List[ErroValidacaoDict]:
+        '''
+        Valida as colunas já convertidas (uma lista de valores por coluna do cabeçalho, na mesma ordem).
+        linhas_origem informa a linha da matriz original de cada posição (padrão: posição + 2, logo após o cabeçalho)
+        e duplicados ativa a busca de valores repetidos nas colunas únicas.
+        '''
+        quantidade = len(colunas[0]) if colunas else 0
+        if linhas_origem is None:
+            linhas_origem = range(2, quantidade + 2)
+        erros = self.validar_colunas(cabecalho, colunas, linhas_origem)
+        erros.extend(self.validar_matriz(cabecalho, lambda nome: colunas[cabecalho.index(nome)], linhas_origem, duplicados))
+        return ordenar_erros(erros, cabecalho)
+
+    def validar_colunas(self, cabecalho: List[str], colunas: List[List[Any]], linhas_origem: Sequence[int]) -> List[ErroValidacaoDict]:
+        '''
+        Regras que dependem só dos valores de cada linha (NOT NULL, tipo, Enum e tamanho), podem ser aplicadas em fatias da matriz
+        (ex.: conversão paralela) desde que linhas_origem seja a da fatia. Os erros saem na ordem das colunas.
+        '''
+        erros: List[ErroValidacaoDict] = []
+        erro = self._registrador(erros, linhas_origem)
+
+        for nome, valores in zip(cabecalho, colunas):
+            regras = self.regras.get(nome)
+            if regras is None:
+                continue
+            #Tipos presentes na coluna (map em C), a maior parte das regras é decidida só com eles
+            tipos_presentes = set(map(type, valores))
+            tem_nulo = type(None) in tipos_presentes
+            tipos_presentes.discard(type(None))
+
+            #NOT NULL sem valor padrão (nas colunas com padrão a célula vazia recebe o padrão, ver Db.preparar_atualizacao)
+            if regras.exige_valor_inclusao and tem_nulo:
+                for posicao, valor in enumerate(valores):
+                    if valor is None:
+                        erro(posicao, nome, None, "obrigatorio", "valor obrigatório (a coluna não aceita vazio).")
+            #Colunas JSON (listas/dicionários) não formam conjunto, ficam só com a regra de nulo
+            if any(t.__hash__ is None for t in tipos_presentes):
+                continue
+
+            #Cada regra separa os valores distintos inválidos e só então localiza as linhas
+            #O conjunto de distintos só é montado quando necessário (Enum ou algum valor inválido)
+            distintos = None
+            invalidos: Dict[Any, tuple] = {}
+            if regras.tipos is not None and not all(issubclass(t, regras.tipos) for t in tipos_presentes):
+                distintos = set(valores)
+                for valor in distintos:
+                    if valor is not None and not isinstance(valor, regras.tipos):
+                        invalidos[valor] = ("tipo", f"o valor '{_texto(valor)}' não é um(a) {regras.nome_tipo}.")
+            if regras.enum is not None:
+                distintos = distintos or set(valores)
+                for valor in distintos - regras.enum:
+                    if valor is not None:
+                        invalidos[valor] = ("enum", f"o valor '{_texto(valor)}' não é válido. Valores aceitos: {', '.join(sorted(regras.enum))}.")
+            if regras.tamanho is not None and str in tipos_presentes:
+                textos = valores if tipos_presentes == {str} and not tem_nulo else [v for v in valores if isinstance(v, str)]
+                if max(map(len, textos)) > regras.tamanho:
+                    distintos = distintos or set(valores)
+                    for valor in distintos:
+                        if isinstance(valor, str) and len(valor) > regras.tamanho:
+                            invalidos.setdefault(valor, ("tamanho", f"o texto tem {len(valor)} caracteres, o máximo é {regras.tamanho}."))
+            if invalidos:
+                for posicao, valor in enumerate(valores):
+                    motivo = invalidos.get(valor)
+                    if motivo is not None:
+                        erro(posicao, nome, valor, motivo[0], motivo[1])
+        return erros
+
+    def validar_matriz(self, cabecalho: List[str], obter_coluna: Callable[[str], List[Any]], linhas_origem: Sequence[int], duplicados: bool = True) -> List[ErroValidacaoDict]:
+        '''
+        Regras que precisam da matriz inteira: colunas obrigatórias ausentes (quando há inclusões) e valores repetidos nas colunas únicas.
+        obter_coluna(nome) devolve os valores da coluna, só as colunas usadas por essas regras são lidas.
+        '''
+        erros: List[ErroValidacaoDict] = []
+        erro = self._registrador(erros, linhas_origem)
+
+        #Colunas obrigatórias sem valor padrão ausentes do cabeçalho: só importam se houver inclusões
+        #Aqui só as linhas sem id, os ids informados que não existem na tabela são conferidos na gravação (validar_inclusoes)
+        if self.autoincremento and self.coluna_id in cabecalho and self.colunas_ausentes(cabecalho):
+            erros.extend(self.validar_inclusoes(cabecalho, sum(1 for id in obter_coluna(self.coluna_id) if _sem_id(id))))
+
+        #Valores repetidos na própria matriz em colunas únicas (o banco recusaria na gravação)
+        #O mesmo id repetido com o mesmo valor é a mesma linha, não conta como repetição (linhas sem id são sempre linhas diferentes)
+        if duplicados:
+            ids = obter_coluna(self.coluna_id) if self.coluna_id in cabecalho else None
+            for nome in cabecalho:
+                regras = self.regras.get(nome)
+                if regras is None or not regras.unica:
+                    continue
+                valores = obter_coluna(nome)
+                if any(t.__hash__ is None for t in set(map(type, valores))):
+                    continue
+                distintos = set(valores)
+                if len(distintos) - (None in distintos) < len(valores) - valores.count(None):
+                    primeiras: Dict[Any, int] = {}
+                    for posicao, valor in enumerate(valores):
+                        if valor is None:
+                            continue
+                        primeira = primeiras.setdefault(valor, posicao)
+                        if primeira == posicao:
+                            continue
+                        if ids is not None and ids[posicao] == ids[primeira] and not _sem_id(ids[posicao]):
+                            continue
+                        erro(posicao, nome, valor, "duplicado", f"o valor '{_texto(valor)}' já aparece na linha {linhas_origem[primeira]} e a coluna é única.")
+        return erros
+
+    def colunas_ausentes(self, cabecalho: List[str]) -> List[str]:
+        '''
+        Colunas obrigatórias sem valor padrão que não estão no cabeçalho (necessárias apenas para incluir registros).
+        '''
+        return [r.nome for r in self.regras.values() if r.exige_valor_inclusao and r.nome not in cabecalho]
+
+    def validar_inclusoes(self, cabecalho: List[str], inclusoes: int) -> List[ErroValidacaoDict]:
+        '''
+        Colunas obrigatórias sem valor padrão ausentes do cabeçalho quando a matriz tem inclusoes linhas a incluir.
+        Usado pelo validar_matriz (linhas sem id) e pelo Db.gravar_atualizacao, que conhece os ids informados que não existem na tabela.
+        '''
+        erros: List[ErroValidacaoDict] = []
+        if inclusoes:
+            erro = self._registrador(erros, ())
+            for coluna in self.colunas_ausentes(cabecalho):
+                erro(None, coluna, None, "coluna_ausente", f"obrigatória para incluir registros ({inclusoes} linhas a incluir) e ausente da matriz.")
+        return erros
+
+    @staticmethod
+    def _registrador(erros: List[ErroValidacaoDict], linhas_origem: Sequence[int]) -> Callable[..., None]:
+        def erro(posicao: Optional[int], coluna: str, valor: Any, regra: RegraValidacao, mensagem: str):
+            linha = linhas_origem[posicao] if posicao is not None else None
+            prefixo = f"Linha {linha}, coluna '{coluna}'" if linha is not None else f"Coluna '{coluna}'"
+            erros.append({"linha": linha, "coluna": coluna, "valor": valor, "regra": regra, "mensagem": f"{prefixo}: {mensagem}"})
+        return erro
+
+def _sem_id(id: Any) -> bool:
+    #Linha de inclusão nas tabelas com autoincremento (id vazio ou 0)
+    return id is None or id == "" or id == 0
+
+def ordenar_erros(erros: List[ErroValidacaoDict], cabecalho: List[str]) -> List[ErroValidacaoDict]:
+    '''
+    Ordena os erros pela linha (erros da coluna inteira primeiro), depois pela coluna no cabeçalho e pela regra,
+    a mesma ordem para a validação de uma vez e para a junção das fatias da conversão paralela.
+    '''
+    posicoes = {nome: posicao for posicao, nome in enumerate(cabecalho)}
+    erros.sort(key=lambda e: (e["linha"] or 0, posicoes.get(e["coluna"], -1), _ORDEM_REGRAS[e["regra"]]))
+    return erros
@@ -1,6 +1,7 @@
 #from fastapi import Depends
 from app.api.excel.classes.db import Db
 from app.api.excel.classes.excel import Excel
+from app.api.excel.classes.jobs import GerenciadorJobs
 
 #(db: Db = Depends(get_db)):
 def get_db():
@@ -8,4 +9,8 @@ def get_db():
 
 #(excel: Excel = Depends(get_excel)):
 def get_excel():
-    return Excel()
\ No newline at end of file
+    return Excel()
+
+#(jobs: GerenciadorJobs = Depends(get_jobs)):
+def get_jobs():
+    return GerenciadorJobs()
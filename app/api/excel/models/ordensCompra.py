@@ -11,7 +11,7 @@ class OrdensCompra(Base):
     __tablename__ = 'OrdensCompra'
     PO:Mapped[str] = mapped_column(types.TEXT, primary_key=True,nullable=False,autoincrement=False) 
     Delivery_To: Mapped[str] = mapped_column(types.TEXT)
-    Cliente: Mapped[str] = mapped_column(types.TEXT)
+    Cliente: Mapped[str] = mapped_column(types.TEXT, info={"busca_texto": True})
     Madeira: Mapped[str] = mapped_column(types.TEXT)
     INCO_Terms: Mapped[str] = mapped_column(types.TEXT)
     Cond_PGTO: Mapped[str] = mapped_column(types.TEXT,)
@@ -12,7 +12,7 @@ class Users(Base):
     __tablename__ = 'users'
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    name: Mapped[str] = mapped_column(String(50), nullable=False)
+    name: Mapped[str] = mapped_column(String(50), nullable=False, info={"busca_texto": True})
     email: Mapped[str] = mapped_column(String(100), nullable=False, unique=True)
     idade: Mapped[int] = mapped_column(Integer, nullable=False)
     uf: Mapped[str] = mapped_column(Enum(*UF_LIST, name="uf_enum"), nullable=False)
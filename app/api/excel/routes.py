@@ -1,6 +1,6 @@
 from fastapi import APIRouter
-from app.api.excel.routes_get import obter_estrutura,obter_cabecalhos,caregar_exemplo
-from app.api.excel.routes_post import pesquisar,atualizar
+from app.api.excel.routes_get import obter_estrutura,obter_cabecalhos,caregar_exemplo,obter_estatisticas,obter_job,obter_indices,obter_consultas_lentas
+from app.api.excel.routes_post import pesquisar,atualizar,aplicar_indices
 
 router = APIRouter()
 
@@ -8,10 +8,15 @@ router = APIRouter()
 router.include_router(caregar_exemplo.router, prefix="/carregar_exemplo")
 router.include_router(obter_estrutura.router, prefix="/obter_estrutura")
 router.include_router(obter_cabecalhos.router, prefix="/obter_cabecalhos")
+router.include_router(obter_estatisticas.router, prefix="/obter_estatisticas")
+router.include_router(obter_job.router, prefix="/jobs")
+router.include_router(obter_indices.router, prefix="/obter_indices")
+router.include_router(obter_consultas_lentas.router, prefix="/obter_consultas_lentas")
 
 #Rotas post
 router.include_router(pesquisar.router, prefix="/pesquisar")
 router.include_router(atualizar.router, prefix="/atualizar")
+router.include_router(aplicar_indices.router, prefix="/aplicar_indices")
 
 @router.get("/",include_in_schema=False)
 async def check():
@@ -10,7 +10,7 @@ router = APIRouter()
 @router.get("/")
 async def carregar_exemplo():
     excel = Excel()
-    excel.db.criar_tabelas()  # Cria as tabelas se não existirem
+    await excel.db.executar(excel.db.criar_tabelas)  # Cria as tabelas se não existirem
     
     # Exemplo de uso para atualizar (inclusão de registros em usuarios)
     usuarios = [
@@ -20,7 +20,7 @@ async def carregar_exemplo():
         [0, 'João', 'joao@example.com', 28, 'SP', 'Observação 3', 2800.0, '1992-03-03', True, ['interesse1'], 'A'],
     ]
     try:
-        resultado = excel.atualizar('users', usuarios)
+        resultado = await excel.db.executar(excel.atualizar, 'users', usuarios)
         return {"message": f"Exemplo de uso carregado com sucesso. Ids.:{resultado}"}
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,27 @@
+from typing import Annotated
+from fastapi import APIRouter, Depends, Query
+from app.api.excel import dependencies as dp
+
+router = APIRouter()
+
+
+@router.get("/")
+async def obter_consultas_lentas(
+    limite: Annotated[int, Query(ge=1, le=1000, description="Quantidade máxima de consultas (as mais recentes primeiro)")] = 50,
+    rota: Annotated[str|None, Query(description="Filtra pela rota de origem (trecho do texto, ex.: pesquisar)")] = None,
+    limpar: Annotated[bool, Query(description="Esvazia o registro após a leitura")] = False,
+    db: dp.Db = Depends(dp.get_db)
+):
+    '''
+    Consultas acima de DB_CONSULTA_LENTA_MS com parâmetros, duração, linhas, rota de origem e plano de execução (ou o erro, quando a instrução falhou).
+    '''
+    try:
+        registro = db.consultas_lentas
+        if registro is None:
+            return {"ativo": False, "limite_ms": None, "consultas": []}
+        consultas = registro.consultas(limite, rota)
+        if limpar:
+            registro.limpar()
+        return {"ativo": True, "limite_ms": registro.limite_ms, "consultas": consultas}
+    except Exception as e:
+        return {"error": str(e)}
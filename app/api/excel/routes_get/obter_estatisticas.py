@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from app.api.excel import dependencies as dp
+
+router = APIRouter()
+
+
+@router.get("/")
+async def obter_estatisticas(db: dp.Db = Depends(dp.get_db)):
+    return {
+        "cache": db.estatisticas_cache(),
+        "formas": db.estatisticas_formas(),
+        "pool": db.estatisticas_pool(),
+    }
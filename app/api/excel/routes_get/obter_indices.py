@@ -0,0 +1,22 @@
+from typing import Annotated
+from fastapi import APIRouter, Depends, Query
+from app.api.excel import dependencies as dp
+from app.api.excel.classes import indices
+
+router = APIRouter()
+
+
+@router.get("/")
+async def obter_indices(limite: Annotated[int, Query(ge=1, le=100, description="Quantidade de formas de consulta (as de maior tempo total) analisadas")] = 10, db: dp.Db = Depends(dp.get_db)):
+    '''
+    Sugestões de índices a partir das consultas registradas desde o início do servidor (EXPLAIN das formas mais lentas),
+    com o uso de cada coluna em filtros, relações, agrupamentos e ordenações e as formas analisadas.
+    '''
+    try:
+        return {
+            "sugestoes": await db.executar(indices.sugerir, db, limite),
+            "colunas": db.registro_consultas.colunas(),
+            "formas": db.registro_consultas.formas(limite),
+        }
+    except Exception as e:
+        return {"error": str(e)}
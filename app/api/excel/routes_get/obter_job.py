@@ -0,0 +1,49 @@
+from typing import Annotated
+import asyncio
+import functools
+import json
+import anyio
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from app.api.excel import dependencies as dp
+from app.api.excel.classes.jobs import ESTADOS_FINAIS
+
+router = APIRouter()
+
+
+@router.get("/{id}")
+async def obter_job(id: str, incluir_ids: Annotated[bool, Query(description="Inclui a lista de ids quando o job estiver concluído")] = True, jobs: dp.GerenciadorJobs = Depends(dp.get_jobs)):
+    '''
+    Estado do job: linhas processadas, linhas por segundo, erro (com os erros de validação por linha e coluna em erros) e, ao concluir, a mesma lista de ids do atualizar.
+    '''
+    try:
+        return await anyio.to_thread.run_sync(functools.partial(jobs.obter, id, incluir_ids))
+    except Exception as e:
+        return {"error": str(e)}
+
+@router.get("/{id}/eventos")
+async def eventos_job(id: str, intervalo: Annotated[float, Query(ge=0.1, le=60, description="Segundos entre as verificações do progresso")] = 1.0, jobs: dp.GerenciadorJobs = Depends(dp.get_jobs)):
+    '''
+    Progresso do job via Server-Sent Events: um evento "progresso" a cada mudança e um evento "fim" quando o job terminar
+    (os ids não vão nos eventos, use GET /jobs/{id} ao final).
+    '''
+    try:
+        job = await anyio.to_thread.run_sync(functools.partial(jobs.obter, id, False))
+    except Exception as e:
+        return {"error": str(e)}
+
+    async def gerar_eventos():
+        nonlocal job
+        anterior = None
+        while True:
+            dados = json.dumps(job, ensure_ascii=False)
+            if job["estado"] in ESTADOS_FINAIS:
+                yield f"event: fim\ndata: {dados}\n\n"
+                return
+            if dados != anterior:
+                yield f"event: progresso\ndata: {dados}\n\n"
+                anterior = dados
+            await asyncio.sleep(intervalo)
+            job = await anyio.to_thread.run_sync(functools.partial(jobs.obter, id, False))
+
+    return StreamingResponse(gerar_eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
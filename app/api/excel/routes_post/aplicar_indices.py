@@ -0,0 +1,24 @@
+from typing import Annotated
+from fastapi import APIRouter, Depends
+from app.api.excel import dependencies as dp
+from app.api.excel.classes import indices
+from pydantic import BaseModel,Field
+
+router = APIRouter()
+
+class AplicarIndicesRequest(BaseModel):
+    nomes: Annotated[list[str]|None, Field(default=None, description="Nomes dos índices sugeridos a criar, todos quando omitido", examples=[["ix_orders_status"]])]
+    limite: Annotated[int, Field(default=10, ge=1, le=100, description="Quantidade de formas de consulta analisadas (igual ao GET /obter_indices)")]
+
+
+@router.post("/")
+async def aplicar_indices(body: AplicarIndicesRequest, db: dp.Db = Depends(dp.get_db)):
+    '''
+    Cria os índices sugeridos pelo GET /obter_indices. As sugestões são recalculadas aqui, os nomes que deixaram de ser sugeridos
+    voltam em "nao_encontrados" sem criar nada. Os índices não ficam nos models, declare os que forem mantidos.
+    '''
+    try:
+        sugestoes = await db.executar(indices.sugerir, db, body.limite)
+        return await db.executar(indices.aplicar, db, sugestoes, body.nomes)
+    except Exception as e:
+        return {"error": str(e)}
@@ -1,6 +1,10 @@
-from typing import Annotated,Any
-from fastapi import APIRouter, Depends
+from typing import Annotated,Any,Iterator
+import functools
+import anyio
+from fastapi import APIRouter, Depends, Query, Request
 from app.api.excel import dependencies as dp
+from app.api.excel.classes.leitura import LeitorCarga, resolver_formato_carga
+from app.api.excel.classes.validacao import ErroValidacao
 from pydantic import BaseModel,Field
 
 router = APIRouter()
@@ -9,13 +13,69 @@ class AtualizarRequest(BaseModel):
     tabela: Annotated[str, Field(description="Nome da tabela a ser atualizada",examples=["users"])]
     matriz: Annotated[list[list[Any]], Field(description="Matriz de dados a ser atualizada",examples=[[["id","name","MD"],[1,"John Doe","A"],[2,"Jane Doe","D"]]])]
 
+class AtualizarMatrizRequest(AtualizarRequest):
+    validar_duplicados: Annotated[bool, Field(default=True, description="Recusa a matriz com valores repetidos em colunas únicas (ex.: users.email)")]
+
+class AtualizarJobRequest(AtualizarRequest):
+    tamanho_lote: Annotated[int|None, Field(default=None, gt=0, description="Linhas gravadas por lote (transação), padrão JOBS_TAMANHO_LOTE", examples=[5000])]
+
 
 @router.post("/")
-async def atualizar(body: AtualizarRequest, excel: dp.Excel = Depends(dp.get_excel)):
+async def atualizar(body: AtualizarMatrizRequest, excel: dp.Excel = Depends(dp.get_excel)):
     try:
-        return excel.atualizar(
+        return await excel.db.executar(
+            excel.atualizar,
             tabela=body.tabela,
-            matriz=body.matriz
+            matriz=body.matriz,
+            validar_duplicados=body.validar_duplicados
         )
+    except ErroValidacao as e:
+        #Todos os erros da pré-validação, com a linha e a coluna de cada um
+        return {"error": str(e), "erros": e.erros}
+    except Exception as e:
+       return {"error": str(e)}
+
+@router.post("/stream")
+async def atualizar_stream(
+    request: Request,
+    tabela: Annotated[str, Query(description="Nome da tabela a ser atualizada", examples=["users"])],
+    formato: Annotated[str|None, Query(description="Formato do corpo: ndjson ou csv, quando omitido segue o Content-Type (padrão ndjson)", examples=["csv"])] = None,
+    separador: Annotated[str, Query(min_length=1, max_length=1, description="Separador das colunas no CSV", examples=[";"])] = ",",
+    tamanho_lote: Annotated[int, Query(gt=0, le=100000, description="Linhas gravadas por lote (transação)", examples=[5000])] = 5000,
+    excel: dp.Excel = Depends(dp.get_excel)
+):
+    '''
+    Upload em streaming para o atualizar: o corpo é o cabeçalho seguido das linhas (mesmo formato da matriz, com MD na última coluna),
+    em NDJSON (uma lista JSON por linha) ou CSV, opcionalmente comprimido (Content-Encoding gzip, deflate ou zstd).
+    O corpo é lido aos poucos e gravado em lotes, sem montar a matriz inteira em memória.
+    Retorna a mesma lista de ids do atualizar.
+    '''
+    try:
+        leitor = LeitorCarga(resolver_formato_carga(formato, request.headers.get("content-type")), request.headers.get("content-encoding"), separador)
+        corpo = request.stream()
+
+        async def proximo_pedaco() -> bytes|None:
+            try:
+                return await corpo.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        def pedacos() -> Iterator[bytes]:
+            #Roda na thread do Db.executar, cada pedaço do corpo é buscado no event loop somente quando o lote atual precisa
+            while (pedaco := anyio.from_thread.run(proximo_pedaco)) is not None:
+                yield pedaco
+
+        return await excel.db.executar(excel.atualizar_em_lotes, tabela, leitor.linhas(pedacos()), tamanho_lote)
+    except Exception as e:
+        return {"error": str(e)}
+
+@router.post("/job")
+async def atualizar_job(body: AtualizarJobRequest, jobs: dp.GerenciadorJobs = Depends(dp.get_jobs)):
+    '''
+    Agenda o atualizar em segundo plano e retorna o job imediatamente (estado "pendente").
+    Acompanhe em GET /jobs/{id} (ou /jobs/{id}/eventos via SSE), os ids ficam disponíveis quando o estado for "concluido".
+    '''
+    try:
+        return await anyio.to_thread.run_sync(functools.partial(jobs.enviar, body.tabela, body.matriz, body.tamanho_lote))
     except Exception as e:
-       return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
@@ -1,6 +1,8 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header
+from fastapi.responses import StreamingResponse
 from app.api.excel import dependencies as dp
+from app.api.excel.classes.formatos import TIPOS_MIDIA, codificar, resolver_compressao, resolver_formato
 from pydantic import BaseModel,Field
 
 router = APIRouter()
@@ -13,7 +15,7 @@ class PesquisarRequest(BaseModel):
     criterios: Annotated[list[list[str]], Field(default=None,
                                                 description="Critérios de pesquisa, primeira linha o cabeçalho, as demais os critérios",
                                                 examples=[[["uf","idade","idade","idade"],["SP",">30","<=40","<>10"],["PR","","",""]]])]
-    criterios_tabelas: Annotated[list[str]|None, Field(default=None,
+    criterios_tabelas: Annotated[list[list[str]]|None, Field(default=None,
                                                 description="Tabelas relacionadas aos critérios",
                                                 examples=[[["users","users","users","users"]]])]
     relacoes: Annotated[list[list[str]], Field(default=None,
@@ -22,17 +24,103 @@ class PesquisarRequest(BaseModel):
     caractere_especial: Annotated[str|None, Field(default="-",
                                                  description="Caractere especial utilizado para marcar colunas passadas sem correspondência na base de dados",
                                                  examples=["-"])]
+    agregacoes: Annotated[list[list[str]]|None, Field(default=None,
+                                                 description="Agregação de cada coluna (soma, contar, contar_distintos, media, minimo, maximo), as colunas vazias formam o agrupamento",
+                                                 examples=[[["","","contar","soma"]]])]
+    ordenacao: Annotated[list[list[str]]|None, Field(default=None,
+                                                description="Ordenação de cada coluna (asc, desc ou vazio), aplicada da esquerda para a direita",
+                                                examples=[[["","","","desc"]]])]
+    top: Annotated[int|None, Field(default=None, gt=0,
+                                   description="Quantidade máxima de linhas retornadas (após agregação e ordenação)",
+                                   examples=[10])]
+    limite: Annotated[int|None, Field(default=None, gt=0,
+                                      description="Quantidade de registros da tabela base por página, quando informado o retorno é {dados, cursor}",
+                                      examples=[1000])]
+    cursor: Annotated[str|None, Field(default=None,
+                                      description="Cursor retornado pela página anterior (somente com limite)",
+                                      examples=[None])]
+    formato: Annotated[str|None, Field(default=None,
+                                       description="Formato da resposta: json, ndjson, csv, msgpack (colunar) ou arrow (Arrow IPC stream), quando omitido segue o cabeçalho Accept",
+                                       examples=["arrow"])]
+    compressao: Annotated[str|None, Field(default=None,
+                                          description="Compressão da resposta: gzip ou zstd, quando omitida segue o cabeçalho Accept-Encoding (exceto no json)",
+                                          examples=["gzip"])]
+
+def resposta_codificada(excel: dp.Excel, body: PesquisarRequest, formato: str, compressao: str|None, tamanho_lote: int = 1000) -> StreamingResponse:
+    '''
+    Resposta em streaming no formato pedido, codificada em lotes conforme as linhas são lidas da base.
+    A leitura, a codificação e a compressão de cada lote rodam fora do event loop (Db.iterar).
+    '''
+    linhas = excel.pesquisar_stream(
+        colunas=body.colunas,
+        tabelas=body.tabelas,
+        criterios=body.criterios,
+        criterios_tabelas=body.criterios_tabelas,
+        relacoes=body.relacoes,
+        caractere_especial=body.caractere_especial,
+        agregacoes=body.agregacoes,
+        ordenacao=body.ordenacao,
+        top=body.top,
+        tamanho_lote=tamanho_lote
+    )
+    pedacos = codificar(formato, body.colunas[0], excel.tipos_colunas(body.colunas, body.tabelas, body.agregacoes), linhas, compressao, tamanho_lote)
+    cabecalhos = {"Vary": "Accept, Accept-Encoding"}
+    if compressao:
+        cabecalhos["Content-Encoding"] = compressao
+    return StreamingResponse(excel.db.iterar(pedacos, tamanho_lote=1), media_type=TIPOS_MIDIA[formato], headers=cabecalhos)
 
 @router.post("/")
-async def pesquisar(body: PesquisarRequest, excel: dp.Excel = Depends(dp.get_excel)):
+async def pesquisar(body: PesquisarRequest, accept: Annotated[str|None, Header()] = None, accept_encoding: Annotated[str|None, Header()] = None, excel: dp.Excel = Depends(dp.get_excel)):
+    '''
+    Retorna o resultado da pesquisa, por padrão em JSON (lista de linhas).
+    Com formato (ou Accept) ndjson, csv, msgpack ou arrow, ou com compressão, o resultado é enviado em streaming no formato pedido.
+    '''
     try:
-        return excel.pesquisar(
+        formato = resolver_formato(body.formato, accept)
+        compressao = resolver_compressao(body.compressao, accept_encoding if formato != "json" else None)
+        if formato != "json" or compressao:
+            if body.limite:
+                raise ValueError("A paginação (limite/cursor) só está disponível no formato json sem compressão.")
+            return resposta_codificada(excel, body, formato, compressao)
+        if body.limite:
+            return await excel.db.executar(
+                excel.pesquisar_pagina,
+                colunas=body.colunas,
+                tabelas=body.tabelas,
+                criterios=body.criterios,
+                criterios_tabelas=body.criterios_tabelas,
+                relacoes=body.relacoes,
+                caractere_especial=body.caractere_especial,
+                agregacoes=body.agregacoes,
+                ordenacao=body.ordenacao,
+                top=body.top,
+                limite=body.limite,
+                cursor=body.cursor
+            )
+        return await excel.db.executar(
+            excel.pesquisar,
             colunas=body.colunas,
             tabelas=body.tabelas,
             criterios=body.criterios,
             criterios_tabelas=body.criterios_tabelas,
             relacoes=body.relacoes,
-            caractere_especial=body.caractere_especial
+            caractere_especial=body.caractere_especial,
+            agregacoes=body.agregacoes,
+            ordenacao=body.ordenacao,
+            top=body.top
         )
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+@router.post("/stream")
+async def pesquisar_stream(body: PesquisarRequest, accept_encoding: Annotated[str|None, Header()] = None, excel: dp.Excel = Depends(dp.get_excel)):
+    '''
+    Retorna o resultado em NDJSON (uma linha JSON por registro) conforme as linhas são lidas da base.
+    Aceita os mesmos formatos e compressões do pesquisar via parâmetros formato/compressao.
+    '''
+    try:
+        formato = resolver_formato(body.formato) if body.formato else "ndjson"
+        compressao = resolver_compressao(body.compressao, accept_encoding)
+        return resposta_codificada(excel, body, formato, compressao)
+    except Exception as e:
+        return {"error": str(e)}
@@ -1,14 +1,27 @@
 #Core
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
 #imports
 from app.api.routes import router as api_router
+from app.api.excel.classes.jobs import GerenciadorJobs
+from app.api.excel.classes.metricas import Metricas, MiddlewareMetricas
+
+#Ciclo de vida: retoma os jobs pendentes ou abandonados (pulso vencido, ver classes/jobs.py) ao iniciar e os pausa (após o lote em andamento) ao encerrar
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    jobs = GerenciadorJobs()
+    jobs.retomar()
+    yield
+    jobs.encerrar()
 
 #Criação da instância do FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+#Contadores e latência das requisições por rota, expostos em /metrics
+app.add_middleware(MiddlewareMetricas)
 templates = Jinja2Templates(directory="app/htmlTemplates")
 
 # Para servir arquivos estáticos (CSS, JS, imagens) da pasta "static"
@@ -30,3 +43,8 @@ app.include_router(api_router, prefix="/api")
 async def home():
     return paginaInicial
 
+#Métricas no formato de exposição do Prometheus
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metricas():
+    return PlainTextResponse(Metricas().exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
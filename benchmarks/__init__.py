@@ -0,0 +1,10 @@
+'''
+Benchmark do Excel/Db.
+
+Popula um SQLite local (ou o banco de --database-url) com dados sintéticos em users, orders e OrdensCompra
+e mede vazão e latência (p50/p95/p99) do Excel.atualizar, Excel.pesquisar, Db.remover e das rotas HTTP.
+
+Uso (na raiz do projeto):
+    python -m benchmarks --tamanhos 10000 100000 --saida atual.json
+    python -m benchmarks --tamanhos 10000 --cenarios pesquisar_tabela rotas --comparar anterior.json
+'''
@@ -0,0 +1,130 @@
+from datetime import datetime
+from typing import Any, Dict, List
+import argparse
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+
+#Configuração padrão do benchmark, antes de importar o Db (lida na criação do Db)
+os.environ.setdefault("DB_CACHE_MAX_ITENS", "0") # mede as consultas reais, não o cache de resultados
+os.environ.setdefault("EXCEL_TOKEN", "benchmark")
+
+#Imports internos
+from app.api.excel.classes.db import Db
+from app.api.excel.classes.excel import Excel
+from app.api.excel.classes.singleton import Singleton
+from benchmarks.cenarios import CENARIOS, Contexto
+from benchmarks.dados import popular
+from benchmarks.medicao import ResultadoDict, comparar, imprimir, resumir, salvar
+
+def _argumentos() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark do Excel/Db (atualizar, pesquisar, remover e rotas).")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[10000, 100000, 1000000], help="Quantidade de linhas por tabela (users, orders e OrdensCompra).")
+    parser.add_argument("--cenarios", nargs="+", choices=list(CENARIOS), default=list(CENARIOS), help="Cenários a medir (padrão: todos).")
+    parser.add_argument("--repeticoes", type=int, default=20, help="Repetições medidas por cenário.")
+    parser.add_argument("--lote", type=int, default=1000, help="Linhas por chamada nos cenários de atualizar/remover e por página no pesquisar_pagina.")
+    parser.add_argument("--concorrencia", type=int, default=8, help="Threads simultâneas no cenário rota_pesquisar_concorrente.")
+    parser.add_argument("--database-url", default=None, help="URL do banco, {tamanho} é substituído pelo tamanho (padrão: SQLite em arquivo temporário).")
+    parser.add_argument("--semente", type=int, default=42, help="Semente dos dados sintéticos.")
+    parser.add_argument("--saida", default="benchmark_resultados.json", help="Arquivo JSON com os resultados.")
+    parser.add_argument("--comparar", default=None, help="Arquivo JSON de uma execução anterior para comparar.")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="Aumento de latência aceito na comparação (0.10 = 10%%).")
+    return parser.parse_args()
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def _ambiente(args: argparse.Namespace) -> Dict[str, Any]:
+    return {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "processadores": os.cpu_count(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("saida", "comparar")},
+        "configuracao": {k: v for k, v in os.environ.items() if k.startswith("DB_")},
+    }
+
+def _criar_excel(database_url: str) -> Excel:
+    '''
+    Cria o Db do tamanho atual, descartando o anterior (Db e Excel são singletons).
+    '''
+    instancias_db = type(Db)._instances
+    if Db in instancias_db:
+        instancias_db.pop(Db).engine.dispose()
+    Singleton._instances.pop(Excel, None)
+    db = Db(database_url)
+    db.engine.echo = False # o log de SQL distorce as medições
+    return Excel()
+
+def _executar(args: argparse.Namespace, pasta_temporaria: str) -> List[ResultadoDict]:
+    resultados: List[ResultadoDict] = []
+    for tamanho in args.tamanhos:
+        if args.database_url:
+            database_url = args.database_url.format(tamanho=tamanho)
+        else:
+            database_url = f"sqlite:///{os.path.join(pasta_temporaria, f'benchmark_{tamanho}.db')}"
+        excel = _criar_excel(database_url)
+
+        print(f"Populando {tamanho} linhas por tabela em {database_url}...", file=sys.stderr)
+        inicio = time.perf_counter()
+        popular(excel.db, tamanho, args.semente)
+        resultados.append(resumir("popular", tamanho, [time.perf_counter() - inicio], 3 * tamanho))
+
+        ctx = Contexto(excel, tamanho, args.repeticoes, args.lote, args.concorrencia, args.semente)
+        for nome in args.cenarios:
+            print(f"  {nome}...", file=sys.stderr)
+            resultados.extend(CENARIOS[nome](ctx))
+
+    return resultados
+
+def main():
+    args = _argumentos()
+    pasta_temporaria = tempfile.mkdtemp(prefix="benchmark_excel_")
+    try:
+        resultados = _executar(args, pasta_temporaria)
+    finally:
+        #Descarta o engine e os bancos temporários (o de 1M linhas passa de centenas de MB)
+        if Db in type(Db)._instances:
+            type(Db)._instances.pop(Db).engine.dispose()
+        shutil.rmtree(pasta_temporaria, ignore_errors=True)
+
+    imprimir(resultados)
+    salvar(args.saida, _ambiente(args), resultados)
+    print(f"\nResultados salvos em {args.saida}")
+
+    #Séries de escala (ex.: atualizar_escala) com crescimento acima do linear
+    nao_lineares = [r for r in resultados if r["extra"].get("linear") is False]
+    for r in nao_lineares:
+        print(f"\nCrescimento não linear em {r['cenario']}: tempo por linha {r['extra']['razao_por_linha']:.1f}x maior em {r['tamanho']} linhas")
+
+    #Cenários com verificações (ex.: jobs_retomada) que falharam
+    com_falhas = [r for r in resultados if r["extra"].get("falhas")]
+    for r in com_falhas:
+        print(f"\nVerificações com falha em {r['cenario']}: " + "; ".join(r["extra"]["falhas"]))
+
+    if args.comparar:
+        comparacoes = comparar(args.comparar, resultados, args.tolerancia)
+        regressoes = [c for c in comparacoes if c["regressao"]]
+        print(f"\nComparação com {args.comparar}: {len(comparacoes)} métricas, {len(regressoes)} regressões acima de {args.tolerancia:.0%}")
+        for c in regressoes:
+            print(f"  {c['cenario']} ({c['tamanho']}) {c['metrica']}: {c['anterior']:.2f} -> {c['atual']:.2f} ({c['variacao']:+.1%})")
+        if regressoes:
+            sys.exit(1)
+    if nao_lineares or com_falhas:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1014 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import anyio
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, or_, select, text
+
+#Imports internos
+from app.api.excel.classes import criterios as criterios_sql
+from app.api.excel.classes.busca import IndiceTexto
+from app.api.excel.classes.conversores import conversor_para_tipo
+from app.api.excel.classes.db import intercalar_ids
+from app.api.excel.classes.excel import Excel
+from app.api.excel.classes.jobs import GerenciadorJobs
+from app.api.excel.classes.singleton import Singleton
+from app.api.excel.classes.validacao import ErroValidacao
+from app.api.excel.models.users import UF_LIST
+from benchmarks.dados import COLUNAS_USERS, STATUS, matriz_ordens_compra, matriz_users, matriz_users_existentes
+from benchmarks.medicao import ResultadoDict, medir, pico_memoria, resumir
+
+'''
+Cenários medidos pelo benchmark.
+Cada cenário recebe o Contexto e devolve uma lista de resultados (um cenário pode gerar mais de uma medição, ex.: uma por estratégia).
+'''
+
+class Contexto:
+    def __init__(self, excel: Excel, tamanho: int, repeticoes: int, lote: int, concorrencia: int, semente: int = 42):
+        self.excel = excel
+        self.db = excel.db
+        self.tamanho = tamanho
+        self.repeticoes = repeticoes
+        self.lote = min(lote, tamanho)
+        self.concorrencia = concorrencia
+        self.rnd = random.Random(semente)
+        #Contador global das chamadas, mantém dados únicos entre aquecimento, repetições e cenários
+        self.chamadas = itertools.count()
+
+    def ids_existentes(self, quantidade: int, ate: int = None) -> List[int]:
+        return self.rnd.sample(range(1, (ate or self.tamanho) + 1), quantidade)
+
+#Atualizar
+# Tamanhos do atualizar_escala e o crescimento aceito do tempo por linha entre o menor e o maior
+ESCALAS = (1_000, 10_000, 100_000, 1_000_000)
+LIMITE_LINEAR = 2.0
+# Prazo do pulso (segundos) dos gerenciadores de jobs dos cenários, curto para a retomada não esperar o padrão
+PRAZO_JOBS = 1.0
+# Processos medidos no conversao_paralela
+PROCESSOS_CONVERSAO = (1, 2, 4, 8)
+# Tamanho da segunda medição do conversao_paralela, usada para separar o custo fixo do custo por linha
+LINHAS_EQUILIBRIO = 10_000
+
+def atualizar_inclusao(ctx: Contexto) -> List[ResultadoDict]:
+    def operacao(repeticao: int):
+        ctx.excel.atualizar("users", matriz_users([None] * ctx.lote, ctx.rnd, f"i{next(ctx.chamadas)}"))
+    return [medir("atualizar_inclusao", ctx.tamanho, operacao, ctx.repeticoes, ctx.lote)]
+
+def atualizar_alteracao(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Uma medição por estratégia de atualização (diff e upsert), a estratégia configurada é restaurada ao final.
+    '''
+    resultados = []
+    estrategia_original = ctx.db.estrategia_atualizacao
+    try:
+        for estrategia in ("diff", "upsert"):
+            ctx.db.estrategia_atualizacao = estrategia
+            def operacao(repeticao: int):
+                ids = ctx.ids_existentes(ctx.lote, ctx.tamanho // 2)
+                ctx.excel.atualizar("users", matriz_users(ids, ctx.rnd, f"a{next(ctx.chamadas)}"))
+            try:
+                resultados.append(medir(f"atualizar_alteracao_{estrategia}", ctx.tamanho, operacao, ctx.repeticoes, ctx.lote, extra={"estrategia": estrategia}))
+            except ValueError as e:
+                #Ex.: upsert em SQLite anterior ao 3.24
+                print(f"atualizar_alteracao_{estrategia} ignorado: {e}", file=sys.stderr)
+    finally:
+        ctx.db.estrategia_atualizacao = estrategia_original
+    return resultados
+
+def atualizar_reenvio(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Reenvio da planilha inteira (até 100 mil users lidos do banco) com cerca de 1% das linhas alteradas, uma medição por estratégia.
+    Mede o caso comum em que a maior parte das linhas chega igual ao que já está gravado.
+    '''
+    quantidade = min(ctx.tamanho, 100_000)
+    matriz = matriz_users_existentes(ctx.db.consultar_base(COLUNAS_USERS, ["users"] * len(COLUNAS_USERS), top=quantidade))
+    cabecalho, linhas = matriz[0], matriz[1:]
+    posicao_observacao = COLUNAS_USERS.index("observacao")
+    alteradas = max(1, len(linhas) // 100)
+    resultados = []
+    estrategia_original = ctx.db.estrategia_atualizacao
+    try:
+        for estrategia in ("diff", "upsert"):
+            ctx.db.estrategia_atualizacao = estrategia
+            def operacao(repeticao: int):
+                chamada = next(ctx.chamadas)
+                for pos in ctx.rnd.sample(range(len(linhas)), alteradas):
+                    linhas[pos][posicao_observacao] = f"reenvio {chamada}"
+                ctx.excel.atualizar("users", [cabecalho] + linhas)
+            try:
+                resultados.append(medir(f"atualizar_reenvio_{estrategia}", ctx.tamanho, operacao, ctx.repeticoes, len(linhas), extra={"estrategia": estrategia, "alteradas": alteradas}))
+            except ValueError as e:
+                print(f"atualizar_reenvio_{estrategia} ignorado: {e}", file=sys.stderr)
+    finally:
+        ctx.db.estrategia_atualizacao = estrategia_original
+    return resultados
+
+# Colunas de users que aceitam célula em branco no celulas_vazias e o valor gravado (eh_funcionario é NOT NULL com default=False)
+VAZIOS_USERS = {"salario": None, "data_nascimento": None, "eh_funcionario": False, "interesses": None}
+
+def _verificar_vazios(ctx: Contexto, sufixo: str) -> List[str]:
+    '''
+    Células em branco ("" e só espaços) nas colunas que não são texto, na inclusão e na alteração. Devolve as falhas.
+    '''
+    falhas = []
+    posicoes = {coluna: COLUNAS_USERS.index(coluna) for coluna in VAZIOS_USERS}
+    ler = lambda ids: {linha[0]: dict(zip(VAZIOS_USERS, linha[1:])) for linha in ctx.db.consultar_base(["id", *VAZIOS_USERS], ["users"] * (len(VAZIOS_USERS) + 1), [["id"], [";".join(map(str, ids))]], ["users"])}
+
+    #Inclusão: a primeira linha com as células em branco, a segunda marcada como funcionário
+    matriz = matriz_users([None, None], ctx.rnd, sufixo)
+    for coluna, posicao in posicoes.items():
+        matriz[1][posicao] = "" if coluna != "data_nascimento" else "  "
+    matriz[2][posicoes["eh_funcionario"]] = True
+    ids = ctx.excel.atualizar("users", matriz)[1:]
+    gravados = ler(ids)
+    if gravados.get(ids[0]) != VAZIOS_USERS:
+        falhas.append(f"inclusão com células em branco gravou {gravados.get(ids[0])}, esperado {VAZIOS_USERS}")
+    if gravados.get(ids[1], {}).get("eh_funcionario") is not True:
+        falhas.append(f"inclusão com eh_funcionario marcado gravou {gravados.get(ids[1])}")
+
+    #Alteração: o funcionário recebe a célula em branco (volta ao padrão False) e a linha em branco é marcada
+    matriz = matriz_users(ids, ctx.rnd, sufixo + "a")
+    matriz[1][posicoes["eh_funcionario"]] = True
+    matriz[2][posicoes["eh_funcionario"]] = ""
+    matriz[2][posicoes["salario"]] = " "
+    ctx.excel.atualizar("users", matriz)
+    gravados = ler(ids)
+    if gravados.get(ids[0], {}).get("eh_funcionario") is not True:
+        falhas.append(f"alteração para eh_funcionario marcado gravou {gravados.get(ids[0])}")
+    if gravados.get(ids[1], {}).get("eh_funcionario") is not False or gravados.get(ids[1], {}).get("salario") is not None:
+        falhas.append(f"alteração com eh_funcionario e salario em branco gravou {gravados.get(ids[1])}, esperado False e None")
+
+    #NOT NULL sem padrão continua obrigatório
+    matriz = matriz_users([None], ctx.rnd, sufixo + "o")
+    matriz[1][COLUNAS_USERS.index("idade")] = " "
+    matriz[1][posicoes["eh_funcionario"]] = ""
+    try:
+        ctx.excel.atualizar("users", matriz)
+        falhas.append("idade em branco (NOT NULL sem padrão) foi aceita")
+    except ErroValidacao as e:
+        regras = [(erro["coluna"], erro["regra"]) for erro in e.erros]
+        if regras != [("idade", "obrigatorio")]:
+            falhas.append(f"idade e eh_funcionario em branco geraram os erros {regras}, esperado só idade obrigatório")
+    return falhas
+
+def celulas_vazias(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Verificação das células em branco nas colunas que não são texto (nulo nas anuláveis, padrão nas NOT NULL com padrão, obrigatório nas demais),
+    na inclusão e na alteração, com as duas estratégias e com a conversão paralela. Uma medição por combinação, extra["falhas"] lista as verificações que falharam.
+    '''
+    resultados = []
+    estrategia_original = ctx.db.estrategia_atualizacao
+    paralela = ctx.db.conversao_paralela
+    processos_original, min_linhas_original = paralela.processos, paralela.min_linhas
+    try:
+        for estrategia, processos in (("diff", 0), ("upsert", 0), ("diff", 2)):
+            ctx.db.estrategia_atualizacao = estrategia
+            paralela.processos, paralela.min_linhas = processos, 0
+            nome = f"celulas_vazias_{estrategia}" + ("_paralela" if processos else "")
+            falhas = []
+            def operacao(repeticao: int):
+                try:
+                    falhas.extend(_verificar_vazios(ctx, f"v{next(ctx.chamadas)}"))
+                except ErroValidacao as e:
+                    #ErroValidacao é um ValueError, não pode cair no "ignorado" abaixo
+                    falhas.append(f"células em branco recusadas: {e}")
+            try:
+                resultados.append(medir(nome, ctx.tamanho, operacao, ctx.repeticoes, 5, aquecimento=0, extra={"estrategia": estrategia, "processos": processos, "falhas": falhas}))
+            except ValueError as e:
+                print(f"{nome} ignorado: {e}", file=sys.stderr)
+            for falha in dict.fromkeys(falhas):
+                print(f"{nome}: {falha}", file=sys.stderr)
+    finally:
+        ctx.db.estrategia_atualizacao = estrategia_original
+        paralela.processos, paralela.min_linhas = processos_original, min_linhas_original
+    return resultados
+
+# Colunas obrigatórias sem padrão de users, recusadas pelo validacao_matriz quando ausentes em uma inclusão por id informado
+OBRIGATORIAS_USERS = ("name", "idade", "uf")
+
+def _verificar_matriz(ctx: Contexto, sufixo: str) -> List[str]:
+    '''
+    Regras da matriz inteira do atualizar: ids informados que não existem são inclusões (colunas obrigatórias ausentes)
+    e o mesmo id repetido com o mesmo valor em coluna única não é duplicado. Devolve as falhas.
+    '''
+    falhas = []
+    def regras_erro(tabela: str, matriz: List[List[Any]]) -> Any:
+        #Regras (coluna, regra) do ErroValidacao, None quando a matriz é aceita
+        try:
+            ctx.db.atualizar(tabela, matriz)
+            return None
+        except ErroValidacao as e:
+            return sorted((erro["coluna"], erro["regra"]) for erro in e.erros)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"[:200]
+
+    #Mesmo id repetido com o mesmo e-mail: a mesma linha, aceita (linhas próprias, outros cenários removem ids da base)
+    id1, id2 = ctx.db.atualizar("users", matriz_users([None, None], ctx.rnd, sufixo))
+    email = f"mesmo_{sufixo}@exemplo.com"
+    resultado = regras_erro("users", [["id", "email"], [id1, email], [id1, email]])
+    if resultado is not None:
+        falhas.append(f"id {id1} repetido com o mesmo e-mail recusado: {resultado}")
+    #Ids diferentes com o mesmo e-mail continuam duplicados
+    email = f"outro_{sufixo}@exemplo.com"
+    resultado = regras_erro("users", [["id", "email"], [id1, email], [id2, email]])
+    if resultado != [("email", "duplicado")]:
+        falhas.append(f"ids {id1} e {id2} com o mesmo e-mail geraram {resultado}, esperado email duplicado")
+
+    #Id informado que não existe, sem as colunas obrigatórias: inclusão recusada antes de gravar
+    id_novo = 10**9 + next(ctx.chamadas)
+    resultado = regras_erro("users", [["id", "email"], [id1, f"existe_{sufixo}@exemplo.com"], [id_novo, f"novo_{sufixo}@exemplo.com"]])
+    esperado = sorted((coluna, "coluna_ausente") for coluna in OBRIGATORIAS_USERS)
+    if resultado != esperado:
+        falhas.append(f"id {id_novo} inexistente sem as colunas obrigatórias gerou {resultado}, esperado {esperado}")
+    if ctx.db.consultar_base(["id"], ["users"], [["email"], [f"existe_{sufixo}@exemplo.com"]], ["users"]):
+        falhas.append("a alteração da matriz recusada foi gravada")
+
+    #OrdensCompra (chave texto sem autoincremento): PO existente só com o Cliente é aceita, PO nova é inclusão
+    resultado = regras_erro("OrdensCompra", [["PO", "Cliente"], [f"PO{1:08d}", f"Cliente {sufixo}"]])
+    if resultado is not None:
+        falhas.append(f"alteração de PO existente só com o Cliente recusada: {resultado}")
+    resultado = regras_erro("OrdensCompra", [["PO", "Cliente"], [f"PONOVA{sufixo}", "Cliente novo"]])
+    if not isinstance(resultado, list) or not resultado or any(regra != "coluna_ausente" for _, regra in resultado):
+        falhas.append(f"PO nova sem as colunas obrigatórias gerou {resultado}, esperado coluna_ausente")
+    return falhas
+
+def validacao_matriz(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Verificação das regras da matriz inteira (colunas obrigatórias ausentes com ids informados inexistentes e duplicados por id)
+    com as duas estratégias. Uma medição por estratégia, extra["falhas"] lista as verificações que falharam.
+    '''
+    resultados = []
+    estrategia_original = ctx.db.estrategia_atualizacao
+    try:
+        for estrategia in ("diff", "upsert"):
+            ctx.db.estrategia_atualizacao = estrategia
+            falhas = []
+            def operacao(repeticao: int):
+                falhas.extend(_verificar_matriz(ctx, f"m{next(ctx.chamadas)}"))
+            resultados.append(medir(f"validacao_matriz_{estrategia}", ctx.tamanho, operacao, ctx.repeticoes, 6, aquecimento=0, extra={"estrategia": estrategia, "falhas": falhas}))
+            for falha in dict.fromkeys(falhas):
+                print(f"validacao_matriz_{estrategia}: {falha}", file=sys.stderr)
+    finally:
+        ctx.db.estrategia_atualizacao = estrategia_original
+    return resultados
+
+#Processo do jobs_retomada: envia o job e morre (os._exit, sem encerrar nada) depois do commit do primeiro lote
+#na base principal e antes do registro do progresso na base dos jobs
+_PROCESSO_JOB_INTERROMPIDO = """
+import json, os, sys, time
+from app.api.excel.classes.db import Db
+from app.api.excel.classes.jobs import GerenciadorJobs
+Db(os.environ["BENCHMARK_DATABASE_URL"]).engine.echo = False
+GerenciadorJobs._registrar_lote = lambda self, id, numero, ids: os._exit(3)
+job = GerenciadorJobs(os.environ["BENCHMARK_JOBS_URL"]).enviar("users", json.load(sys.stdin), int(os.environ["BENCHMARK_TAMANHO_LOTE"]))
+print(job["id"], flush=True)
+time.sleep(300)
+os._exit(4)
+"""
+
+def jobs_retomada(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Job de inclusões (3 lotes) interrompido entre o commit de um lote na base principal e o registro do progresso na base dos jobs
+    (processo morto com os._exit), depois retomado por outro GerenciadorJobs. Mede a retomada e verifica que nenhuma inclusão
+    é gravada duas vezes e que os ids do job são os gravados. extra["falhas"] lista as verificações que falharam (o __main__ falha se houver).
+    '''
+    quantidade = min(ctx.lote * 3, ctx.tamanho)
+    tamanho_lote = max(1, -(-quantidade // 3))
+    sufixo = f"job{next(ctx.chamadas)}r"
+    matriz = matriz_users([None] * quantidade, ctx.rnd, sufixo)
+    pasta = tempfile.mkdtemp(prefix="benchmark_jobs_")
+    jobs_url = f"sqlite:///{os.path.join(pasta, 'jobs.db')}"
+    falhas = []
+
+    ambiente = dict(os.environ, BENCHMARK_DATABASE_URL=ctx.db.engine.url.render_as_string(hide_password=False), BENCHMARK_JOBS_URL=jobs_url, BENCHMARK_TAMANHO_LOTE=str(tamanho_lote))
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processo = subprocess.run([sys.executable, "-c", _PROCESSO_JOB_INTERROMPIDO], input=json.dumps(matriz, default=str), text=True, env=ambiente, cwd=raiz, capture_output=True, timeout=600)
+    if processo.returncode != 3:
+        falhas.append(f"o processo do job terminou com o código {processo.returncode} em vez de morrer entre os commits: {processo.stderr[-500:]}")
+    id = processo.stdout.strip()
+
+    #Retomada em um gerenciador novo (o singleton do processo atual não pode ser reaproveitado com outra base)
+    anterior = Singleton._instances.pop(GerenciadorJobs, None)
+    jobs = GerenciadorJobs(jobs_url)
+    duracao = 0.0
+    job = None
+    try:
+        if id:
+            #O pulso do processo morto ainda está no prazo: o job não pode ser retomado
+            if jobs.retomar() != 0:
+                falhas.append("job com o pulso do dono dentro do prazo foi retomado por outro processo")
+            jobs.prazo = PRAZO_JOBS
+            time.sleep(PRAZO_JOBS)
+            inicio = time.perf_counter()
+            jobs.retomar()
+            job = _aguardar_job(jobs, id)
+            duracao = time.perf_counter() - inicio
+    finally:
+        _encerrar_gerenciador(jobs)
+        Singleton._instances.pop(GerenciadorJobs, None)
+        if anterior is not None:
+            Singleton._instances[GerenciadorJobs] = anterior
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    falhas.extend(_verificar_job(ctx, id, job, sufixo, quantidade))
+    for falha in falhas:
+        print(f"jobs_retomada: {falha}", file=sys.stderr)
+    return [resumir("jobs_retomada", ctx.tamanho, [duracao], quantidade, {"lotes": 3, "tamanho_lote": tamanho_lote, "falhas": falhas})]
+
+def jobs_concorrentes(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Dois gerenciadores (como dois workers do gunicorn) na mesma base de jobs: um envia o job e o outro chama retomar logo em seguida.
+    Só um deles pode reivindicar o job, verifica que nenhuma inclusão é gravada duas vezes. Uma medição por repetição.
+    '''
+    quantidade = min(ctx.lote * 3, ctx.tamanho)
+    tamanho_lote = max(1, -(-quantidade // 3))
+    pasta = tempfile.mkdtemp(prefix="benchmark_jobs_")
+    jobs_url = f"sqlite:///{os.path.join(pasta, 'jobs.db')}"
+    falhas = []
+    tempos = []
+    anterior = Singleton._instances.pop(GerenciadorJobs, None)
+    gerenciadores = []
+    try:
+        for _ in range(2):
+            gerenciadores.append(GerenciadorJobs(jobs_url))
+            Singleton._instances.pop(GerenciadorJobs, None)
+        envio, concorrente = gerenciadores
+        for _ in range(ctx.repeticoes):
+            sufixo = f"job{next(ctx.chamadas)}c"
+            matriz = matriz_users([None] * quantidade, ctx.rnd, sufixo)
+            inicio = time.perf_counter()
+            id = envio.enviar("users", matriz, tamanho_lote)["id"]
+            concorrente.retomar()
+            job = _aguardar_job(envio, id)
+            tempos.append(time.perf_counter() - inicio)
+            falhas.extend(_verificar_job(ctx, id, job, sufixo, quantidade))
+    finally:
+        for jobs in gerenciadores:
+            _encerrar_gerenciador(jobs)
+        if anterior is not None:
+            Singleton._instances[GerenciadorJobs] = anterior
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    for falha in falhas:
+        print(f"jobs_concorrentes: {falha}", file=sys.stderr)
+    return [resumir("jobs_concorrentes", ctx.tamanho, tempos, quantidade, {"lotes": 3, "tamanho_lote": tamanho_lote, "falhas": falhas})]
+
+def _aguardar_job(jobs: GerenciadorJobs, id: str, limite_s: float = 600) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    job = jobs.obter(id)
+    while job["estado"] not in ("concluido", "erro") and time.perf_counter() - inicio < limite_s:
+        time.sleep(0.05)
+        job = jobs.obter(id)
+    return job
+
+def _encerrar_gerenciador(jobs: GerenciadorJobs):
+    jobs.encerrar()
+    jobs._engine.dispose()
+
+def _verificar_job(ctx: Contexto, id: str, job: Dict[str, Any], sufixo: str, quantidade: int) -> List[str]:
+    '''
+    Confere um job de inclusões concluído: ids do job iguais às linhas gravadas (e-mails com o sufixo), sem duplicadas e sem marcações restantes.
+    '''
+    falhas = []
+    with ctx.db.engine.connect() as conexao:
+        gravados = conexao.execute(text("SELECT id FROM users WHERE email LIKE :padrao ORDER BY id"), {"padrao": f"%{sufixo}%"}).scalars().all()
+        marcacoes = conexao.execute(text("SELECT COUNT(*) FROM jobs_lotes_gravados WHERE job_id = :id"), {"id": id}).scalar_one()
+    if job is None or job["estado"] != "concluido":
+        falhas.append(f"o job {id} não concluiu: {job and (job['estado'], job['erro'])}")
+    elif sorted(job["ids"][1:]) != gravados:
+        falhas.append(f"os ids do job {id} não correspondem às linhas gravadas")
+    if len(gravados) != quantidade:
+        falhas.append(f"{len(gravados)} linhas gravadas para {quantidade} inclusões no job {id}")
+    if marcacoes:
+        falhas.append(f"{marcacoes} marcações de lote restantes após a conclusão do job {id}")
+    return falhas
+
+def memoria_atualizar(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Pico de memória (tracemalloc) do Db.preparar_atualizacao + gravar_atualizacao por milhão de células da matriz (até 100 mil linhas):
+    reenvio de users existentes com 1% alterados (uma medição por estratégia) e inclusão de users novos.
+    O tempo é medido sem o tracemalloc, o pico vai em extra["pico_mb"] e extra["mb_por_milhao_celulas"] (a matriz recebida não entra).
+    '''
+    quantidade = min(ctx.tamanho, 100_000)
+    existentes = matriz_users_existentes(ctx.db.consultar_base(COLUNAS_USERS, ["users"] * len(COLUNAS_USERS), top=quantidade))
+    posicao_observacao = COLUNAS_USERS.index("observacao")
+    celulas = quantidade * len(COLUNAS_USERS)
+
+    def reenvio() -> List[List[Any]]:
+        chamada = next(ctx.chamadas)
+        for pos in ctx.rnd.sample(range(1, len(existentes)), max(1, quantidade // 100)):
+            existentes[pos][posicao_observacao] = f"memoria {chamada}"
+        return existentes
+
+    def inclusao() -> List[List[Any]]:
+        return matriz_users([None] * quantidade, ctx.rnd, f"m{next(ctx.chamadas)}")
+
+    resultados = []
+    estrategia_original = ctx.db.estrategia_atualizacao
+    try:
+        for cenario, estrategia, montar in (("memoria_atualizar_reenvio_diff", "diff", reenvio), ("memoria_atualizar_reenvio_upsert", "upsert", reenvio), ("memoria_atualizar_inclusao", estrategia_original, inclusao)):
+            ctx.db.estrategia_atualizacao = estrategia
+            def gravar(matriz: List[List[Any]]):
+                ctx.db.gravar_atualizacao(ctx.db.preparar_atualizacao("users", matriz))
+            try:
+                resultado = medir(cenario, ctx.tamanho, lambda repeticao: gravar(montar()), ctx.repeticoes, quantidade)
+                matriz = montar()
+                pico = pico_memoria(lambda: gravar(matriz))
+            except ValueError as e:
+                print(f"{cenario} ignorado: {e}", file=sys.stderr)
+                continue
+            resultado["extra"].update({"celulas": celulas, "pico_mb": round(pico / 2**20, 2), "mb_por_milhao_celulas": round(pico / 2**20 * 1_000_000 / celulas, 2)})
+            resultados.append(resultado)
+    finally:
+        ctx.db.estrategia_atualizacao = estrategia_original
+    return resultados
+
+def conversao_paralela(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Escala da conversão e validação do atualizar (Db.preparar_atualizacao, sem gravar) com 1, 2, 4 e 8 processos, matriz de inclusões com ctx.tamanho linhas.
+    1 processo é a conversão sem o pool. extra["aceleracao"] é o p50 com 1 processo dividido pelo p50 da medição, extra["cpus"] os núcleos da máquina.
+    O ponto de equilíbrio vem de uma segunda medição com LINHAS_EQUILIBRIO linhas: com as duas, o tempo com o pool é separado em
+    custo fixo por chamada (extra["fixo_ms"]) e custo por linha (extra["ms_por_mil_linhas"], a serialização fica nele).
+    extra["linhas_equilibrio"] é o número de linhas a partir do qual o pool é mais rápido que 1 processo, None quando nunca é (custo por linha maior).
+    '''
+    paralela = ctx.db.conversao_paralela
+    processos_original, min_linhas_original = paralela.processos, paralela.min_linhas
+    matriz = matriz_users([None] * ctx.tamanho, ctx.rnd, f"p{next(ctx.chamadas)}")
+    pequena = matriz_users([None] * LINHAS_EQUILIBRIO, ctx.rnd, f"p{next(ctx.chamadas)}")
+    resultados = []
+    try:
+        paralela.min_linhas = 0
+        for processos in PROCESSOS_CONVERSAO:
+            paralela.processos = processos
+            resultado = medir(f"conversao_paralela_{processos}", ctx.tamanho, lambda repeticao: ctx.db.preparar_atualizacao("users", matriz), ctx.repeticoes, ctx.tamanho, extra={"processos": processos, "cpus": os.cpu_count()})
+            if ctx.tamanho > LINHAS_EQUILIBRIO:
+                menor = medir(f"conversao_paralela_{processos}", LINHAS_EQUILIBRIO, lambda repeticao: ctx.db.preparar_atualizacao("users", pequena), max(ctx.repeticoes, 5), LINHAS_EQUILIBRIO)
+                por_linha = (resultado["p50_ms"] - menor["p50_ms"]) / (ctx.tamanho - LINHAS_EQUILIBRIO)
+                resultado["extra"].update({"fixo_ms": round(max(menor["p50_ms"] - por_linha * LINHAS_EQUILIBRIO, 0.0), 3), "ms_por_mil_linhas": round(por_linha * 1000, 3)})
+            resultados.append(resultado)
+    finally:
+        paralela.processos, paralela.min_linhas = processos_original, min_linhas_original
+    for resultado in resultados:
+        resultado["extra"]["aceleracao"] = round(resultados[0]["p50_ms"] / resultado["p50_ms"], 2)
+        if resultado is not resultados[0] and "fixo_ms" in resultado["extra"]:
+            serial = resultados[0]["extra"]["ms_por_mil_linhas"]
+            paralelo = resultado["extra"]["ms_por_mil_linhas"]
+            resultado["extra"]["linhas_equilibrio"] = round(resultado["extra"]["fixo_ms"] * 1000 / (serial - paralelo)) if serial > paralelo else None
+    return resultados
+
+def atualizar_escala(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Crescimento do Excel.atualizar com o tamanho da matriz (1 mil até 1 milhão de linhas, limitado ao tamanho da tabela):
+    80% inclusões, 10% exclusões ("D") de ids inexistentes e 10% linhas sem ação, além da remontagem dos ids (intercalar_ids) isolada.
+    Cada série recebe extra["linear"]: tempo por linha do maior tamanho até LIMITE_LINEAR vezes o do menor (o __main__ falha se não for).
+    '''
+    resultados = []
+    repeticoes = min(ctx.repeticoes, 3)
+    series = {"atualizar_escala": [], "atualizar_escala_ids": []}
+    for quantidade in ESCALAS:
+        #Remontagem isolada em todos os tamanhos, é barata e é onde um custo quadrático aparece primeiro
+        origens = [["A", "A", "A", "A", "A", "A", "A", "A", "D", ""][i % 10] for i in range(quantidade)]
+        novos_ids = list(range(origens.count("A")))
+        series["atualizar_escala_ids"].append(medir("atualizar_escala_ids", quantidade, lambda repeticao: intercalar_ids(origens, {"A": novos_ids}), repeticoes, quantidade))
+        if quantidade > ctx.tamanho:
+            continue
+
+        def operacao(repeticao: int):
+            chamada = next(ctx.chamadas)
+            matriz = matriz_users([None] * quantidade, ctx.rnd, f"e{chamada}", origens)
+            for pos, acao in enumerate(origens, 1):
+                if acao == "D":
+                    matriz[pos][0] = -pos
+            ctx.excel.atualizar("users", matriz)
+        series["atualizar_escala"].append(medir("atualizar_escala", quantidade, operacao, repeticoes, quantidade))
+
+    for serie in series.values():
+        if not serie:
+            continue
+        por_linha = [r["p50_ms"] / r["tamanho"] for r in serie]
+        razao = por_linha[-1] / por_linha[0]
+        serie[-1]["extra"].update({"razao_por_linha": round(razao, 3), "linear": razao <= LIMITE_LINEAR})
+        if razao > LIMITE_LINEAR:
+            print(f"{serie[-1]['cenario']}: tempo por linha cresceu {razao:.1f}x de {serie[0]['tamanho']} para {serie[-1]['tamanho']} linhas", file=sys.stderr)
+        resultados.extend(serie)
+    return resultados
+
+def atualizar_misto(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Metade alterações, um quarto inclusões e um quarto exclusões ("D") na mesma matriz.
+    As exclusões usam faixas da metade superior dos ids, sem repetir entre as chamadas.
+    '''
+    quarto = max(1, ctx.lote // 4)
+    def operacao(repeticao: int):
+        chamada = next(ctx.chamadas)
+        alterar = ctx.ids_existentes(ctx.lote - 2 * quarto, ctx.tamanho // 2)
+        inicio_excluir = ctx.tamanho // 2 + 1 + (chamada * quarto) % max(1, ctx.tamanho // 2 - quarto)
+        excluir = list(range(inicio_excluir, inicio_excluir + quarto))
+        ids = alterar + [None] * quarto + excluir
+        acoes = ["A"] * (len(alterar) + quarto) + ["D"] * quarto
+        ctx.excel.atualizar("users", matriz_users(ids, ctx.rnd, f"m{chamada}", acoes))
+    return [medir("atualizar_misto", ctx.tamanho, operacao, ctx.repeticoes, ctx.lote)]
+
+def atualizar_ordens_compra(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    OrdensCompra tem chave texto sem autoincremento, metade das POs já existe e metade é nova.
+    '''
+    def operacao(repeticao: int):
+        inicio = ctx.tamanho + 1 - ctx.lote // 2 + next(ctx.chamadas) * ctx.lote
+        ctx.excel.atualizar("OrdensCompra", matriz_ordens_compra(inicio, ctx.lote, ctx.rnd))
+    return [medir("atualizar_ordens_compra", ctx.tamanho, operacao, ctx.repeticoes, ctx.lote)]
+
+def remover(ctx: Contexto) -> List[ResultadoDict]:
+    contador = itertools.count()
+    def operacao(repeticao: int):
+        inicio = 1 + next(contador) * ctx.lote
+        ctx.db.remover("orders", list(range(inicio, inicio + ctx.lote)))
+    return [medir("remover", ctx.tamanho, operacao, ctx.repeticoes, ctx.lote)]
+
+#Pesquisar
+def _pesquisa_tabela(repeticao: int) -> Dict[str, Any]:
+    return {
+        "colunas": [["id", "name", "email", "idade", "uf", "salario", "data_nascimento"]],
+        "tabelas": [["users"] * 7],
+        "criterios": [["uf", "idade"], [UF_LIST[repeticao % len(UF_LIST)], f">{40 + repeticao % 30}"]],
+        "criterios_tabelas": [["users", "users"]],
+    }
+
+def _pesquisa_relacoes(repeticao: int) -> Dict[str, Any]:
+    return {
+        "colunas": [["id", "name", "uf", "product", "quantity", "price", "status"]],
+        "tabelas": [["users", "users", "users", "orders", "orders", "orders", "orders"]],
+        "criterios": [["status", "quantity", "idade"], [STATUS[repeticao % len(STATUS)], "<3", f">{50 + repeticao % 20}"]],
+        "criterios_tabelas": [["orders", "orders", "users"]],
+        "relacoes": [["orders", "users", "user_id", "id", "inner"]],
+    }
+
+def _pesquisa_curinga(repeticao: int) -> Dict[str, Any]:
+    return {
+        "colunas": [["id", "name", "email"]],
+        "tabelas": [["users"] * 3],
+        "criterios": [["name"], [f"*{1000 + (repeticao * 37) % 9000}*"]],
+        "criterios_tabelas": [["users"]],
+    }
+
+def _pesquisa_agregacao(repeticao: int) -> Dict[str, Any]:
+    #Resumo por produto/status dos pedidos (o que antes exigia trazer a tabela inteira para a tabela dinâmica)
+    return {
+        "colunas": [["product", "status", "id", "quantity", "price", "price"]],
+        "tabelas": [["orders"] * 6],
+        "criterios": [["quantity"], [f">{repeticao % 3}"]],
+        "agregacoes": [["", "", "contar", "soma", "media", "maximo"]],
+        "ordenacao": [["", "", "", "desc", "", ""]],
+        "top": 100,
+    }
+
+def _pesquisa_lista(repeticao: int, quantidade: int = 1000) -> Dict[str, Any]:
+    #Lista de 1.000 ids colada em uma célula ("1;2;3;..."), comum ao filtrar pelos ids de outra planilha
+    inicio = 1 + repeticao * quantidade
+    return {
+        "colunas": [["id", "name", "email", "uf"]],
+        "tabelas": [["users"] * 4],
+        "criterios": [["id"], [";".join(str(i) for i in range(inicio, inicio + quantidade))]],
+        "criterios_tabelas": [["users"]],
+    }
+
+def _medir_pesquisa(ctx: Contexto, cenario: str, montar: Callable[[int], Dict[str, Any]], pesquisar: Callable[..., int] = None) -> ResultadoDict:
+    '''
+    Mede uma pesquisa, pesquisar(**parametros) deve devolver a quantidade de linhas lidas (padrão: Excel.pesquisar).
+    A vazão em linhas é calculada com a quantidade real de linhas devolvidas.
+    '''
+    pesquisar = pesquisar or (lambda **parametros: len(ctx.excel.pesquisar(**parametros)))
+    linhas = []
+    def operacao(repeticao: int):
+        quantidade = pesquisar(**montar(repeticao))
+        if repeticao >= 0:
+            linhas.append(quantidade)
+    resultado = medir(cenario, ctx.tamanho, operacao, ctx.repeticoes)
+    resultado["linhas_por_repeticao"] = round(sum(linhas) / len(linhas)) if linhas else 0
+    resultado["vazao_linhas_s"] = round(sum(linhas) / resultado["total_s"], 2) if resultado["total_s"] else 0.0
+    return resultado
+
+def pesquisar_tabela(ctx: Contexto) -> List[ResultadoDict]:
+    return [_medir_pesquisa(ctx, "pesquisar_tabela", _pesquisa_tabela)]
+
+def pesquisar_relacoes(ctx: Contexto) -> List[ResultadoDict]:
+    return [_medir_pesquisa(ctx, "pesquisar_relacoes", _pesquisa_relacoes)]
+
+def pesquisar_curinga(ctx: Contexto) -> List[ResultadoDict]:
+    return [_medir_pesquisa(ctx, "pesquisar_curinga", _pesquisa_curinga)]
+
+def pesquisar_lista(ctx: Contexto) -> List[ResultadoDict]:
+    return [_medir_pesquisa(ctx, "pesquisar_lista", _pesquisa_lista)]
+
+def pesquisar_agregacao(ctx: Contexto) -> List[ResultadoDict]:
+    return [_medir_pesquisa(ctx, "pesquisar_agregacao", _pesquisa_agregacao)]
+
+def pesquisar_pagina(ctx: Contexto) -> List[ResultadoDict]:
+    pesquisar = lambda **parametros: len(ctx.excel.pesquisar_pagina(**parametros, limite=ctx.lote)["dados"])
+    return [_medir_pesquisa(ctx, "pesquisar_pagina", _pesquisa_tabela, pesquisar)]
+
+def pesquisar_stream(ctx: Contexto) -> List[ResultadoDict]:
+    pesquisar = lambda **parametros: sum(1 for _ in ctx.excel.pesquisar_stream(**parametros))
+    return [_medir_pesquisa(ctx, "pesquisar_stream", _pesquisa_tabela, pesquisar)]
+
+# Itens por lote do Db.iterar no stream_thread (pequeno para a leitura passar por vários lotes)
+LOTE_STREAM_THREAD = 10
+
+def _verificar_iterar(ctx: Contexto, repeticao: int) -> List[str]:
+    '''
+    Db.iterar sobre o Excel.pesquisar_stream: consumo completo, abandono no meio e erro de leitura. Devolve as falhas.
+    '''
+    falhas = []
+    parametros = _pesquisa_tabela(repeticao)
+    total = sum(1 for _ in ctx.excel.pesquisar_stream(**parametros))
+
+    def rastreado(threads: List[int], fechamento: List[int], erro: bool = False):
+        #Linhas do stream com a thread de cada linha e a do fechamento (onde a sessão do gerador é fechada)
+        try:
+            for linha in ctx.excel.pesquisar_stream(**parametros):
+                threads.append(threading.get_ident())
+                yield linha
+            if erro:
+                raise LookupError("erro de leitura")
+        finally:
+            fechamento.append(threading.get_ident())
+
+    async def consumir(iterador, limite: int = None) -> int:
+        quantidade = 0
+        itens = ctx.db.iterar(iterador, tamanho_lote=LOTE_STREAM_THREAD)
+        try:
+            async for _ in itens:
+                quantidade += 1
+                if limite is not None and quantidade >= limite:
+                    break
+        finally:
+            await itens.aclose()
+        return quantidade
+
+    for caso, limite in (("completo", None), ("abandonado", LOTE_STREAM_THREAD + 1)):
+        threads, fechamento = [], []
+        quantidade = anyio.run(consumir, rastreado(threads, fechamento), limite)
+        #No abandono o fechamento é enviado para a thread do iterador sem esperar
+        prazo = time.monotonic() + 10
+        while not fechamento and time.monotonic() < prazo:
+            time.sleep(0.01)
+        esperado = total if limite is None else min(limite, total)
+        if quantidade != esperado:
+            falhas.append(f"{caso}: {quantidade} linhas, esperado {esperado}")
+        usadas = set(threads + fechamento)
+        if len(usadas) != 1 or threading.get_ident() in usadas:
+            falhas.append(f"{caso}: o gerador passou por {len(usadas)} threads (incluindo a do event loop: {threading.get_ident() in usadas}), esperado uma thread própria")
+        if len(fechamento) != 1:
+            falhas.append(f"{caso}: o gerador foi fechado {len(fechamento)} vezes")
+    try:
+        anyio.run(consumir, rastreado([], [], erro=True))
+        falhas.append("erro de leitura não chegou ao consumidor")
+    except LookupError:
+        pass
+    except Exception as e:
+        falhas.append(f"erro de leitura chegou como {type(e).__name__}, esperado LookupError")
+    return falhas
+
+def stream_thread(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Verificação do Db.iterar (usado nas respostas em streaming): o gerador do pesquisar_stream e a sua sessão ficam em uma única thread,
+    inclusive o fechamento ao abandonar a iteração, e o erro da leitura chega ao consumidor com o tipo original.
+    extra["falhas"] lista as verificações que falharam (o __main__ falha se houver).
+    '''
+    falhas = []
+    def operacao(repeticao: int):
+        falhas.extend(_verificar_iterar(ctx, max(repeticao, 0)))
+    resultado = medir("stream_thread", ctx.tamanho, operacao, ctx.repeticoes, aquecimento=0, extra={"falhas": falhas})
+    for falha in dict.fromkeys(falhas):
+        print(f"stream_thread: {falha}", file=sys.stderr)
+    return [resultado]
+
+# Linhas da tabela dos critérios_operadores (id, nome, uf, idade): uf com texto vazio e nulo, idade nula
+PESSOAS_CRITERIOS = [
+    (1, "Ana", "SP", 30),
+    (2, "Bruno", "RJ", 45),
+    (3, "Carla", "", 22),
+    (4, "Daniel", None, 60),
+    (5, "Silvana", "MG", None),
+    (6, "Marcos", "SP", 18),
+]
+
+# Critérios (cabeçalho e linhas) e ids esperados de cada caso do criterios_operadores
+CASOS_CRITERIOS = [
+    ([["uf"], ["SP"]], {1, 6}),
+    ([["uf"], ["=SP"]], {1, 6}),
+    ([["uf"], ["SP;RJ"]], {1, 2, 6}),
+    ([["uf"], [" SP ; RJ ;"]], {1, 2, 6}),
+    ([["idade"], [">30"]], {2, 4}),
+    ([["idade"], [">=30"]], {1, 2, 4}),
+    ([["idade"], ["<30"]], {3, 6}),
+    ([["idade"], ["<=30"]], {1, 3, 6}),
+    ([["uf"], ["<>SP"]], {2, 3, 5}),
+    ([["uf"], ["!=SP"]], {2, 3, 5}),
+    ([["uf"], ["="]], {3, 4}),
+    ([["uf"], ["<>"]], {1, 2, 5, 6}),
+    ([["uf"], ["!="]], {1, 2, 5, 6}),
+    ([["uf"], [""]], {1, 2, 3, 4, 5, 6}),
+    ([["idade"], ["="]], {5}),
+    ([["idade"], ["<>"]], {1, 2, 3, 4, 6}),
+    ([["idade"], ["= ;45"]], {2, 5}),
+    ([["idade"], ["*"]], {1, 2, 3, 4, 6}),
+    ([["nome"], ["*ar*"]], {3, 6}),
+    ([["nome"], ["*a"]], {1, 3, 5}),
+    ([["nome"], ["da*"]], {4}),
+    ([["nome"], [">=*an*"]], {1, 4, 5}),
+    ([["idade"], ["<20;>50"]], {4, 6}),
+    ([["idade"], ["<20;45;60"]], {2, 4, 6}),
+    ([["idade", "idade"], [">=20", "<=45"]], {1, 2, 3}),
+    ([["idade", "idade"], ["<=45", ">=20"]], {1, 2, 3}),
+    ([["idade", "idade", "uf"], [">=20", "<=45", "SP"]], {1}),
+    ([["uf", "idade"], ["SP", ">20"], ["RJ", ""]], {1, 2}),
+    ([["id"], ["1;2;3;4;5"]], {1, 2, 3, 4, 5}),
+]
+
+# Resultado esperado de analisar_celula (operador e valor de cada item do OU)
+CELULAS_CRITERIOS = {
+    "SP": (("", "SP"),),
+    "SP;RJ": (("", "SP"), ("", "RJ")),
+    "=10": (("=", "10"),),
+    ">10": ((">", "10"),),
+    ">=10": ((">=", "10"),),
+    "<10": (("<", "10"),),
+    "<=10": (("<=", "10"),),
+    "<>10": (("!=", "10"),),
+    "!=10": (("!=", "10"),),
+    ">=10;<5": ((">=", "10"), ("<", "5")),
+    "*silva*": (("**", "silva"),),
+    "*silva": (("*-", "silva"),),
+    "silva*": (("-*", "silva"),),
+    "=*silva": (("*-", "silva"),),
+    "<>": (("!=", ""),),
+}
+
+# Valores por bloco do IN no criterios_operadores (força a divisão em blocos)
+LIMITE_IN_CRITERIOS = 2
+
+def _verificar_criterios(engine: Any, tabela: Table) -> List[str]:
+    '''
+    Executa os CASOS_CRITERIOS (análise, compilação e select) e confere os ids e a forma gerada. Devolve as falhas.
+    '''
+    falhas = []
+    for celula, esperado in CELULAS_CRITERIOS.items():
+        obtido = criterios_sql.analisar_celula(celula)
+        if obtido != esperado:
+            falhas.append(f"analisar_celula({celula!r}) = {obtido}, esperado {esperado}")
+
+    conversor = lambda _, coluna: conversor_para_tipo(tabela.c[coluna].type)
+    with engine.connect() as conexao:
+        for criterios, esperado in CASOS_CRITERIOS:
+            forma, valores = criterios_sql.analisar(criterios, ["pessoas"] * len(criterios[0]), conversor, lambda _: LIMITE_IN_CRITERIOS)
+            condicoes = criterios_sql.compilar(forma, lambda _, coluna: tabela.c[coluna])
+            stmt = select(tabela.c.id)
+            if condicoes:
+                stmt = stmt.where(or_(*condicoes))
+            obtido = set(conexao.execute(stmt, {f"criterio_{i}": valor for i, valor in enumerate(valores)}).scalars())
+            if obtido != esperado:
+                falhas.append(f"{criterios[1:]}: ids {sorted(obtido)}, esperado {sorted(esperado)}")
+
+    #Forma: OU vira IN (antes dos demais predicados, com os valores na mesma ordem), vazio marca o predicado, >= e <= viram BETWEEN, IN em blocos
+    conversor_idade = lambda *_: conversor_para_tipo(tabela.c.idade.type)
+    forma, valores = criterios_sql.analisar([["idade"], ["<20;45;60"]], ["pessoas"], conversor_idade, lambda _: 10)
+    if [p.operador for p in forma[0][0]] != ["in", "<"] or valores != [[45, 60], 20]:
+        falhas.append(f"'<20;45;60' gerou {forma} {valores}, esperado IN (45, 60) antes de < 20")
+    forma, _ = criterios_sql.analisar([["uf", "uf", "uf"], ["=", "<>", "SP"]], ["pessoas"] * 3, conversor, lambda _: 10)
+    if [(p.operador, p.vazio) for celula in forma[0] for p in celula] != [("=", True), ("!=", True), ("=", False)]:
+        falhas.append(f"'=', '<>' e 'SP' geraram {forma}, esperado = e != com vazio e = sem vazio")
+    forma, valores = criterios_sql.analisar([["idade", "uf", "idade"], [">=20", "SP", "<=45"]], ["pessoas"] * 3, conversor, lambda _: 10)
+    if [p.operador for celula in forma[0] for p in celula] != ["between", "="] or valores != [20, 45, "SP"]:
+        falhas.append(f"'>=20' e '<=45' geraram {forma} {valores}, esperado BETWEEN 20 AND 45")
+    forma, valores = criterios_sql.analisar([["id"], ["1;2;3;4;5"]], ["pessoas"], conversor, lambda _: LIMITE_IN_CRITERIOS)
+    if forma[0][0][0].blocos != 3 or valores != [[1, 2], [3, 4], [5]]:
+        falhas.append(f"IN de 5 valores com limite {LIMITE_IN_CRITERIOS} gerou {forma} {valores}, esperado 3 blocos")
+
+    #Comparações com vazio consideram o nulo
+    sql = lambda criterios: str(or_(*criterios_sql.compilar(criterios_sql.analisar(criterios, ["pessoas"] * len(criterios[0]), conversor, lambda _: 10)[0], lambda _, coluna: tabela.c[coluna])))
+    if "IS NULL" not in sql([["uf"], ["="]]):
+        falhas.append("'=' vazio não gerou IS NULL")
+    for operador in ("<>", "!="):
+        if "IS NOT NULL" not in sql([["uf"], [operador]]):
+            falhas.append(f"'{operador}' vazio não gerou IS NOT NULL")
+    #Coluna que não é texto: o vazio é convertido para None e compara só com o nulo
+    forma, valores = criterios_sql.analisar([["idade", "idade"], ["=", "<>"]], ["pessoas"] * 2, conversor, lambda _: 10)
+    if [p.operador for celula in forma[0] for p in celula] != ["nulo", "nao_nulo"] or valores:
+        falhas.append(f"'=' e '<>' vazios em coluna inteira geraram {forma} {valores}, esperado IS NULL e IS NOT NULL sem parâmetros")
+    if "BETWEEN" not in sql([["idade", "idade"], [">=20", "<=45"]]):
+        falhas.append("'>=20' e '<=45' não geraram BETWEEN")
+    return falhas
+
+def criterios_operadores(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Verificação dos operadores dos critérios (classes/criterios.py) em uma tabela pequena em memória, independente da base do benchmark.
+    Mede cada rodada de análise, compilação e select dos CASOS_CRITERIOS, extra["falhas"] lista as verificações que falharam (o __main__ falha se houver).
+    '''
+    metadata = MetaData()
+    tabela = Table("pessoas", metadata, Column("id", Integer, primary_key=True), Column("nome", String(50)), Column("uf", String(2)), Column("idade", Integer))
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(tabela.insert(), [dict(zip(("id", "nome", "uf", "idade"), linha)) for linha in PESSOAS_CRITERIOS])
+
+    falhas = []
+    def operacao(repeticao: int):
+        falhas[:] = _verificar_criterios(engine, tabela)
+    resultado = medir("criterios_operadores", ctx.tamanho, operacao, ctx.repeticoes, len(CASOS_CRITERIOS), extra={"casos": len(CASOS_CRITERIOS), "falhas": falhas})
+    engine.dispose()
+    for falha in falhas:
+        print(f"criterios_operadores: {falha}", file=sys.stderr)
+    return [resultado]
+
+# Linhas e padrões do busca_vacuum
+LINHAS_BUSCA_VACUUM = 5_000
+PADROES_BUSCA_VACUUM = ("%00123%", "%0001%", "%Novo%", "%4999%", "%Cliente 00002%")
+
+def _verificar_busca(engine: Any, tabela: Table, indice: IndiceTexto) -> List[str]:
+    #Cada padrão pelo índice deve trazer as mesmas chaves do LIKE direto na tabela
+    falhas = []
+    with engine.connect() as conexao:
+        for padrao in PADROES_BUSCA_VACUUM:
+            esperado = set(conexao.execute(select(tabela.c.po).where(tabela.c.cliente.like(padrao))).scalars())
+            obtido = set(conexao.execute(select(tabela.c.po).where(indice.condicao(tabela, "cliente", padrao))).scalars())
+            if obtido != esperado:
+                falhas.append(f"{padrao}: índice {sorted(obtido)[:5]} ({len(obtido)}), tabela {sorted(esperado)[:5]} ({len(esperado)})")
+    return falhas
+
+def busca_vacuum(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Verificação do índice de texto (classes/busca.py) em uma tabela de chave texto, como OrdensCompra, após VACUUM.
+    Metade das linhas é removida antes do VACUUM (que pode renumerar o rowid implícito), depois a tabela é restaurada como de um .dump
+    (rowid renumerado sem passar pelos triggers) e há alterações, exclusões e inclusões.
+    Mede as buscas por curinga, extra["falhas"] lista os padrões em que o índice diverge do LIKE na tabela (o __main__ falha se houver).
+    '''
+    metadata = MetaData()
+    tabela = Table("ordens", metadata, Column("po", String(20), primary_key=True, autoincrement=False), Column("cliente", String(50), info={"busca_texto": True}))
+    pasta = tempfile.mkdtemp(prefix="benchmark_busca_")
+    engine = create_engine(f"sqlite:///{os.path.join(pasta, 'busca.db')}")
+    falhas = []
+    try:
+        metadata.create_all(engine)
+        indice = IndiceTexto(engine, SimpleNamespace(metadata=metadata))
+        indice.criar()
+        if not indice.possui("ordens", "cliente"):
+            print("busca_vacuum ignorado: SQLite sem FTS5 com trigram", file=sys.stderr)
+            return []
+        with engine.begin() as conexao:
+            conexao.execute(tabela.insert(), [{"po": f"PO{i}", "cliente": f"Cliente {i:05d}"} for i in range(1, LINHAS_BUSCA_VACUUM + 1)])
+            conexao.execute(tabela.delete().where(text("CAST(substr(po, 3) AS INTEGER) % 2 = 0")))
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexao:
+            conexao.exec_driver_sql("VACUUM")
+        falhas.extend(f"após VACUUM {falha}" for falha in _verificar_busca(engine, tabela, indice))
+        #Restauração de um .dump: os dados entram antes dos triggers e o rowid implícito é renumerado (aqui na ordem das POs)
+        with engine.begin() as conexao:
+            gatilhos = conexao.exec_driver_sql("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'ordens'").all()
+            for nome, _ in gatilhos:
+                conexao.exec_driver_sql(f'DROP TRIGGER "{nome}"')
+            conexao.exec_driver_sql("CREATE TEMP TABLE copia_ordens AS SELECT * FROM ordens")
+            conexao.exec_driver_sql("DELETE FROM ordens")
+            conexao.exec_driver_sql("INSERT INTO ordens SELECT * FROM copia_ordens ORDER BY po")
+            conexao.exec_driver_sql("DROP TABLE copia_ordens")
+            for _, sql in gatilhos:
+                conexao.exec_driver_sql(sql)
+        falhas.extend(f"após restaurar {falha}" for falha in _verificar_busca(engine, tabela, indice))
+        #Gravações depois do VACUUM passam pelos triggers com as linhas já renumeradas
+        with engine.begin() as conexao:
+            conexao.execute(tabela.update().where(tabela.c.po.in_(["PO1", "PO1231", "PO4999"])).values(cliente="Novo Cliente"))
+            conexao.execute(tabela.delete().where(tabela.c.po.in_(["PO11", "PO123"])))
+            conexao.execute(tabela.insert(), [{"po": "PO2", "cliente": "Cliente 00002 Novo"}])
+        falhas.extend(f"após gravar {falha}" for falha in _verificar_busca(engine, tabela, indice))
+        def operacao(repeticao: int):
+            with engine.connect() as conexao:
+                for padrao in PADROES_BUSCA_VACUUM:
+                    conexao.execute(select(tabela.c.po).where(indice.condicao(tabela, "cliente", padrao))).all()
+        resultado = medir("busca_vacuum", ctx.tamanho, operacao, ctx.repeticoes, len(PADROES_BUSCA_VACUUM), extra={"falhas": falhas})
+    finally:
+        engine.dispose()
+        shutil.rmtree(pasta, ignore_errors=True)
+    for falha in falhas:
+        print(f"busca_vacuum: {falha}", file=sys.stderr)
+    return [resultado]
+
+#Formatos de resposta do pesquisar
+def formatos(ctx: Contexto) -> List[ResultadoDict]:
+    '''
+    Tempo de codificação e bytes gerados por formato/compressão, sobre o mesmo resultado já lido da base.
+    json_padrao é a resposta padrão da rota (jsonable_encoder + JSON), referência para os demais.
+    '''
+    from fastapi.encoders import jsonable_encoder
+    from app.api.excel.classes import formatos as fmt
+
+    pesquisa = _pesquisa_relacoes(0)
+    del pesquisa["criterios"], pesquisa["criterios_tabelas"]
+    linhas = ctx.excel.pesquisar(**pesquisa)
+    nomes = pesquisa["colunas"][0]
+    tipos = ctx.excel.tipos_colunas(pesquisa["colunas"], pesquisa["tabelas"])
+
+    resultados = []
+    tamanhos = []
+    def json_padrao(repeticao: int):
+        tamanhos.append(len(json.dumps(jsonable_encoder(linhas), ensure_ascii=False).encode("utf-8")))
+    resultado = medir("formato_json_padrao", ctx.tamanho, json_padrao, ctx.repeticoes, len(linhas))
+    resultado["extra"]["bytes"] = tamanhos[-1]
+    resultados.append(resultado)
+
+    for formato in fmt.TIPOS_MIDIA:
+        for compressao in (None, "gzip", "zstd"):
+            try:
+                fmt.resolver_formato(formato)
+                if compressao:
+                    fmt.resolver_compressao(compressao)
+            except ValueError as e:
+                print(f"formato {formato}/{compressao} ignorado: {e}", file=sys.stderr)
+                continue
+            tamanhos = []
+            def codificar(repeticao: int):
+                tamanhos.append(sum(len(pedaco) for pedaco in fmt.codificar(formato, nomes, tipos, iter(linhas), compressao)))
+            cenario = f"formato_{formato}" + (f"_{compressao}" if compressao else "")
+            resultado = medir(cenario, ctx.tamanho, codificar, ctx.repeticoes, len(linhas), extra={"formato": formato, "compressao": compressao})
+            resultado["extra"]["bytes"] = tamanhos[-1]
+            resultados.append(resultado)
+    return resultados
+
+#Rotas HTTP (cliente em processo, precisa do httpx instalado)
+def rotas(ctx: Contexto) -> List[ResultadoDict]:
+    try:
+        from fastapi.testclient import TestClient
+    except Exception as e:
+        print(f"Rotas ignoradas (instale o httpx para medir as rotas): {e}", file=sys.stderr)
+        return []
+    from app.main import app
+    import os
+
+    cabecalhos = {"Authorization": f"Bearer {os.environ['EXCEL_TOKEN']}"}
+    resultados = []
+    with TestClient(app) as cliente:
+        def requisitar(metodo: str, caminho: str, **kwargs):
+            resposta = cliente.request(metodo, caminho, headers=cabecalhos, **kwargs)
+            resposta.raise_for_status()
+            corpo = resposta.json() if resposta.headers.get("content-type", "").startswith("application/json") else None
+            if isinstance(corpo, dict) and "error" in corpo:
+                raise ValueError(f"{caminho}: {corpo['error']}")
+            return resposta
+
+        medicoes = [
+            ("rota_obter_cabecalhos", lambda r: requisitar("GET", "/api/excel/obter_cabecalhos/", params={"tabelas": "users;orders;OrdensCompra"}), 1),
+            ("rota_obter_estrutura", lambda r: requisitar("GET", "/api/excel/obter_estrutura/"), 1),
+            ("rota_pesquisar", lambda r: requisitar("POST", "/api/excel/pesquisar/", json=_pesquisa_tabela(r)), 1),
+            ("rota_pesquisar_stream", lambda r: requisitar("POST", "/api/excel/pesquisar/stream", json=_pesquisa_tabela(r)), 1),
+            ("rota_atualizar", lambda r: requisitar("POST", "/api/excel/atualizar/", json={"tabela": "users", "matriz": matriz_users(ctx.ids_existentes(ctx.lote, ctx.tamanho // 2), ctx.rnd, f"h{next(ctx.chamadas)}")}), ctx.lote),
+        ]
+        for cenario, operacao, linhas in medicoes:
+            resultados.append(medir(cenario, ctx.tamanho, operacao, ctx.repeticoes, linhas))
+
+        #Mesma pesquisa disparada por várias threads ao mesmo tempo
+        def cronometrar(repeticao: int) -> float:
+            inicio = time.perf_counter()
+            requisitar("POST", "/api/excel/pesquisar/", json=_pesquisa_tabela(repeticao))
+            return time.perf_counter() - inicio
+        total_requisicoes = ctx.repeticoes * ctx.concorrencia
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=ctx.concorrencia) as executor:
+            tempos = list(executor.map(cronometrar, range(total_requisicoes)))
+        resultados.append(resumir("rota_pesquisar_concorrente", ctx.tamanho, tempos, 1, {"concorrencia": ctx.concorrencia}, total_s=time.perf_counter() - inicio))
+    return resultados
+
+CENARIOS: Dict[str, Callable[[Contexto], List[ResultadoDict]]] = {
+    "pesquisar_tabela": pesquisar_tabela,
+    "pesquisar_relacoes": pesquisar_relacoes,
+    "pesquisar_curinga": pesquisar_curinga,
+    "pesquisar_lista": pesquisar_lista,
+    "pesquisar_agregacao": pesquisar_agregacao,
+    "pesquisar_pagina": pesquisar_pagina,
+    "pesquisar_stream": pesquisar_stream,
+    "stream_thread": stream_thread,
+    "criterios_operadores": criterios_operadores,
+    "busca_vacuum": busca_vacuum,
+    "formatos": formatos,
+    "rotas": rotas,
+    "atualizar_inclusao": atualizar_inclusao,
+    "atualizar_alteracao": atualizar_alteracao,
+    "atualizar_reenvio": atualizar_reenvio,
+    "atualizar_misto": atualizar_misto,
+    "atualizar_escala": atualizar_escala,
+    "celulas_vazias": celulas_vazias,
+    "validacao_matriz": validacao_matriz,
+    "memoria_atualizar": memoria_atualizar,
+    "jobs_retomada": jobs_retomada,
+    "jobs_concorrentes": jobs_concorrentes,
+    "conversao_paralela": conversao_paralela,
+    "atualizar_ordens_compra": atualizar_ordens_compra,
+    "remover": remover,
+}
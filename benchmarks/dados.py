@@ -0,0 +1,128 @@
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List
+import random
+
+from sqlalchemy import insert
+
+#Imports internos
+from app.api.excel.classes.db import Db
+from app.api.excel.models.users import UF_LIST
+
+'''
+Dados sintéticos para os benchmarks.
+Tudo é gerado a partir de uma semente, então duas execuções com os mesmos parâmetros usam exatamente os mesmos dados.
+'''
+
+PRODUTOS = ["Notebook", "Monitor", "Teclado", "Mouse", "Cadeira", "Mesa", "Headset", "Webcam"]
+STATUS = ["novo", "pago", "enviado", "entregue", "cancelado"]
+MADEIRAS = ["Pinus", "Eucalipto", "Teca", "Cedro", "Ipe"]
+PAISES = ["Brasil", "Chile", "EUA", "China", "Alemanha", "Portugal"]
+DATA_BASE = date(2020, 1, 1)
+
+COLUNAS_USERS = ["id", "name", "email", "idade", "uf", "observacao", "salario", "data_nascimento", "eh_funcionario", "interesses"]
+COLUNAS_ORDERS = ["id", "user_id", "product", "quantity", "price", "order_date", "status"]
+COLUNAS_ORDENS_COMPRA = ["PO", "Delivery_To", "Cliente", "Madeira", "INCO_Terms", "Cond_PGTO", "Destino", "Dias_para_Entrega", "Pais", "Payment_Terms", "Data_da_Ordem", "Pedido_BM"]
+
+def linha_user(i: int, rnd: random.Random, sufixo: str = "") -> List[Any]:
+    return [
+        i,
+        f"Usuario {i}{sufixo}",
+        f"usuario{i}{sufixo}@exemplo.com",
+        rnd.randint(18, 80),
+        UF_LIST[i % len(UF_LIST)],
+        f"Observação {rnd.randint(0, 999)}" if i % 3 else None,
+        round(rnd.uniform(1500, 25000), 2),
+        DATA_BASE - timedelta(days=rnd.randint(6570, 29200)),
+        i % 2 == 0,
+        rnd.sample(PRODUTOS, 2),
+    ]
+
+def linha_order(i: int, rnd: random.Random, tamanho_users: int) -> List[Any]:
+    return [
+        i,
+        rnd.randint(1, tamanho_users),
+        PRODUTOS[i % len(PRODUTOS)],
+        rnd.randint(1, 20),
+        round(rnd.uniform(10, 5000), 2),
+        DATA_BASE + timedelta(days=rnd.randint(0, 1800)),
+        STATUS[i % len(STATUS)],
+    ]
+
+def linha_ordem_compra(i: int, rnd: random.Random) -> List[Any]:
+    return [
+        f"PO{i:08d}",
+        f"Entrega {i % 97}",
+        f"Cliente {i % 500}",
+        MADEIRAS[i % len(MADEIRAS)],
+        rnd.choice(["FOB", "CIF", "EXW"]),
+        rnd.choice(["30 dias", "60 dias", "À vista"]),
+        f"Porto {i % 40}",
+        rnd.randint(5, 120),
+        PAISES[i % len(PAISES)],
+        rnd.choice(["Net 30", "Net 60"]),
+        DATA_BASE + timedelta(days=rnd.randint(0, 1800)),
+        rnd.randint(1, 99999),
+    ]
+
+def _lotes(colunas: List[str], linhas: Iterator[List[Any]], tamanho_lote: int) -> Iterator[List[Dict[str, Any]]]:
+    lote = []
+    for linha in linhas:
+        lote.append(dict(zip(colunas, linha)))
+        if len(lote) >= tamanho_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def popular(db: Db, tamanho: int, semente: int = 42, tamanho_lote: int = 20000):
+    '''
+    Recria as tabelas e insere `tamanho` linhas em users, orders e OrdensCompra.
+    A carga é feita direto pelo engine (insert em lote), sem passar pelo Db.atualizar que é o que se quer medir.
+    '''
+    db.base.metadata.drop_all(db.engine)
+    db.criar_tabelas()
+    rnd = random.Random(semente)
+    tabelas = [
+        ("users", COLUNAS_USERS, (linha_user(i, rnd) for i in range(1, tamanho + 1))),
+        ("orders", COLUNAS_ORDERS, (linha_order(i, rnd, tamanho) for i in range(1, tamanho + 1))),
+        ("OrdensCompra", COLUNAS_ORDENS_COMPRA, (linha_ordem_compra(i, rnd) for i in range(1, tamanho + 1))),
+    ]
+    for tabela, colunas, linhas in tabelas:
+        tabela_sql = db.modelo(tabela)["tabela"]
+        for lote in _lotes(colunas, linhas, tamanho_lote):
+            with db.engine.begin() as conexao:
+                conexao.execute(insert(tabela_sql), lote)
+
+def _para_excel(valor: Any) -> Any:
+    #No Excel as datas chegam como texto, assim os conversores também entram na medição
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+def matriz_users(ids: List[Any], rnd: random.Random, sufixo: str, acoes: List[str] = None) -> List[List[Any]]:
+    '''
+    Matriz no formato do Excel.atualizar (cabeçalho + linhas + coluna MD).
+    ids None geram inclusões, os demais alteram (ou excluem com acao "D") a linha existente.
+    O sufixo mantém o e-mail único entre as repetições.
+    '''
+    matriz = [COLUNAS_USERS + ["MD"]]
+    for pos, id in enumerate(ids):
+        linha = linha_user(id or 0, rnd, f"{sufixo}_{pos}")
+        linha[0] = id
+        matriz.append([_para_excel(valor) for valor in linha] + [acoes[pos] if acoes else "A"])
+    return matriz
+
+def matriz_users_existentes(linhas: List[List[Any]]) -> List[List[Any]]:
+    '''
+    Matriz do Excel.atualizar a partir de linhas de users lidas do banco (colunas COLUNAS_USERS), todas com acao "A".
+    '''
+    return [COLUNAS_USERS + ["MD"]] + [[_para_excel(valor) for valor in linha] + ["A"] for linha in linhas]
+
+def matriz_ordens_compra(inicio: int, quantidade: int, rnd: random.Random) -> List[List[Any]]:
+    '''
+    Matriz do Excel.atualizar para OrdensCompra (chave texto sem autoincremento), linhas de PO{inicio} em diante.
+    '''
+    matriz = [COLUNAS_ORDENS_COMPRA + ["MD"]]
+    for i in range(inicio, inicio + quantidade):
+        matriz.append([_para_excel(valor) for valor in linha_ordem_compra(i, rnd)] + ["A"])
+    return matriz
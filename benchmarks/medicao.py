@@ -0,0 +1,135 @@
+from typing import Any, Callable, Dict, List, Optional, TypedDict
+import json
+import math
+import time
+import tracemalloc
+
+#Tipagem
+class ResultadoDict(TypedDict):
+    cenario: str
+    tamanho: int
+    repeticoes: int
+    linhas_por_repeticao: int
+    total_s: float
+    vazao_linhas_s: float
+    vazao_operacoes_s: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    min_ms: float
+    max_ms: float
+    extra: Dict[str, Any]
+
+class ComparacaoDict(TypedDict):
+    cenario: str
+    tamanho: int
+    metrica: str
+    anterior: float
+    atual: float
+    variacao: float
+    regressao: bool
+
+def percentil(valores: List[float], p: float) -> float:
+    '''
+    Percentil por interpolação linear entre as posições vizinhas (mesmo critério do numpy padrão).
+    '''
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicao = (len(ordenados) - 1) * p / 100
+    inferior = math.floor(posicao)
+    superior = math.ceil(posicao)
+    if inferior == superior:
+        return ordenados[inferior]
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicao - inferior)
+
+def medir(cenario: str, tamanho: int, operacao: Callable[[int], Any], repeticoes: int, linhas_por_repeticao: int = 1, aquecimento: int = 1, extra: Optional[Dict[str, Any]] = None) -> ResultadoDict:
+    '''
+    Executa operacao(repeticao) `aquecimento` vezes sem medir e depois `repeticoes` vezes medindo cada chamada.
+    A operação recebe o número da repetição para poder variar os dados (ids, critérios...) a cada chamada.
+    '''
+    for repeticao in range(aquecimento):
+        operacao(-1 - repeticao)
+
+    tempos = []
+    for repeticao in range(repeticoes):
+        inicio = time.perf_counter()
+        operacao(repeticao)
+        tempos.append(time.perf_counter() - inicio)
+
+    return resumir(cenario, tamanho, tempos, linhas_por_repeticao, extra)
+
+def resumir(cenario: str, tamanho: int, tempos: List[float], linhas_por_repeticao: int = 1, extra: Optional[Dict[str, Any]] = None, total_s: Optional[float] = None) -> ResultadoDict:
+    '''
+    Gera o resultado a partir dos tempos (em segundos) de cada operação.
+    total_s permite informar o tempo de parede quando as operações rodam em paralelo.
+    '''
+    total = total_s if total_s is not None else sum(tempos)
+    tempos_ms = [t * 1000 for t in tempos]
+    return {
+        "cenario": cenario,
+        "tamanho": tamanho,
+        "repeticoes": len(tempos),
+        "linhas_por_repeticao": linhas_por_repeticao,
+        "total_s": round(total, 6),
+        "vazao_linhas_s": round(len(tempos) * linhas_por_repeticao / total, 2) if total else 0.0,
+        "vazao_operacoes_s": round(len(tempos) / total, 2) if total else 0.0,
+        "p50_ms": round(percentil(tempos_ms, 50), 3),
+        "p95_ms": round(percentil(tempos_ms, 95), 3),
+        "p99_ms": round(percentil(tempos_ms, 99), 3),
+        "min_ms": round(min(tempos_ms), 3) if tempos_ms else 0.0,
+        "max_ms": round(max(tempos_ms), 3) if tempos_ms else 0.0,
+        "extra": extra or {},
+    }
+
+def pico_memoria(operacao: Callable[[], Any]) -> int:
+    '''
+    Pico de memória alocada (bytes, tracemalloc) durante operacao(), descontado o que já estava alocado no início.
+    '''
+    tracemalloc.start()
+    try:
+        inicial = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        operacao()
+        return tracemalloc.get_traced_memory()[1] - inicial
+    finally:
+        tracemalloc.stop()
+
+def salvar(caminho: str, ambiente: Dict[str, Any], resultados: List[ResultadoDict]):
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        json.dump({"ambiente": ambiente, "resultados": resultados}, arquivo, indent=2, ensure_ascii=False, default=str)
+
+def comparar(caminho_anterior: str, resultados: List[ResultadoDict], tolerancia: float = 0.10, metricas: List[str] = None) -> List[ComparacaoDict]:
+    '''
+    Compara os resultados atuais com os de uma execução anterior (arquivo gerado por salvar).
+    Uma métrica é regressão quando a latência cresceu mais que a tolerância (0.10 = 10%).
+    '''
+    metricas = metricas or ["p50_ms", "p95_ms", "p99_ms"]
+    with open(caminho_anterior, "r", encoding="utf-8") as arquivo:
+        anteriores = {(r["cenario"], r["tamanho"]): r for r in json.load(arquivo)["resultados"]}
+
+    comparacoes = []
+    for resultado in resultados:
+        anterior = anteriores.get((resultado["cenario"], resultado["tamanho"]))
+        if anterior is None:
+            continue
+        for metrica in metricas:
+            valor_anterior = anterior.get(metrica) or 0.0
+            valor_atual = resultado[metrica]
+            variacao = (valor_atual - valor_anterior) / valor_anterior if valor_anterior else 0.0
+            comparacoes.append({
+                "cenario": resultado["cenario"],
+                "tamanho": resultado["tamanho"],
+                "metrica": metrica,
+                "anterior": valor_anterior,
+                "atual": valor_atual,
+                "variacao": round(variacao, 4),
+                "regressao": variacao > tolerancia,
+            })
+    return comparacoes
+
+def imprimir(resultados: List[ResultadoDict]):
+    print(f"{'cenario':<32} {'tamanho':>9} {'rep':>5} {'linhas/s':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'bytes':>12}")
+    print("-" * 107)
+    for r in resultados:
+        print(f"{r['cenario']:<32} {r['tamanho']:>9} {r['repeticoes']:>5} {r['vazao_linhas_s']:>12.0f} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['extra'].get('bytes', ''):>12}")